@@ -0,0 +1,280 @@
+'''
+Headless engine-vs-engine arena. Plays games between two SmartMoveFinder configurations on a pool of
+worker processes (one game per task, so every core stays busy), streams each finished game to a PGN file
+and reports wins/draws/losses, an Elo difference with a 95% error margin, and the nodes/sec and
+time per move of both engines.
+
+An engine is a comma separated list of settings:
+    depth=N          fixed search depth
+    movetime=S       seconds per move (iterative deepening)
+    name=TEXT        name in the PGN and the report
+    SETTING=VALUE    any SmartMoveFinder setting (e.g. DELTA_MARGIN=3, BATCH_LEAF_EVALUATION=True),
+                     applied only while this engine searches
+Games are played in pairs from the same random opening with colors swapped, so neither engine gets
+the better openings.
+
+Usage:
+    python Arena.py --games 100 --engine1 "depth=3" --engine2 "depth=2"
+    python Arena.py --games 50 --engine1 "movetime=0.2,name=new" --engine2 "movetime=0.2,DELTA_MARGIN=4,name=old" --pgn games.pgn
+'''
+import argparse
+import ast
+import math
+import multiprocessing
+import os
+import random
+import time
+import ChessEngine, SmartMoveFinder, Bitbases
+from TranspositionTable import TranspositionTable
+
+DEFAULT_GAMES = 20
+DEFAULT_RANDOM_PLIES = 4 # random moves from the start position that make up each opening
+MAX_PLIES = 300 # games still running after this many plies are adjudicated as draws
+FIFTY_MOVE_PLIES = 100
+TT_SIZE_MB = 16
+
+'''
+Parses an engine specification into a dict with name, max_depth, move_time and the SmartMoveFinder overrides
+'''
+def parse_engine(spec) :
+    engine = {"name" : spec, "max_depth" : None, "move_time" : None, "overrides" : {}}
+    for setting in filter(None, (part.strip() for part in spec.split(','))) :
+        if '=' not in setting :
+            raise ValueError(f"Engine setting is not name=value: {setting}")
+        key, value = (part.strip() for part in setting.split('=', 1))
+        if key == "name" :
+            engine["name"] = value
+        elif key == "depth" :
+            engine["max_depth"] = int(value)
+        elif key == "movetime" :
+            engine["move_time"] = float(value)
+        elif key.isupper() and hasattr(SmartMoveFinder, key) :
+            engine["overrides"][key] = ast.literal_eval(value)
+        else :
+            raise ValueError(f"Unknown engine setting: {key}")
+    return engine
+
+'''
+One side of a game: its transposition table and history survive from move to move like in a real game,
+its settings are swapped into SmartMoveFinder only while it searches
+'''
+class Player() :
+    def __init__(self, engine) :
+        self.engine = engine
+        self.transposition_table = TranspositionTable(TT_SIZE_MB)
+        self.history_table = {}
+        self.nodes = 0
+        self.search_time = 0.0
+        self.moves = 0
+
+    def find_move(self, gs, valid_moves) :
+        defaults = {key : getattr(SmartMoveFinder, key) for key in self.engine["overrides"]}
+        for key, value in self.engine["overrides"].items() :
+            setattr(SmartMoveFinder, key, value)
+        SmartMoveFinder.transposition_table = self.transposition_table
+        SmartMoveFinder.history_table = self.history_table
+        start_time = time.perf_counter()
+        try :
+            move = SmartMoveFinder.find_best_move(gs, valid_moves, self.engine["max_depth"], self.engine["move_time"])
+        finally :
+            for key, value in defaults.items() :
+                setattr(SmartMoveFinder, key, value)
+        self.search_time += time.perf_counter() - start_time
+        self.nodes += SmartMoveFinder.nodes_searched
+        self.moves += 1
+        return move
+
+'''
+Standard algebraic notation of move, which must be one of valid_moves (check and mate marks are added by the caller)
+'''
+def san_notation(move, valid_moves) :
+    if move.is_castle_move :
+        return "O-O" if move.end_col == 6 else "O-O-O"
+    square = move.get_rank_file(move.end_row, move.end_col)
+    capture = move.piece_captured != '--'
+    piece = move.piece_moved[1]
+    if piece == 'p' :
+        notation = (move.get_rank_file(move.start_row, move.start_col)[0] + 'x' if capture else "") + square
+        return notation + ("=Q" if move.is_pawn_promotion else "")
+    # name the start file, rank or square when another piece of the same kind can go to the same square
+    rivals = [other for other in valid_moves if other.piece_moved == move.piece_moved and other.end_row == move.end_row
+              and other.end_col == move.end_col and other != move]
+    start = move.get_rank_file(move.start_row, move.start_col)
+    if not rivals :
+        disambiguation = ""
+    elif all(other.start_col != move.start_col for other in rivals) :
+        disambiguation = start[0]
+    elif all(other.start_row != move.start_row for other in rivals) :
+        disambiguation = start[1]
+    else :
+        disambiguation = start
+    return piece + disambiguation + ('x' if capture else "") + square
+
+'''
+True when neither side has the material to mate (bare kings, or a lone knight or bishop)
+'''
+def insufficient_material(gs) :
+    if gs.piece_count > 3 :
+        return False
+    return all(piece == '--' or piece[1] in ('K', 'N', 'B') for row in gs.board for piece in row)
+
+'''
+Plays one game in a worker process. task is (game index, engine for white, engine for black, opening seed, random plies)
+Returns a dict with the moves (SAN), the result from white's point of view, the reason and both players' counters
+'''
+def play_game(task) :
+    index, white_engine, black_engine, opening_seed, random_plies = task
+    players = (Player(white_engine), Player(black_engine))
+    gs = ChessEngine.GameState()
+    rng = random.Random(opening_seed)
+    moves = []
+    positions = {gs.zobrist_key : 1}
+    halfmove_clock = 0
+    result, reason = None, None
+    valid_moves = gs.get_valid_moves()
+    while result is None :
+        if not valid_moves :
+            if gs.check_mate :
+                result, reason = ("0-1" if gs.white_to_move else "1-0"), "checkmate"
+            else :
+                result, reason = "1/2-1/2", "stalemate"
+            break
+        if len(moves) < random_plies :
+            move = rng.choice(valid_moves)
+        else :
+            player = players[0 if gs.white_to_move else 1]
+            move = player.find_move(gs, valid_moves) or valid_moves[0]
+        notation = san_notation(move, valid_moves)
+        halfmove_clock = 0 if move.piece_moved[1] == 'p' or move.piece_captured != '--' else halfmove_clock + 1
+        gs.make_move(move)
+        valid_moves = gs.get_valid_moves()
+        if gs.check_mate :
+            notation += '#'
+        elif gs.in_check :
+            notation += '+'
+        moves.append(notation)
+        positions[gs.zobrist_key] = positions.get(gs.zobrist_key, 0) + 1
+        if positions[gs.zobrist_key] >= 3 :
+            result, reason = "1/2-1/2", "threefold repetition"
+        elif halfmove_clock >= FIFTY_MOVE_PLIES and not gs.check_mate :
+            result, reason = "1/2-1/2", "fifty move rule"
+        elif insufficient_material(gs) :
+            result, reason = "1/2-1/2", "insufficient material"
+        elif len(moves) >= MAX_PLIES :
+            result, reason = "1/2-1/2", f"adjudicated after {MAX_PLIES} plies"
+    return {"index" : index, "white" : white_engine["name"], "black" : black_engine["name"], "moves" : moves,
+            "result" : result, "reason" : reason, "engine1_white" : index % 2 == 0,
+            "counters" : [(player.nodes, player.search_time, player.moves) for player in players]}
+
+'''
+Formats a finished game as PGN
+'''
+def game_to_pgn(game, round_number) :
+    tags = [("Event", "Arena"), ("Site", "local"), ("Date", time.strftime("%Y.%m.%d")), ("Round", str(round_number)),
+            ("White", game["white"]), ("Black", game["black"]), ("Result", game["result"]), ("Termination", game["reason"])]
+    lines = [f'[{tag} "{value}"]' for tag, value in tags]
+    text = ""
+    for i, notation in enumerate(game["moves"]) :
+        text += (f"{i // 2 + 1}. " if i % 2 == 0 else "") + notation + " "
+    text += game["result"]
+    # PGN lines are kept under 80 characters
+    movetext_lines = []
+    line = ""
+    for word in text.split() :
+        if line and len(line) + len(word) + 1 > 79 :
+            movetext_lines.append(line)
+            line = word
+        else :
+            line = f"{line} {word}" if line else word
+    movetext_lines.append(line)
+    return "\n".join(lines) + "\n\n" + "\n".join(movetext_lines) + "\n\n"
+
+'''
+Elo difference of a score and its 95% error margin from the per game score variance
+Returns (elo, margin), infinite when one side scored everything
+'''
+def elo_estimate(wins, draws, losses) :
+    games = wins + draws + losses
+    if games == 0 :
+        return 0.0, math.inf
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+    elo = score_to_elo(score)
+    high, low = score_to_elo(min(score + margin, 1.0)), score_to_elo(max(score - margin, 0.0))
+    return elo, (high - low) / 2
+
+def score_to_elo(score) :
+    if score <= 0 :
+        return -math.inf
+    if score >= 1 :
+        return math.inf
+    return -400 * math.log10(1 / score - 1)
+
+'''
+Loads the endgame tables in every worker, so both engines play the simple endings the same way
+'''
+def init_worker() :
+    Bitbases.load()
+
+'''
+Plays the match on a pool of worker processes, writing each game to the PGN file as soon as it finishes
+Returns (wins, draws, losses) from engine1's point of view
+'''
+def run_match(engine1, engine2, games, workers=None, pgn_path=None, random_plies=DEFAULT_RANDOM_PLIES, seed=None) :
+    workers = workers or os.cpu_count() or 1
+    seed = random.randrange(1 << 30) if seed is None else seed
+    # game 2k and 2k + 1 share an opening, engine1 is white in the even games
+    tasks = [(i, engine1 if i % 2 == 0 else engine2, engine2 if i % 2 == 0 else engine1, seed + i // 2, random_plies)
+             for i in range(games)]
+    wins = draws = losses = 0
+    engine_totals = [[0, 0.0, 0], [0, 0.0, 0]] # nodes, search time and moves of engine1 and engine2
+    pgn = open(pgn_path, "a") if pgn_path is not None else None
+    start_time = time.perf_counter()
+    try :
+        with multiprocessing.Pool(workers, initializer=init_worker) as pool :
+            for finished, game in enumerate(pool.imap_unordered(play_game, tasks), 1) :
+                white_score = {"1-0" : 1.0, "0-1" : 0.0}.get(game["result"], 0.5)
+                engine1_score = white_score if game["engine1_white"] else 1 - white_score
+                if engine1_score == 1 :
+                    wins += 1
+                elif engine1_score == 0 :
+                    losses += 1
+                else :
+                    draws += 1
+                counters = game["counters"] if game["engine1_white"] else game["counters"][::-1]
+                for totals, engine_counters in zip(engine_totals, counters) :
+                    for i in range(3) :
+                        totals[i] += engine_counters[i]
+                if pgn is not None :
+                    pgn.write(game_to_pgn(game, game["index"] + 1))
+                    pgn.flush()
+                print(f"game {game['index'] + 1:>3}/{games}  {game['white']} - {game['black']}  {game['result']:<7} "
+                      f"{game['reason']}, {len(game['moves'])} plies   (+{wins} ={draws} -{losses} after {finished})")
+    finally :
+        if pgn is not None :
+            pgn.close()
+    elapsed = time.perf_counter() - start_time
+
+    elo, margin = elo_estimate(wins, draws, losses)
+    print(f"\n{engine1['name']} vs {engine2['name']}: +{wins} ={draws} -{losses}  "
+          f"score {(wins + draws / 2) / max(games, 1):.3f}  Elo {elo:+.1f} +/- {margin:.1f}  ({games} games in {elapsed:.1f}s on {workers} workers)")
+    for engine, (nodes, search_time, moves) in zip((engine1, engine2), engine_totals) :
+        print(f"{engine['name']:<30} {nodes / search_time if search_time > 0 else 0:>8.0f} nps  "
+              f"{search_time / moves if moves else 0:.3f}s per move  ({moves} moves)")
+    return wins, draws, losses
+
+def main() :
+    parser = argparse.ArgumentParser(description="Play games between two engine configurations")
+    parser.add_argument("--engine1", default="depth=3", help="settings of the first engine (see the module docstring)")
+    parser.add_argument("--engine2", default="depth=2", help="settings of the second engine")
+    parser.add_argument("--games", type=int, default=DEFAULT_GAMES)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--pgn", help="PGN file the games are appended to")
+    parser.add_argument("--random-plies", type=int, default=DEFAULT_RANDOM_PLIES, help="random opening moves per game pair")
+    parser.add_argument("--seed", type=int, help="opening seed, for repeatable matches")
+    args = parser.parse_args()
+    run_match(parse_engine(args.engine1), parse_engine(args.engine2), args.games, args.workers, args.pgn, args.random_plies, args.seed)
+
+if __name__ == "__main__" :
+    main()
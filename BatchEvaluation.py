@@ -0,0 +1,117 @@
+'''
+Batched leaf evaluation with NumPy. Scores many positions at once as a dot product of their piece
+placements against the Evaluation tables, for offline analysis and for scoring all the children of a
+depth 1 node together in the search.
+A position is encoded either as 64 piece codes (0 for an empty square, 1-12 for the PIECES below)
+or as 12 one-hot planes of 64 squares. Results match SmartMoveFinder.score_board exactly for positions
+that aren't checkmate or stalemate.
+NumPy is optional - NUMPY_AVAILABLE is False when it isn't installed and the search won't use this module.
+'''
+try :
+    import numpy as np
+except ImportError : # the rest of the engine works without NumPy
+    np = None
+from Evaluation import piece_square_values
+
+NUMPY_AVAILABLE = np is not None
+
+PIECES = ['wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK']
+PIECE_CODES = {piece : i + 1 for i, piece in enumerate(PIECES)}
+PIECE_CODES['--'] = 0
+
+if NUMPY_AVAILABLE :
+    # PLANE_WEIGHTS[plane][square] = piece square value in tenths of a pawn, white positive
+    PLANE_WEIGHTS = np.array([piece_square_values[piece] for piece in PIECES], dtype=np.int32)
+    PLANE_CODES = np.arange(1, len(PIECES) + 1, dtype=np.int8).reshape(1, len(PIECES), 1)
+    # CODE_WEIGHTS[code][square], the same values with a row of zeros for empty squares, so codes index it directly
+    CODE_WEIGHTS = np.vstack((np.zeros((1, 64), dtype=np.int32), PLANE_WEIGHTS))
+    SQUARES = np.arange(64)
+
+def check_numpy() :
+    if not NUMPY_AVAILABLE :
+        raise ImportError("BatchEvaluation needs NumPy (pip install numpy)")
+
+'''
+Encodes a 2d board as 64 int8 piece codes, written into out if given
+'''
+def encode_board(board, out=None) :
+    check_numpy()
+    if out is None :
+        out = np.empty(64, dtype=np.int8)
+    out[:] = [PIECE_CODES[piece] for row in board for piece in row]
+    return out
+
+'''
+Encodes the position after each move as an (N, 64) int8 array of piece codes without playing the moves:
+every row starts as the parent's codes, then the moved piece goes from its start square to its end square
+(squares are numbered row * 8 + col, like move_id). Promotions, en passant and castling get their extra squares
+The moves need their pieces, which the move generators fill in
+'''
+def encode_children(parent_codes, moves) :
+    check_numpy()
+    count = len(moves)
+    codes = np.repeat(parent_codes[np.newaxis, :], count, axis=0)
+    start_squares = np.empty(count, dtype=np.intp)
+    end_squares = np.empty(count, dtype=np.intp)
+    placed_codes = np.empty(count, dtype=np.int8)
+    for i, move in enumerate(moves) :
+        move_id = move.move_id
+        start_squares[i] = move_id & 63
+        end_squares[i] = move_id >> 6
+        piece_moved = move.piece_moved
+        placed_codes[i] = PIECE_CODES[piece_moved[0] + 'Q' if move.is_pawn_promotion else piece_moved]
+        if move.is_enpassant_move : # the captured pawn is beside the start square, not on the end square
+            codes[i, move.start_row * 8 + move.end_col] = 0
+        elif move.is_castle_move :
+            row = move.start_row * 8
+            rook_start, rook_end = (7, 5) if move.end_col == 6 else (0, 3)
+            codes[i, row + rook_start] = 0
+            codes[i, row + rook_end] = PIECE_CODES[piece_moved[0] + 'R']
+    rows = np.arange(count)
+    codes[rows, start_squares] = 0
+    codes[rows, end_squares] = placed_codes
+    return codes
+
+'''
+Encodes a list of 2d boards as an (N, 64) int8 array of piece codes
+'''
+def encode_boards(boards) :
+    check_numpy()
+    codes = np.empty((len(boards), 64), dtype=np.int8)
+    for i, board in enumerate(boards) :
+        encode_board(board, codes[i])
+    return codes
+
+'''
+Turns (N, 64) piece codes into (N, 12, 64) one-hot int8 planes
+'''
+def codes_to_planes(codes) :
+    check_numpy()
+    return (np.asarray(codes, dtype=np.int8)[:, np.newaxis, :] == PLANE_CODES).astype(np.int8)
+
+'''
+Returns the board scores of the positions in tenths of a pawn as an int array (white positive)
+positions is an (N, 64) array of piece codes or an (N, 12, 64) array of one-hot planes
+'''
+def score_positions_tenths(positions) :
+    check_numpy()
+    positions = np.asarray(positions)
+    if positions.ndim == 2 and positions.shape[1] == 64 : # piece codes look their values up without building planes
+        return CODE_WEIGHTS[positions, SQUARES].sum(axis=1)
+    if positions.ndim == 2 :
+        positions = codes_to_planes(positions)
+    if positions.ndim != 3 or positions.shape[1:] != PLANE_WEIGHTS.shape :
+        raise ValueError(f"Expected an (N, 64) or (N, {len(PIECES)}, 64) array, got shape {positions.shape}")
+    return np.tensordot(positions.astype(np.int32), PLANE_WEIGHTS, axes=([1, 2], [0, 1]))
+
+'''
+Returns the board scores of the positions in pawns (the same numbers score_board gives)
+'''
+def score_positions(positions) :
+    return score_positions_tenths(positions) / 10
+
+'''
+Scores a list of 2d boards in one batch
+'''
+def score_boards(boards) :
+    return score_positions(encode_boards(boards))
@@ -0,0 +1,244 @@
+'''
+Win/draw bitbases for the simplest endings: king and queen, king and rook, or king and pawn against a lone king.
+The generator works them out offline by retrograde analysis: GameState move generation finds the checkmates
+and counts the lone king's moves in every position, then wins are spread backwards through un-moves until
+nothing changes. Every position gets one bit (1 = the side with the extra piece wins, 0 = draw), so a table
+is 64 KB on disk and the search can probe it in O(1).
+
+Usage:
+    python Bitbases.py              # generate bitbases/KQK.bin, KRK.bin and KPK.bin
+    python Bitbases.py --check      # print how many positions of each table are wins
+'''
+import argparse
+import os
+import ChessEngine
+from Evaluation import piece_score
+from ChessEngine import KING_SQUARES, RAY_SQUARES, ROOK_DIRECTIONS, QUEEN_DIRECTIONS
+
+BITBASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bitbases")
+SIGNATURES = ('KQK', 'KRK', 'KPK') # KPK is built last since pawn promotions lead into KQK
+MAX_PIECES = 3
+TABLE_SIZE = 2 * 64 * 64 * 64 # side to move, strong king, weak king, extra piece
+INSUFFICIENT_MATERIAL = ('N', 'B') # a lone minor piece can never mate
+
+KING_SQUARES_INDEX = [frozenset(r * 8 + c for r, c in squares) for squares in KING_SQUARES]
+
+# loaded tables, signature -> packed bits (see load)
+tables = {}
+
+'''
+Index of a position with the strong side as white. strong_to_move is 1 when the side with the extra piece moves
+Squares are row * 8 + col like everywhere else in the engine
+'''
+def position_index(strong_to_move, strong_king, weak_king, piece_sq) :
+    return (((1 - strong_to_move) * 64 + strong_king) * 64 + weak_king) * 64 + piece_sq
+
+def split_index(index) :
+    return 1 - (index >> 18), (index >> 12) & 63, (index >> 6) & 63, index & 63
+
+'''
+Reads every bitbase file found in directory into tables. Returns the signatures that were loaded
+'''
+def load(directory=BITBASE_DIR) :
+    for signature in SIGNATURES :
+        path = os.path.join(directory, signature + ".bin")
+        if os.path.exists(path) :
+            with open(path, "rb") as f :
+                data = f.read()
+            if len(data) != TABLE_SIZE // 8 :
+                raise ValueError(f"{path} is {len(data)} bytes, expected {TABLE_SIZE // 8}")
+            tables[signature] = data
+    return sorted(tables)
+
+'''
+Looks the position up if only the kings and one other piece are left
+Returns 1 if the side to move wins, -1 if it loses, 0 for a draw and None when no table covers the position
+'''
+def probe(gs) :
+    if gs.piece_count > MAX_PIECES :
+        return None
+    pieces = [(gs.board[r][c], r * 8 + c) for r in range(8) for c in range(8) if gs.board[r][c] != '--']
+    extra = [(piece, sq) for piece, sq in pieces if piece[1] != 'K']
+    if len(extra) == 0 or extra[0][0][1] in INSUFFICIENT_MATERIAL :
+        return 0
+    piece, piece_sq = extra[0]
+    data = tables.get('K' + piece[1].upper() + 'K')
+    if data is None :
+        return None
+    strong_white = piece[0] == 'w'
+    strong_king = (gs.white_king_loc if strong_white else gs.black_king_loc)
+    weak_king = (gs.black_king_loc if strong_white else gs.white_king_loc)
+    strong_king = strong_king[0] * 8 + strong_king[1]
+    weak_king = weak_king[0] * 8 + weak_king[1]
+    if not strong_white : # the tables have the strong side as white, so flip the board vertically
+        strong_king ^= 56
+        weak_king ^= 56
+        piece_sq ^= 56
+    strong_to_move = 1 if gs.white_to_move == strong_white else 0
+    index = position_index(strong_to_move, strong_king, weak_king, piece_sq)
+    if not (data[index >> 3] >> (index & 7)) & 1 :
+        return 0
+    return 1 if strong_to_move else -1
+
+'''
+Small bonus that steers a won ending towards mate: the lone king pushed to the edge, the kings close together,
+the pawn advanced and promoted. In pawns, from the strong side's point of view
+'''
+def mop_up(gs) :
+    strong_white = False
+    material = 0
+    for r in range(8) :
+        for c in range(8) :
+            piece = gs.board[r][c]
+            if piece != '--' and piece[1] != 'K' :
+                strong_white = piece[0] == 'w'
+                if piece[1] == 'p' :
+                    material = piece_score['p'] + (7 - r if strong_white else r) / 5 # a pawn on the 7th is still worth less than a queen
+                else :
+                    material = piece_score[piece[1]]
+    strong_row, strong_col = gs.white_king_loc if strong_white else gs.black_king_loc
+    weak_row, weak_col = gs.black_king_loc if strong_white else gs.white_king_loc
+    weak_center_distance = max(3 - weak_row, weak_row - 4) + max(3 - weak_col, weak_col - 4)
+    king_distance = abs(strong_row - weak_row) + abs(strong_col - weak_col)
+    return material + (2 * weak_center_distance + 14 - king_distance) / 10
+
+'''
+Puts a position from the table on the (otherwise empty) board of gs
+'''
+def set_up_position(gs, signature, index) :
+    strong_to_move, strong_king, weak_king, piece_sq = split_index(index)
+    board = gs.board
+    for row in board :
+        row[:] = ['--'] * 8
+    board[strong_king >> 3][strong_king & 7] = 'wK'
+    board[weak_king >> 3][weak_king & 7] = 'bK'
+    board[piece_sq >> 3][piece_sq & 7] = 'w' + signature[1]
+    gs.white_king_loc = (strong_king >> 3, strong_king & 7)
+    gs.black_king_loc = (weak_king >> 3, weak_king & 7)
+    gs.white_to_move = strong_to_move == 1
+    gs.castling_rights = 0
+    gs.enpassant_possible = ()
+    gs.check_mate = gs.stale_mate = False
+
+'''
+Returns if the table index describes a position that can happen in a game
+'''
+def is_legal(gs, signature, index) :
+    strong_to_move, strong_king, weak_king, piece_sq = split_index(index)
+    if len({strong_king, weak_king, piece_sq}) < 3 or weak_king in KING_SQUARES_INDEX[strong_king] :
+        return False
+    if signature[1] == 'p' and not 8 <= piece_sq < 56 : # pawns never stand on the first or last row
+        return False
+    set_up_position(gs, signature, index)
+    # the side to move may be in check, the side that just moved can't be
+    if strong_to_move :
+        return not gs.is_square_attacked(weak_king >> 3, weak_king & 7, 'w')
+    return not gs.is_square_attacked(strong_king >> 3, strong_king & 7, 'b')
+
+'''
+Squares the piece on sq can have come from with its last move (empty squares only)
+'''
+def unmove_squares(piece, sq, occupied) :
+    if piece == 'K' :
+        return [r * 8 + c for r, c in KING_SQUARES[sq] if r * 8 + c not in occupied]
+    if piece == 'p' : # white pawns move up the board, so they came from below
+        squares = []
+        if sq + 8 < 56 and sq + 8 not in occupied :
+            squares.append(sq + 8)
+            if 32 <= sq < 40 and sq + 16 not in occupied :
+                squares.append(sq + 16)
+        return squares
+    squares = []
+    for j in (ROOK_DIRECTIONS if piece == 'R' else QUEEN_DIRECTIONS) :
+        for r, c in RAY_SQUARES[sq][j] :
+            if r * 8 + c in occupied :
+                break
+            squares.append(r * 8 + c)
+    return squares
+
+'''
+Builds the bitbase of a signature and returns it packed into bytes
+known holds already generated tables (KPK needs KQK for its promotions)
+'''
+def generate(signature, known=None) :
+    gs = ChessEngine.GameState()
+    piece = 'p' if signature[1] == 'P' else signature[1] # the engine's name for the piece
+    signature = 'K' + piece + 'K'
+    wins = bytearray(TABLE_SIZE)
+    legal = bytearray(TABLE_SIZE)
+    move_counts = bytearray(TABLE_SIZE) # moves of the lone king not yet shown to lose
+    queue = []
+
+    # forward pass: checkmates, move counts, and pawn promotions into won KQK positions
+    for index in range(TABLE_SIZE) :
+        if not is_legal(gs, signature, index) :
+            continue
+        legal[index] = 1
+        strong_to_move = index < TABLE_SIZE // 2
+        if strong_to_move and not (piece == 'p' and (index & 63) < 16) :
+            continue # only a pawn about to promote needs the strong side's moves
+        moves = gs.get_valid_moves()
+        if not strong_to_move :
+            if len(moves) == 0 :
+                if gs.check_mate :
+                    wins[index] = 1
+                    queue.append(index)
+            else :
+                move_counts[index] = len(moves)
+        else :
+            _, strong_king, weak_king, _ = split_index(index)
+            for move in moves :
+                if move.is_pawn_promotion :
+                    queen_index = position_index(0, strong_king, weak_king, move.end_row * 8 + move.end_col)
+                    if (known['KQK'][queen_index >> 3] >> (queen_index & 7)) & 1 :
+                        wins[index] = 1
+                        queue.append(index)
+                        break
+
+    # backward pass: a strong side move into a win makes a win, a lone king position is won once all its moves are
+    while queue :
+        index = queue.pop()
+        strong_to_move, strong_king, weak_king, piece_sq = split_index(index)
+        if not strong_to_move : # the strong side just moved - un-move its king or piece
+            occupied = {strong_king, weak_king, piece_sq}
+            predecessors = [position_index(1, sq, weak_king, piece_sq) for sq in unmove_squares('K', strong_king, occupied)]
+            predecessors += [position_index(1, strong_king, weak_king, sq) for sq in unmove_squares(piece, piece_sq, occupied)]
+            for predecessor in predecessors :
+                if legal[predecessor] and not wins[predecessor] :
+                    wins[predecessor] = 1
+                    queue.append(predecessor)
+        else : # the lone king just moved
+            occupied = {strong_king, weak_king, piece_sq}
+            for sq in unmove_squares('K', weak_king, occupied) :
+                predecessor = position_index(0, strong_king, sq, piece_sq)
+                if legal[predecessor] and not wins[predecessor] :
+                    move_counts[predecessor] -= 1
+                    if move_counts[predecessor] == 0 :
+                        wins[predecessor] = 1
+                        queue.append(predecessor)
+
+    packed = bytearray(TABLE_SIZE // 8)
+    for index in range(TABLE_SIZE) :
+        if wins[index] :
+            packed[index >> 3] |= 1 << (index & 7)
+    return bytes(packed)
+
+def main() :
+    parser = argparse.ArgumentParser(description="Generate or inspect the endgame bitbases")
+    parser.add_argument("--dir", default=BITBASE_DIR, help="directory the tables are written to / read from")
+    parser.add_argument("--check", action="store_true", help="count the won positions of the existing tables")
+    args = parser.parse_args()
+    if args.check :
+        for signature in load(args.dir) :
+            print(f"{signature}: {sum(bin(byte).count('1') for byte in tables[signature])} won positions")
+        return
+    os.makedirs(args.dir, exist_ok=True)
+    known = {}
+    for signature in SIGNATURES :
+        known[signature] = generate(signature, known)
+        with open(os.path.join(args.dir, signature + ".bin"), "wb") as f :
+            f.write(known[signature])
+        print(f"{signature}: {sum(bin(byte).count('1') for byte in known[signature])} won positions")
+
+if __name__ == "__main__" :
+    main()
@@ -0,0 +1,678 @@
+'''
+Bitboard position backend. Keeps one 64 bit integer per piece type and color plus occupancy masks
+and generates legal moves with mask arithmetic instead of walking the board square by square.
+Moves are generated, made and undone as packed ints (see MOVED_SHIFT) on the bitboards and a flat list of the
+piece index on every square. The 2d board the rest of the program reads (drawing, notation, bitbases, the
+opening book) is only rebuilt when something reads it, and get_valid_moves wraps the packed moves in Move objects.
+Square index is row * 8 + col, so bit 0 is a8 and bit 63 is h1.
+'''
+import ChessEngine
+from ChessEngine import Move
+from Evaluation import piece_square_values
+
+PIECES = ['wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK']
+PIECE_INDEX = {piece : i for i, piece in enumerate(PIECES)}
+WP, WN, WB, WR, WQ, WK, BP, BN, BB, BR, BQ, BK = range(12)
+WHITE_OCC, BLACK_OCC = 12, 13 # indexes of the occupancy masks in the bitboard list
+
+FULL = (1 << 64) - 1
+
+# (row delta, col delta, index increases along the ray)
+ROOK_DIRECTIONS = ((-1, 0, False), (0, -1, False), (1, 0, True), (0, 1, True))
+BISHOP_DIRECTIONS = ((-1, -1, False), (-1, 1, False), (1, -1, True), (1, 1, True))
+
+'''
+Builds the attack masks of a leaper (knight/king) for every square
+'''
+def leaper_attacks(offsets) :
+    table = []
+    for sq in range(64) :
+        r, c = divmod(sq, 8)
+        mask = 0
+        for dr, dc in offsets :
+            if 0 <= r + dr < 8 and 0 <= c + dc < 8 :
+                mask |= 1 << ((r + dr) * 8 + c + dc)
+        table.append(mask)
+    return table
+
+'''
+Builds the mask of squares a slider sees from every square in one direction on an empty board
+'''
+def ray_masks(dr, dc) :
+    table = []
+    for sq in range(64) :
+        r, c = divmod(sq, 8)
+        mask = 0
+        r, c = r + dr, c + dc
+        while 0 <= r < 8 and 0 <= c < 8 :
+            mask |= 1 << (r * 8 + c)
+            r, c = r + dr, c + dc
+        table.append(mask)
+    return table
+
+KNIGHT_ATTACKS = leaper_attacks(((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)))
+KING_ATTACKS = leaper_attacks(((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)))
+PAWN_ATTACKS = (leaper_attacks(((-1, -1), (-1, 1))), leaper_attacks(((1, -1), (1, 1)))) # [white, black]
+RAYS = {(dr, dc) : ray_masks(dr, dc) for dr, dc, _ in ROOK_DIRECTIONS + BISHOP_DIRECTIONS}
+
+# BETWEEN[a][b] holds the squares strictly between a and b when they share a line, otherwise 0
+BETWEEN = [[0] * 64 for _ in range(64)]
+for _sq in range(64) :
+    for (_dr, _dc), _rays in RAYS.items() :
+        _ray = _rays[_sq]
+        while _ray :
+            _target = (_ray & -_ray).bit_length() - 1
+            BETWEEN[_sq][_target] = _rays[_sq] & ~_rays[_target] & ~(1 << _target)
+            _ray &= _ray - 1
+
+'''
+Squares attacked by a slider on sq given (ray table, index increases along the ray) pairs for its directions
+'''
+def slider_attacks(sq, occupied, ray_tables) :
+    attacks = 0
+    for rays, increasing in ray_tables :
+        ray = rays[sq]
+        blockers = ray & occupied
+        if blockers :
+            if increasing :
+                ray ^= rays[(blockers & -blockers).bit_length() - 1]
+            else :
+                ray ^= rays[blockers.bit_length() - 1]
+        attacks |= ray
+    return attacks
+
+'''
+Builds the attack lookup of one line (a file, rank or diagonal) through every square: the mask of the other squares
+on the line, and a dict from every occupancy of those squares to the squares a slider there attacks along the line
+'''
+def line_attack_tables(directions) :
+    ray_tables = tuple((RAYS[(dr, dc)], increasing) for dr, dc, increasing in directions)
+    masks = []
+    tables = []
+    for sq in range(64) :
+        mask = 0
+        for rays, _ in ray_tables :
+            mask |= rays[sq]
+        table = {}
+        occupied = 0
+        while True : # every subset of the mask
+            table[occupied] = slider_attacks(sq, occupied, ray_tables)
+            occupied = (occupied - mask) & mask
+            if not occupied :
+                break
+        masks.append(mask)
+        tables.append(table)
+    return masks, tables
+
+FILE_MASKS, FILE_ATTACKS = line_attack_tables((ROOK_DIRECTIONS[0], ROOK_DIRECTIONS[2]))
+RANK_MASKS, RANK_ATTACKS = line_attack_tables((ROOK_DIRECTIONS[1], ROOK_DIRECTIONS[3]))
+DIAGONAL_MASKS, DIAGONAL_ATTACKS = line_attack_tables((BISHOP_DIRECTIONS[0], BISHOP_DIRECTIONS[3]))
+ANTI_DIAGONAL_MASKS, ANTI_DIAGONAL_ATTACKS = line_attack_tables((BISHOP_DIRECTIONS[1], BISHOP_DIRECTIONS[2]))
+
+'''
+Squares a rook on sq attacks, two lookups instead of walking four rays
+'''
+def rook_attacks(sq, occupied) :
+    return FILE_ATTACKS[sq][occupied & FILE_MASKS[sq]] | RANK_ATTACKS[sq][occupied & RANK_MASKS[sq]]
+
+def bishop_attacks(sq, occupied) :
+    return DIAGONAL_ATTACKS[sq][occupied & DIAGONAL_MASKS[sq]] | ANTI_DIAGONAL_ATTACKS[sq][occupied & ANTI_DIAGONAL_MASKS[sq]]
+
+ROOK_LINES = [rook_attacks(sq, 0) for sq in range(64)] # the file and rank through every square
+BISHOP_LINES = [bishop_attacks(sq, 0) for sq in range(64)]
+
+SQUARES = [divmod(sq, 8) for sq in range(64)] # (row, col) of every square index
+FILE_A = sum(1 << (r * 8) for r in range(8))
+FILE_H = FILE_A << 7
+ROW_MASKS = [0xFF << (r * 8) for r in range(8)]
+
+# A packed move is one int: start square | end square << 6 | moved piece << 12 | captured piece << 16 | flags
+# The low 12 bits are the move_id of the same Move, pieces are PIECES indexes and NO_PIECE means nothing was captured
+MOVED_SHIFT = 12
+CAPTURED_SHIFT = 16
+NO_PIECE = 12
+ENPASSANT_FLAG = 1 << 20
+CASTLE_FLAG = 1 << 21
+PIECE_NAMES = PIECES + ['--'] # piece index (or NO_PIECE) -> the 2d board's piece string
+PIECE_CODES = {piece : i for i, piece in enumerate(PIECE_NAMES)}
+# (piece moved, piece captured) strings of every moved | captured << 4 pair, shared by all moves that have them
+PIECE_PAIRS = [(PIECE_NAMES[i & 15], PIECE_NAMES[i >> 4]) if (i & 15) < NO_PIECE and (i >> 4) <= NO_PIECE else None
+               for i in range(256)]
+# PLACED_PIECES[piece][end square] is the piece that ends up there - a pawn reaching the last row promotes to a queen
+PLACED_PIECES = [[piece] * 64 for piece in range(12)]
+PLACED_PIECES[WP][:8] = [WQ] * 8
+PLACED_PIECES[BP][56:] = [BQ] * 8
+CASTLE_ROOK_SQUARES = {62 : (63, 61), 58 : (56, 59), 6 : (7, 5), 2 : (0, 3)} # king's end square -> rook start, rook end
+ZOBRIST_PIECES = [ChessEngine.ZOBRIST_PIECES[piece] for piece in PIECES] # by piece index
+PIECE_SQUARE_VALUES = [piece_square_values[piece] for piece in PIECES]
+
+'''
+A Move made from a packed move, for everything outside the move generator and make/undo (search, GUI, notation)
+'''
+class BitboardMove(Move) :
+    __slots__ = ("code",)
+
+    def __init__(self, code) :
+        self.code = code
+        self.start_row, self.start_col = SQUARES[code & 63]
+        self.end_row, self.end_col = SQUARES[(code >> 6) & 63]
+        self.move_id = code & 0xFFF
+        self.is_enpassant_move = code & ENPASSANT_FLAG != 0
+        self.is_castle_move = code & CASTLE_FLAG != 0
+        self.board = None
+        self.pieces = PIECE_PAIRS[(code >> MOVED_SHIFT) & 0xFF]
+
+class BitboardGameState(ChessEngine.GameState) :
+    '''
+    The 2d board, rebuilt from piece_on the first time it is read after a move (make and undo never touch it)
+    Rebuilt in place, so a board someone kept a reference to stays current
+    '''
+    @property
+    def board(self) :
+        board = self.mailbox_board
+        if self.board_stale :
+            piece_names = PIECE_NAMES
+            piece_on = self.piece_on
+            for r in range(8) :
+                board[r][:] = [piece_names[piece] for piece in piece_on[r * 8 : r * 8 + 8]]
+            self.board_stale = False
+        return board
+
+    '''
+    Setting the board (GameState.__init__, load_fen) sets up the bitboards from it
+    '''
+    @board.setter
+    def board(self, board) :
+        self.mailbox_board = board
+        self.board_stale = False
+        self.set_up_bitboards()
+
+    '''
+    Rebuilds every bitboard and piece_on from the 2d board
+    '''
+    def set_up_bitboards(self) :
+        bitboards = [0] * 14
+        piece_on = [NO_PIECE] * 64 # piece index on every square, so generation can tell what a move captures
+        for r in range(8) :
+            for c in range(8) :
+                piece = self.mailbox_board[r][c]
+                if piece != '--' :
+                    sq = r * 8 + c
+                    bitboards[PIECE_INDEX[piece]] |= 1 << sq
+                    bitboards[WHITE_OCC if piece[0] == 'w' else BLACK_OCC] |= 1 << sq
+                    piece_on[sq] = PIECE_INDEX[piece]
+        self.bitboards = bitboards
+        self.piece_on = piece_on
+        self.packed_log = [] # packed moves made, move_log only holds the ones made as Move objects
+
+    '''
+    Makes a Move (from get_valid_moves, generate_moves or built from the board) and logs it
+    '''
+    def make_move(self, move) :
+        self.make_packed_move(move.code if isinstance(move, BitboardMove) else self.pack_move(move))
+        self.move_log.append(move)
+
+    def undo_move(self) :
+        if self.move_log :
+            self.move_log.pop()
+            self.undo_packed_move()
+        self.check_mate = self.stale_mate = False
+
+    '''
+    Packs a Move that wasn't generated here (e.g. one built from the clicked squares)
+    '''
+    def pack_move(self, move) :
+        piece_moved, piece_captured = move.pieces or move.decode_pieces()
+        return (move.move_id | PIECE_CODES[piece_moved] << MOVED_SHIFT | PIECE_CODES[piece_captured] << CAPTURED_SHIFT |
+                (ENPASSANT_FLAG if move.is_enpassant_move else 0) | (CASTLE_FLAG if move.is_castle_move else 0))
+
+    '''
+    Makes a packed move: XORs it into the bitboards and updates piece_on, the Zobrist key, the board score,
+    castling rights and en passant. The state that can't be recomputed goes on the undo stack like GameState.make_move
+    '''
+    def make_packed_move(self, code) :
+        packed_log = self.packed_log
+        ply = len(packed_log)
+        undo_stack = self.undo_stack
+        if ply == len(undo_stack) :
+            undo_stack.extend([0] * ply)
+        previous_enpassant = self.enpassant_possible
+        previous_castling_rights = self.castling_rights
+        key = self.zobrist_key
+        score = self.board_score
+        enpassant_code = 0 if previous_enpassant == () else previous_enpassant[0] * 8 + previous_enpassant[1] + 1
+        undo_stack[ply] = (previous_castling_rights | enpassant_code << ChessEngine.UNDO_ENPASSANT_SHIFT |
+                           (score + ChessEngine.UNDO_SCORE_OFFSET) << ChessEngine.UNDO_SCORE_SHIFT |
+                           key << ChessEngine.UNDO_KEY_SHIFT)
+        packed_log.append(code)
+
+        start_sq = code & 63
+        end_sq = (code >> 6) & 63
+        moved = (code >> MOVED_SHIFT) & 15
+        captured = (code >> CAPTURED_SHIFT) & 15
+        placed = PLACED_PIECES[moved][end_sq]
+        bitboards = self.bitboards
+        piece_on = self.piece_on
+        start_bit = 1 << start_sq
+        end_bit = 1 << end_sq
+        white = moved < 6
+        bitboards[moved] ^= start_bit
+        bitboards[placed] ^= end_bit
+        bitboards[WHITE_OCC if white else BLACK_OCC] ^= start_bit | end_bit
+        piece_on[start_sq] = NO_PIECE
+        piece_on[end_sq] = placed
+        key ^= ChessEngine.ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_PIECES[moved][start_sq] ^ ZOBRIST_PIECES[placed][end_sq]
+        score += PIECE_SQUARE_VALUES[placed][end_sq] - PIECE_SQUARE_VALUES[moved][start_sq]
+        if captured != NO_PIECE :
+            captured_sq = end_sq
+            if code & ENPASSANT_FLAG : # the captured pawn is beside the start square
+                captured_sq = (start_sq & 56) | (end_sq & 7)
+                piece_on[captured_sq] = NO_PIECE
+            captured_bit = 1 << captured_sq
+            bitboards[captured] ^= captured_bit
+            bitboards[BLACK_OCC if white else WHITE_OCC] ^= captured_bit
+            key ^= ZOBRIST_PIECES[captured][captured_sq]
+            score -= PIECE_SQUARE_VALUES[captured][captured_sq]
+            self.piece_count -= 1
+        elif code & CASTLE_FLAG :
+            rook = WR if white else BR
+            rook_start, rook_end = CASTLE_ROOK_SQUARES[end_sq]
+            rook_bits = (1 << rook_start) | (1 << rook_end)
+            bitboards[rook] ^= rook_bits
+            bitboards[WHITE_OCC if white else BLACK_OCC] ^= rook_bits
+            piece_on[rook_start] = NO_PIECE
+            piece_on[rook_end] = rook
+            key ^= ZOBRIST_PIECES[rook][rook_start] ^ ZOBRIST_PIECES[rook][rook_end]
+            score += PIECE_SQUARE_VALUES[rook][rook_end] - PIECE_SQUARE_VALUES[rook][rook_start]
+        if moved == WK :
+            self.white_king_loc = SQUARES[end_sq]
+        elif moved == BK :
+            self.black_king_loc = SQUARES[end_sq]
+
+        if previous_enpassant != () :
+            key ^= ChessEngine.ZOBRIST_ENPASSANT[previous_enpassant[1]]
+        if (moved == WP or moved == BP) and (end_sq - start_sq == 16 or start_sq - end_sq == 16) :
+            self.enpassant_possible = SQUARES[(start_sq + end_sq) >> 1]
+            key ^= ChessEngine.ZOBRIST_ENPASSANT[end_sq & 7]
+        else :
+            self.enpassant_possible = ()
+        castling_rights = (previous_castling_rights & ChessEngine.CASTLING_RIGHTS_MASK[start_sq] &
+                           ChessEngine.CASTLING_RIGHTS_MASK[end_sq])
+        if castling_rights != previous_castling_rights :
+            key ^= ChessEngine.ZOBRIST_CASTLING[previous_castling_rights] ^ ChessEngine.ZOBRIST_CASTLING[castling_rights]
+            self.castling_rights = castling_rights
+        self.zobrist_key = key
+        self.board_score = score
+        self.white_to_move = not white
+        self.board_stale = True
+
+    '''
+    Takes back the last packed move: XOR-ing the same bits again takes the move back out of the bitboards
+    '''
+    def undo_packed_move(self) :
+        code = self.packed_log.pop()
+        record = self.undo_stack[len(self.packed_log)]
+        self.castling_rights = record & ChessEngine.ALL_CASTLING_RIGHTS
+        self.enpassant_possible = ChessEngine.ENPASSANT_SQUARES[(record >> ChessEngine.UNDO_ENPASSANT_SHIFT) & 0x7F]
+        self.board_score = ((record >> ChessEngine.UNDO_SCORE_SHIFT) & 0xFFFFF) - ChessEngine.UNDO_SCORE_OFFSET
+        self.zobrist_key = record >> ChessEngine.UNDO_KEY_SHIFT
+
+        start_sq = code & 63
+        end_sq = (code >> 6) & 63
+        moved = (code >> MOVED_SHIFT) & 15
+        captured = (code >> CAPTURED_SHIFT) & 15
+        bitboards = self.bitboards
+        piece_on = self.piece_on
+        start_bit = 1 << start_sq
+        end_bit = 1 << end_sq
+        white = moved < 6
+        bitboards[moved] ^= start_bit
+        bitboards[PLACED_PIECES[moved][end_sq]] ^= end_bit
+        bitboards[WHITE_OCC if white else BLACK_OCC] ^= start_bit | end_bit
+        piece_on[start_sq] = moved
+        piece_on[end_sq] = captured
+        if captured != NO_PIECE :
+            captured_sq = end_sq
+            if code & ENPASSANT_FLAG :
+                captured_sq = (start_sq & 56) | (end_sq & 7)
+                piece_on[end_sq] = NO_PIECE
+                piece_on[captured_sq] = captured
+            captured_bit = 1 << captured_sq
+            bitboards[captured] ^= captured_bit
+            bitboards[BLACK_OCC if white else WHITE_OCC] ^= captured_bit
+            self.piece_count += 1
+        elif code & CASTLE_FLAG :
+            rook = WR if white else BR
+            rook_start, rook_end = CASTLE_ROOK_SQUARES[end_sq]
+            rook_bits = (1 << rook_start) | (1 << rook_end)
+            bitboards[rook] ^= rook_bits
+            bitboards[WHITE_OCC if white else BLACK_OCC] ^= rook_bits
+            piece_on[rook_end] = NO_PIECE
+            piece_on[rook_start] = rook
+        if moved == WK :
+            self.white_king_loc = SQUARES[start_sq]
+        elif moved == BK :
+            self.black_king_loc = SQUARES[start_sq]
+        self.white_to_move = white
+        self.check_mate = self.stale_mate = False
+        self.board_stale = True
+
+    '''
+    Returns a mask of the pieces of the given color attacking sq
+    '''
+    def attackers_of(self, sq, occupied, white_attacking) :
+        bitboards = self.bitboards
+        if white_attacking :
+            pawns, knights, bishops, rooks, queens, king = bitboards[WP:WK + 1]
+            pawn_attacks = PAWN_ATTACKS[1][sq] # squares a black pawn on sq would attack hold the white pawns attacking sq
+        else :
+            pawns, knights, bishops, rooks, queens, king = bitboards[BP:BK + 1]
+            pawn_attacks = PAWN_ATTACKS[0][sq]
+        attackers = (KNIGHT_ATTACKS[sq] & knights) | (KING_ATTACKS[sq] & king) | (pawn_attacks & pawns)
+        if rooks | queens :
+            attackers |= rook_attacks(sq, occupied) & (rooks | queens)
+        if bishops | queens :
+            attackers |= bishop_attacks(sq, occupied) & (bishops | queens)
+        return attackers
+
+    '''
+    Returns the mask of every square the pieces of the given color attack
+    '''
+    def attacked_squares(self, occupied, white_attacking) :
+        bitboards = self.bitboards
+        offset = 0 if white_attacking else 6
+        pawns = bitboards[WP + offset]
+        if white_attacking :
+            attacks = ((pawns & ~FILE_A) >> 9) | ((pawns & ~FILE_H) >> 7)
+        else :
+            attacks = (((pawns & ~FILE_A) << 7) | ((pawns & ~FILE_H) << 9)) & FULL
+        attacks |= KING_ATTACKS[bitboards[WK + offset].bit_length() - 1]
+        knights = bitboards[WN + offset]
+        while knights :
+            sq = knights.bit_length() - 1
+            knights ^= 1 << sq
+            attacks |= KNIGHT_ATTACKS[sq]
+        queens = bitboards[WQ + offset]
+        for pieces, slider_attacks in ((bitboards[WB + offset] | queens, bishop_attacks), (bitboards[WR + offset] | queens, rook_attacks)) :
+            while pieces :
+                sq = pieces.bit_length() - 1
+                pieces ^= 1 << sq
+                attacks |= slider_attacks(sq, occupied)
+        return attacks
+
+    '''
+    Returns if any piece of attacker_color attacks the square (r, c), from the bitboards
+    '''
+    def is_square_attacked(self, r, c, attacker_color) :
+        bitboards = self.bitboards
+        return self.attackers_of(r * 8 + c, bitboards[WHITE_OCC] | bitboards[BLACK_OCC], attacker_color == 'w') != 0
+
+    '''
+    If the side to move has a knight, bishop, rook or queen, from the bitboards
+    '''
+    def has_non_pawn_material(self) :
+        bitboards = self.bitboards
+        offset = 0 if self.white_to_move else 6
+        return (bitboards[WN + offset] | bitboards[WB + offset] | bitboards[WR + offset] | bitboards[WQ + offset]) != 0
+
+    '''
+    All moves considering checks, as Move objects
+    '''
+    def get_valid_moves(self) :
+        return [BitboardMove(code) for code in self.get_packed_moves()]
+
+    '''
+    All moves considering checks as packed moves, generated from the bitboards
+    '''
+    def get_packed_moves(self) :
+        checkers, pin_masks, attacked = self.find_checks_and_pins()
+        moves = []
+        self.add_legal_moves(checkers, pin_masks, attacked, moves)
+        self.check_mate = self.stale_mate = False
+        if len(moves) == 0 :
+            if self.in_check :
+                self.check_mate = True
+            else :
+                self.stale_mate = True
+        return moves
+
+    '''
+    Sets in_check and returns the mask of the pieces giving check, the pin masks of the side to move
+    (pinned square -> the squares between the king and the pinner, where the pinned piece may still go)
+    and the squares the enemy attacks with the king off the board (so it can't hide behind itself on a slider's ray)
+    '''
+    def find_checks_and_pins(self) :
+        bitboards = self.bitboards
+        white = self.white_to_move
+        own = bitboards[WHITE_OCC if white else BLACK_OCC]
+        occupied = own | bitboards[BLACK_OCC if white else WHITE_OCC]
+        enemy_offset = 6 if white else 0
+        king_sq = bitboards[BK - enemy_offset].bit_length() - 1
+
+        # one attack map answers the check and every king move and castling square
+        attacked = self.attacked_squares(occupied ^ (1 << king_sq), not white)
+        self.in_check = (attacked >> king_sq) & 1 != 0
+        checkers = self.attackers_of(king_sq, occupied, not white) if self.in_check else 0
+
+        # pinned pieces can only move along the line between the king and the pinner
+        # a pinner is an enemy slider on one of the king's lines with exactly one piece, ours, in between
+        pin_masks = {}
+        queens = bitboards[WQ + enemy_offset]
+        snipers = ((ROOK_LINES[king_sq] & (bitboards[WR + enemy_offset] | queens)) |
+                   (BISHOP_LINES[king_sq] & (bitboards[WB + enemy_offset] | queens)))
+        while snipers :
+            bit = snipers & -snipers
+            snipers ^= bit
+            between = BETWEEN[king_sq][bit.bit_length() - 1]
+            blockers = between & occupied
+            if blockers and not blockers & (blockers - 1) and blockers & own :
+                pin_masks[blockers.bit_length() - 1] = between | bit
+        return checkers, pin_masks, attacked
+
+    '''
+    Adds the legal packed moves of the side to move, given the checkers, pins and attacks find_checks_and_pins returned
+    captures=False leaves out captures and promotions, quiet_moves=False every other move (castling included)
+    Only the pieces on from_mask are moved
+    '''
+    def add_legal_moves(self, checkers, pin_masks, attacked, moves, captures=True, quiet_moves=True, from_mask=FULL) :
+        bitboards = self.bitboards
+        white = self.white_to_move
+        us = 0 if white else 1
+        own = bitboards[WHITE_OCC if white else BLACK_OCC]
+        enemy = bitboards[BLACK_OCC if white else WHITE_OCC]
+        occupied = own | enemy
+        offset = 0 if white else 6
+        king_sq = bitboards[WK + offset].bit_length() - 1
+        target_squares = (enemy if captures else 0) | (~occupied & FULL if quiet_moves else 0)
+
+        moving_king = (from_mask >> king_sq) & 1
+        if moving_king :
+            self.add_moves(king_sq, KING_ATTACKS[king_sq] & target_squares & ~attacked, moves)
+
+        if checkers & (checkers - 1) : # double check, only the king can move
+            return
+        if checkers :
+            check_mask = checkers | BETWEEN[king_sq][checkers.bit_length() - 1]
+        else :
+            check_mask = FULL
+
+        targets_mask = target_squares & check_mask
+        self.get_pawn_bitboard_moves(bitboards[WP + offset] & from_mask, us, enemy, occupied, check_mask, pin_masks, king_sq, moves,
+                                     captures, quiet_moves)
+
+        knights = bitboards[WN + offset] & from_mask
+        while knights :
+            sq = knights.bit_length() - 1
+            knights ^= 1 << sq
+            if sq in pin_masks : # a pinned knight can never move
+                continue
+            self.add_moves(sq, KNIGHT_ATTACKS[sq] & targets_mask, moves)
+
+        queens = bitboards[WQ + offset]
+        for pieces, attacks in ((bitboards[WB + offset] | queens, bishop_attacks), (bitboards[WR + offset] | queens, rook_attacks)) :
+            pieces &= from_mask
+            while pieces :
+                sq = pieces.bit_length() - 1
+                pieces ^= 1 << sq
+                targets = attacks(sq, occupied) & targets_mask
+                if sq in pin_masks :
+                    targets &= pin_masks[sq]
+                self.add_moves(sq, targets, moves)
+
+        if moving_king and quiet_moves and not checkers :
+            self.get_castle_bitboard_moves(king_sq, occupied, attacked, moves)
+
+    '''
+    Staged moves for the search (see GameState.generate_moves). Checks and pins are worked out once up front,
+    then the hash move, the captures and the quiet moves are each generated from the masks only when asked for
+    Only the moves of a stage that is reached become Move objects
+    '''
+    def generate_moves(self, hash_move_id=None, order=None, captures_only=False) :
+        self.check_mate = self.stale_mate = False
+        checkers, pin_masks, attacked = self.find_checks_and_pins()
+        if checkers : # evasions are few, generate them all
+            moves = []
+            self.add_legal_moves(checkers, pin_masks, attacked, moves)
+            if not moves :
+                self.check_mate = True
+            return ChessEngine.stage_moves([BitboardMove(code) for code in moves], hash_move_id, order)
+        return self.generate_staged_bitboard_moves(pin_masks, attacked, None if captures_only else hash_move_id, order, captures_only)
+
+    def generate_staged_bitboard_moves(self, pin_masks, attacked, hash_move_id, order, captures_only) :
+        hash_move = None
+        if hash_move_id is not None :
+            piece_moves = []
+            self.add_legal_moves(0, pin_masks, attacked, piece_moves, from_mask=1 << (hash_move_id & 63))
+            hash_code = next((code for code in piece_moves if code & 0xFFF == hash_move_id), None)
+            if hash_code is not None :
+                hash_move = BitboardMove(hash_code)
+                yield hash_move
+
+        codes = []
+        self.add_legal_moves(0, pin_masks, attacked, codes, quiet_moves=False)
+        captures = [BitboardMove(code) for code in codes if code & 0xFFF != hash_move_id]
+        yield from (order(captures, True) if order is not None else captures)
+        if captures_only :
+            return
+
+        codes = []
+        self.add_legal_moves(0, pin_masks, attacked, codes, captures=False)
+        quiet_moves = [BitboardMove(code) for code in codes if code & 0xFFF != hash_move_id]
+        yield from (order(quiet_moves, False) if order is not None else quiet_moves)
+        if hash_move is None and not captures and not quiet_moves :
+            self.stale_mate = True
+
+    '''
+    Adds a packed move from sq to every square in the targets mask, piece_on tells what each one captures
+    '''
+    def add_moves(self, sq, targets, moves) :
+        piece_on = self.piece_on
+        start = sq | piece_on[sq] << MOVED_SHIFT
+        while targets :
+            end_sq = targets.bit_length() - 1
+            targets ^= 1 << end_sq
+            moves.append(start | end_sq << 6 | piece_on[end_sq] << CAPTURED_SHIFT)
+
+    '''
+    Pushes, captures and enpassant captures for all pawns of the side to move
+    Unpinned pawns are shifted as a whole set, pinned pawns are handled one at a time
+    Promotions count as captures, so captures=False leaves them out along with the captures
+    '''
+    def get_pawn_bitboard_moves(self, pawns, us, enemy, occupied, check_mask, pin_masks, king_sq, moves, captures=True, quiet_moves=True) :
+        piece_on = self.piece_on
+        pawn_code = (WP if us == 0 else BP) << MOVED_SHIFT
+        push_code = pawn_code | NO_PIECE << CAPTURED_SHIFT
+        empty = ~occupied & FULL
+        pinned = 0
+        for sq in pin_masks :
+            pinned |= 1 << sq
+        free = pawns & ~pinned
+        if us == 0 : # white pawns move towards row 0 (lower square indexes)
+            forward = -8
+            promotion_row = ROW_MASKS[0]
+            single = (free >> 8) & empty
+            double = ((single & ROW_MASKS[5]) >> 8) & empty
+            diagonals = ((((free & ~FILE_A) >> 9) & enemy & check_mask, 9), (((free & ~FILE_H) >> 7) & enemy & check_mask, 7))
+        else :
+            forward = 8
+            promotion_row = ROW_MASKS[7]
+            single = (free << 8) & empty
+            double = ((single & ROW_MASKS[2]) << 8) & empty
+            diagonals = ((((free & ~FILE_A) << 7) & enemy & check_mask, -7), (((free & ~FILE_H) << 9) & enemy & check_mask, -9))
+
+        pushes = ((single & ~promotion_row & check_mask, -forward), (double & check_mask, -2 * forward)) if quiet_moves else ()
+        if captures :
+            pushes += ((single & promotion_row & check_mask, -forward),)
+        for targets, back in pushes :
+            while targets :
+                end_sq = targets.bit_length() - 1
+                targets ^= 1 << end_sq
+                moves.append((end_sq + back) | end_sq << 6 | push_code)
+        if captures :
+            for targets, back in diagonals :
+                while targets :
+                    end_sq = targets.bit_length() - 1
+                    targets ^= 1 << end_sq
+                    moves.append((end_sq + back) | end_sq << 6 | pawn_code | piece_on[end_sq] << CAPTURED_SHIFT)
+
+        pinned_pawns = pawns & pinned
+        while pinned_pawns :
+            sq = pinned_pawns.bit_length() - 1
+            pinned_pawns ^= 1 << sq
+            allowed = check_mask & pin_masks[sq]
+            one_step = sq + forward
+            if (empty >> one_step) & 1 :
+                if (allowed >> one_step) & 1 and (captures if (promotion_row >> one_step) & 1 else quiet_moves) :
+                    moves.append(sq | one_step << 6 | push_code)
+                two_step = one_step + forward
+                if quiet_moves and (sq >> 3) == (6 if us == 0 else 1) and (empty >> two_step) & 1 and (allowed >> two_step) & 1 :
+                    moves.append(sq | two_step << 6 | push_code)
+            if captures :
+                self.add_moves(sq, PAWN_ATTACKS[us][sq] & enemy & allowed, moves)
+
+        if captures and self.enpassant_possible != () :
+            end_sq = self.enpassant_possible[0] * 8 + self.enpassant_possible[1]
+            enpassant_bit = 1 << end_sq
+            captured_sq = end_sq - forward
+            # capturing must resolve a check (by taking the checking pawn or blocking) and respect pins
+            if (check_mask & enpassant_bit) or ((check_mask >> captured_sq) & 1) :
+                capturers = PAWN_ATTACKS[1 - us][end_sq] & pawns
+                while capturers :
+                    sq = capturers.bit_length() - 1
+                    capturers ^= 1 << sq
+                    if not (pin_masks.get(sq, FULL) & enpassant_bit) :
+                        continue
+                    # both pawns leave the rank at once, so look for a slider that would now see the king
+                    after = occupied ^ (1 << sq) ^ enpassant_bit ^ (1 << captured_sq)
+                    if self.slider_attacks_king(king_sq, after, us) :
+                        continue
+                    moves.append(sq | end_sq << 6 | pawn_code | (BP if us == 0 else WP) << CAPTURED_SHIFT | ENPASSANT_FLAG)
+
+    '''
+    True if an enemy rook, bishop or queen attacks the king given the occupancy
+    '''
+    def slider_attacks_king(self, king_sq, occupied, us) :
+        bitboards = self.bitboards
+        enemy_offset = 6 if us == 0 else 0
+        queens = bitboards[WQ + enemy_offset]
+        if rook_attacks(king_sq, occupied) & (bitboards[WR + enemy_offset] | queens) :
+            return True
+        return bool(bishop_attacks(king_sq, occupied) & (bitboards[WB + enemy_offset] | queens))
+
+    '''
+    Castle moves for a king that is not in check, attacked is the mask of squares the enemy attacks
+    '''
+    def get_castle_bitboard_moves(self, king_sq, occupied, attacked, moves) :
+        rights = self.castling_rights
+        white = self.white_to_move
+        if white :
+            king_side, queen_side = rights & ChessEngine.WHITE_KING_SIDE, rights & ChessEngine.WHITE_QUEEN_SIDE
+        else :
+            king_side, queen_side = rights & ChessEngine.BLACK_KING_SIDE, rights & ChessEngine.BLACK_QUEEN_SIDE
+        king_code = king_sq | (WK if white else BK) << MOVED_SHIFT | NO_PIECE << CAPTURED_SHIFT | CASTLE_FLAG
+        if king_side and not (occupied >> (king_sq + 1)) & 1 and not (occupied >> (king_sq + 2)) & 1 :
+            if not (attacked >> (king_sq + 1)) & 3 : # neither square the king passes is attacked
+                moves.append(king_code | (king_sq + 2) << 6)
+        if queen_side and not (occupied >> (king_sq - 1)) & 1 and not (occupied >> (king_sq - 2)) & 1 and not (occupied >> (king_sq - 3)) & 1 :
+            if not (attacked >> (king_sq - 2)) & 3 :
+                moves.append(king_code | (king_sq - 2) << 6)
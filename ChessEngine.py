@@ -3,8 +3,67 @@ Responsible for storing all the information about the current state of a chess g
 Also responsible for determining the valid moves at the current state.
 Will keep a move log.
 '''
+import random
+from Evaluation import piece_square_values
+
+# Zobrist hashing - every position gets a 64 bit key made by XOR-ing one random number per feature
+# (piece on square, side to move, castling rights, enpassant file), so make/undo can update it incrementally
+zobrist_random = random.Random(20231013) # fixed seed so keys are the same in every run and process
+ZOBRIST_PIECES = {color + piece : [zobrist_random.getrandbits(64) for _ in range(64)]
+                  for color in 'wb' for piece in 'pNBRQK'} # indexed by row * 8 + col
+ZOBRIST_BLACK_TO_MOVE = zobrist_random.getrandbits(64)
+ZOBRIST_CASTLING = [zobrist_random.getrandbits(64) for _ in range(16)] # indexed by the castling rights bits
+ZOBRIST_ENPASSANT = [zobrist_random.getrandbits(64) for _ in range(8)] # indexed by file
+
+# castling rights are kept as 4 bits in one int
+WHITE_KING_SIDE, BLACK_KING_SIDE, WHITE_QUEEN_SIDE, BLACK_QUEEN_SIDE = 1, 2, 4, 8
+ALL_CASTLING_RIGHTS = 15
+# rights that survive a move from or to each square - moving a king or rook off its start square
+# (or capturing on a rook's start square) clears the rights that depend on it
+CASTLING_RIGHTS_MASK = [ALL_CASTLING_RIGHTS] * 64
+CASTLING_RIGHTS_MASK[0] &= ~BLACK_QUEEN_SIDE # a8
+CASTLING_RIGHTS_MASK[4] &= ~(BLACK_KING_SIDE | BLACK_QUEEN_SIDE) # e8
+CASTLING_RIGHTS_MASK[7] &= ~BLACK_KING_SIDE # h8
+CASTLING_RIGHTS_MASK[56] &= ~WHITE_QUEEN_SIDE # a1
+CASTLING_RIGHTS_MASK[60] &= ~(WHITE_KING_SIDE | WHITE_QUEEN_SIDE) # e1
+CASTLING_RIGHTS_MASK[63] &= ~WHITE_KING_SIDE # h1
+
+# make_move saves the state it can't recompute in one packed int per ply on a preallocated undo stack:
+# castling rights (4 bits) | en passant code (7 bits) | board score + offset (20 bits) | zobrist key (64 bits)
+UNDO_STACK_SIZE = 256 # records allocated up front, the stack doubles whenever a game outgrows it
+UNDO_ENPASSANT_SHIFT = 4
+UNDO_SCORE_SHIFT = 11
+UNDO_SCORE_OFFSET = 1 << 19
+UNDO_KEY_SHIFT = 31
+ENPASSANT_SQUARES = [()] + [(r, c) for r in range(8) for c in range(8)] # en passant code -> enpassant_possible
+NO_PINS = (None,) * 64 # pin map of a position without pins, shared so most nodes don't build one
+
+# Attack tables, built once at import. For every square (indexed by row * 8 + col) they hold the squares a knight
+# or king there reaches and, per direction, the squares along the ray moving away from it
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)) # 4 orthogonal, then 4 diagonal
+ROOK_DIRECTIONS = (0, 1, 2, 3) # indices into DIRECTIONS
+BISHOP_DIRECTIONS = (4, 5, 6, 7)
+QUEEN_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KING_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+def leaper_squares(r, c, offsets) :
+    return tuple((r + dr, c + dc) for dr, dc in offsets if 0 <= r + dr < 8 and 0 <= c + dc < 8)
+
+def ray_squares(r, c, d) :
+    squares = []
+    end_row, end_col = r + d[0], c + d[1]
+    while 0 <= end_row < 8 and 0 <= end_col < 8 :
+        squares.append((end_row, end_col))
+        end_row, end_col = end_row + d[0], end_col + d[1]
+    return tuple(squares)
+
+KNIGHT_SQUARES = [leaper_squares(r, c, KNIGHT_OFFSETS) for r in range(8) for c in range(8)]
+KING_SQUARES = [leaper_squares(r, c, KING_OFFSETS) for r in range(8) for c in range(8)]
+RAY_SQUARES = [tuple(ray_squares(r, c, d) for d in DIRECTIONS) for r in range(8) for c in range(8)] # [square][direction index]
+
 class GameState() :
-    def __init__(self) :
+    def __init__(self, fen=None) :
         # board is 8x8 2d list, each element has 2 characters
         # The first character represents the color of the piece, 'b' or 'w'
         # The second character represents the type of the piece, 'K', 'Q', 'R', 'B', 'N', or 'p'
@@ -30,55 +89,240 @@ class GameState() :
         self.check_mate = False
         self.stale_mate = False
         self.enpassant_possible = () # coordinates for the square where an enpassant capture is possible
-        self.enpassant_possible_log = [self.enpassant_possible]
-        self.current_castling_rights = CastleRights(True, True, True, True) # have any rules been broken (not if castling is possible)
-        self.castle_rights_log = [CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                               self.current_castling_rights.wqs, self.current_castling_rights.bqs)]
-        self.pins = []
+        self.castling_rights = ALL_CASTLING_RIGHTS # bits of the castles no rule has ruled out yet
+        self.pins = NO_PINS # pin direction of every square (None when the piece there isn't pinned)
         self.checks = []
+        self.check_block_squares = () # squares a non king move has to land on to answer a single check
+        self.zobrist_key = self.compute_zobrist_key()
+        self.board_score = self.compute_board_score() # material + piece square score in tenths of a pawn, positive is good for white
+        self.undo_stack = [0] * UNDO_STACK_SIZE # undo record of ply i is at index i
+        self.piece_count = 32 # pieces on the board, kings included
+        self.halfmove_clock = 0 # FEN move counters of the position the game started from (move_log extends them)
+        self.fullmove_number = 1
+        if fen is not None :
+            self.load_fen(fen)
+
+    '''
+    Sets up the position described by a FEN string (piece placement, side to move, castling, en passant,
+    and the optional halfmove clock and fullmove number). The first four fields of an EPD line work too
+    '''
+    def load_fen(self, fen) :
+        fields = fen.split()
+        if len(fields) < 4 :
+            raise ValueError(f"Invalid FEN: {fen}")
+        placement, turn, castling, enpassant = fields[:4]
+
+        rows = placement.split('/')
+        if len(rows) != 8 :
+            raise ValueError(f"Invalid FEN piece placement: {placement}")
+        board = []
+        king_counts = {'w' : 0, 'b' : 0}
+        for r, fen_row in enumerate(rows) :
+            row = []
+            for char in fen_row :
+                if char.isdigit() :
+                    row.extend(['--'] * int(char))
+                else :
+                    color = 'w' if char.isupper() else 'b'
+                    piece = 'p' if char.lower() == 'p' else char.upper()
+                    if piece not in self.move_functions :
+                        raise ValueError(f"Invalid FEN piece: {char}")
+                    if piece == 'K' :
+                        king_counts[color] += 1
+                        if color == 'w' :
+                            self.white_king_loc = (r, len(row))
+                        else :
+                            self.black_king_loc = (r, len(row))
+                    row.append(color + piece)
+            if len(row) != 8 :
+                raise ValueError(f"Invalid FEN row: {fen_row}")
+            board.append(row)
+        # without exactly one king a side the king locations would be stale and move generation silently wrong
+        if king_counts['w'] != 1 or king_counts['b'] != 1 :
+            raise ValueError(f"Invalid FEN kings (each side needs exactly one): {placement}")
+        self.board = board
+
+        if turn not in ('w', 'b') :
+            raise ValueError(f"Invalid FEN side to move: {turn}")
+        self.white_to_move = turn == 'w'
+        self.castling_rights = (('K' in castling) * WHITE_KING_SIDE | ('k' in castling) * BLACK_KING_SIDE |
+                                ('Q' in castling) * WHITE_QUEEN_SIDE | ('q' in castling) * BLACK_QUEEN_SIDE)
+        if enpassant == '-' :
+            self.enpassant_possible = ()
+        else :
+            self.enpassant_possible = (Move.ranks_to_rows[enpassant[1]], Move.files_to_cols[enpassant[0]])
+        self.move_log = []
+        self.in_check = self.check_mate = self.stale_mate = False
+        self.zobrist_key = self.compute_zobrist_key()
+        self.board_score = self.compute_board_score()
+        self.piece_count = sum(piece != '--' for row in board for piece in row)
+        try :
+            self.halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+            self.fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError :
+            raise ValueError(f"Invalid FEN move counters: {fen}")
+
+    '''
+    Returns the FEN string of the current position
+    '''
+    def get_fen(self) :
+        rows = []
+        for row in self.board :
+            fen_row = ""
+            empty = 0
+            for piece in row :
+                if piece == '--' :
+                    empty += 1
+                    continue
+                if empty :
+                    fen_row += str(empty)
+                    empty = 0
+                fen_row += piece[1].upper() if piece[0] == 'w' else piece[1].lower()
+            rows.append(fen_row + (str(empty) if empty else ""))
+        castling = "".join(char for char, right in (('K', WHITE_KING_SIDE), ('Q', WHITE_QUEEN_SIDE),
+                                                     ('k', BLACK_KING_SIDE), ('q', BLACK_QUEEN_SIDE))
+                           if self.castling_rights & right)
+        enpassant = "-"
+        if self.enpassant_possible != () :
+            enpassant = Move.cols_to_files[self.enpassant_possible[1]] + Move.rows_to_ranks[self.enpassant_possible[0]]
+        # the halfmove clock counts the moves since the last capture or pawn move
+        halfmove_clock = 0
+        for move in reversed(self.move_log) :
+            if move.piece_moved[1] == 'p' or move.piece_captured != '--' :
+                break
+            halfmove_clock += 1
+        else :
+            halfmove_clock += self.halfmove_clock
+        # plies since white's move of the first full move (one more when the game started with black to move)
+        plies = len(self.move_log) + (0 if self.white_to_move == (len(self.move_log) % 2 == 0) else 1)
+        fullmove_number = self.fullmove_number + plies // 2
+        return " ".join(("/".join(rows), 'w' if self.white_to_move else 'b', castling or "-", enpassant,
+                         str(halfmove_clock), str(fullmove_number)))
+
+    '''
+    Computes the material and piece square score of the current position from scratch
+    '''
+    def compute_board_score(self) :
+        score = 0
+        for r in range(8) :
+            for c in range(8) :
+                piece = self.board[r][c]
+                if piece != '--' :
+                    score += piece_square_values[piece][r * 8 + c]
+        return score
+
+    '''
+    Computes the Zobrist key of the current position from scratch
+    '''
+    def compute_zobrist_key(self) :
+        key = 0
+        for r in range(8) :
+            for c in range(8) :
+                piece = self.board[r][c]
+                if piece != '--' :
+                    key ^= ZOBRIST_PIECES[piece][r * 8 + c]
+        if not self.white_to_move :
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_CASTLING[self.castling_rights]
+        if self.enpassant_possible != () :
+            key ^= ZOBRIST_ENPASSANT[self.enpassant_possible[1]]
+        return key
 
     '''
     Takes a move as a parameter and executes it (will not work for castling, en passant, and promotion)
     '''
     def make_move(self, move) :
-        self.board[move.start_row][move.start_col] = "--"
-        self.board[move.end_row][move.end_col] = move.piece_moved
+        previous_enpassant = self.enpassant_possible
+        previous_castling_rights = self.castling_rights
+        ply = len(self.move_log)
+        if ply == len(self.undo_stack) :
+            self.undo_stack.extend([0] * ply)
+        enpassant_code = 0 if previous_enpassant == () else previous_enpassant[0] * 8 + previous_enpassant[1] + 1
+        self.undo_stack[ply] = (previous_castling_rights | enpassant_code << UNDO_ENPASSANT_SHIFT |
+                                (self.board_score + UNDO_SCORE_OFFSET) << UNDO_SCORE_SHIFT | self.zobrist_key << UNDO_KEY_SHIFT)
+        # decodes the move's pieces (if the generator didn't fill them in) while the board still shows them
+        piece_moved, piece_captured = move.pieces or move.decode_pieces()
+        board = self.board
+        start_row, start_col, end_row, end_col = move.start_row, move.start_col, move.end_row, move.end_col
+        # the piece that ends up on the end square, a pawn reaching the last row promotes to a queen
+        piece_placed = piece_moved[0] + 'Q' if piece_moved[1] == 'p' and (end_row == 0 or end_row == 7) else piece_moved
+        board[start_row][start_col] = "--"
+        board[end_row][end_col] = piece_placed
         self.move_log.append(move)
         self.white_to_move = not self.white_to_move
         # update the king's location if needed
-        if move.piece_moved == "wK" :
-            self.white_king_loc = (move.end_row, move.end_col)
-        if move.piece_moved == "bK" :
-            self.black_king_loc = (move.end_row, move.end_col)
-        
-        if move.is_pawn_promotion :
-            self.board[move.end_row][move.end_col] = move.piece_moved[0] + 'Q'
-        
+        if piece_moved == "wK" :
+            self.white_king_loc = (end_row, end_col)
+        elif piece_moved == "bK" :
+            self.black_king_loc = (end_row, end_col)
+
         if move.is_enpassant_move :
-            self.board[move.start_row][move.end_col] = '--' # capturing the pawn
-        
+            board[start_row][end_col] = '--' # capturing the pawn
+        if piece_captured != '--' :
+            self.piece_count -= 1
+
         # update enpassant possible variable on 2 square pawn advances
-        if move.piece_moved[1] == "p" and abs(move.start_row - move.end_row) == 2 :
-            self.enpassant_possible = ((move.start_row + move.end_row) // 2, move.start_col)
+        if piece_moved[1] == "p" and abs(start_row - end_row) == 2 :
+            self.enpassant_possible = ((start_row + end_row) // 2, start_col)
         else :
             self.enpassant_possible = ()
 
         # castle move
         if move.is_castle_move :
-            if move.end_col - move.start_col == 2 : # kingside castle
-                self.board[move.end_row][move.end_col - 1] = self.board[move.end_row][move.end_col + 1] # moves the rook
-                self.board[move.end_row][move.end_col + 1] = '--' # erase the old rook
+            if end_col - start_col == 2 : # kingside castle
+                board[end_row][end_col - 1] = board[end_row][end_col + 1] # moves the rook
+                board[end_row][end_col + 1] = '--' # erase the old rook
             else : # queenside castle
-                self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][move.end_col - 2] # moves the rook
-                self.board[move.end_row][move.end_col - 2] = '--' # erase the old rook
-
+                board[end_row][end_col + 1] = board[end_row][end_col - 2] # moves the rook
+                board[end_row][end_col - 2] = '--' # erase the old rook
 
         # update castling rights - whenever its a rook or a king move
         self.update_castle_rights(move)
-        self.castle_rights_log.append(CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                               self.current_castling_rights.wqs, self.current_castling_rights.bqs))
-        
-        self.enpassant_possible_log.append(self.enpassant_possible)
+        self.update_zobrist_key(move, piece_moved, piece_captured, piece_placed, previous_enpassant, previous_castling_rights)
+        self.update_board_score(move, piece_moved, piece_captured, piece_placed)
+
+    '''
+    Adds the score changes made by the move to board_score (make_move saved the old score for undo)
+    '''
+    def update_board_score(self, move, piece_moved, piece_captured, piece_placed) :
+        end_sq = move.end_row * 8 + move.end_col
+        score = (self.board_score - piece_square_values[piece_moved][move.start_row * 8 + move.start_col]
+                 + piece_square_values[piece_placed][end_sq])
+        if piece_captured != '--' :
+            captured_sq = move.start_row * 8 + move.end_col if move.is_enpassant_move else end_sq
+            score -= piece_square_values[piece_captured][captured_sq]
+        if move.is_castle_move :
+            rook_values = piece_square_values[piece_moved[0] + 'R']
+            row = move.end_row * 8
+            if move.end_col - move.start_col == 2 : # kingside
+                score += rook_values[row + 5] - rook_values[row + 7]
+            else : # queenside
+                score += rook_values[row + 3] - rook_values[row]
+        self.board_score = score
+
+    '''
+    XOR the features changed by the move in and out of the Zobrist key (make_move saved the old key for undo)
+    '''
+    def update_zobrist_key(self, move, piece_moved, piece_captured, piece_placed, previous_enpassant, previous_castling_rights) :
+        end_sq = move.end_row * 8 + move.end_col
+        key = (self.zobrist_key ^ ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_PIECES[piece_moved][move.start_row * 8 + move.start_col]
+               ^ ZOBRIST_PIECES[piece_placed][end_sq])
+        if piece_captured != '--' :
+            captured_sq = move.start_row * 8 + move.end_col if move.is_enpassant_move else end_sq
+            key ^= ZOBRIST_PIECES[piece_captured][captured_sq]
+        if move.is_castle_move :
+            rook = ZOBRIST_PIECES[piece_moved[0] + 'R']
+            row = move.end_row * 8
+            if move.end_col - move.start_col == 2 : # kingside
+                key ^= rook[row + 7] ^ rook[row + 5]
+            else : # queenside
+                key ^= rook[row] ^ rook[row + 3]
+        if previous_enpassant != () :
+            key ^= ZOBRIST_ENPASSANT[previous_enpassant[1]]
+        if self.enpassant_possible != () :
+            key ^= ZOBRIST_ENPASSANT[self.enpassant_possible[1]]
+        key ^= ZOBRIST_CASTLING[previous_castling_rights] ^ ZOBRIST_CASTLING[self.castling_rights]
+        self.zobrist_key = key
 
     '''
     Undo the last move made
@@ -87,25 +331,25 @@ class GameState() :
         self.check_mate = self.stale_mate = False
         if self.move_log :
             move = self.move_log.pop()
-            self.board[move.start_row][move.start_col] = move.piece_moved
-            self.board[move.end_row][move.end_col] = move.piece_captured
+            record = self.undo_stack[len(self.move_log)]
+            self.castling_rights = record & ALL_CASTLING_RIGHTS
+            self.enpassant_possible = ENPASSANT_SQUARES[(record >> UNDO_ENPASSANT_SHIFT) & 0x7F]
+            self.board_score = ((record >> UNDO_SCORE_SHIFT) & 0xFFFFF) - UNDO_SCORE_OFFSET
+            self.zobrist_key = record >> UNDO_KEY_SHIFT
+            piece_moved, piece_captured = move.pieces # make_move decoded them
+            if piece_captured != '--' :
+                self.piece_count += 1
+            self.board[move.start_row][move.start_col] = piece_moved
+            self.board[move.end_row][move.end_col] = piece_captured
             self.white_to_move = not self.white_to_move
             # update the king's location if needed
-            if move.piece_moved == "wK" :
+            if piece_moved == "wK" :
                 self.white_king_loc = (move.start_row, move.start_col)
-            elif move.piece_moved == "bK" :
+            elif piece_moved == "bK" :
                 self.black_king_loc = (move.start_row, move.start_col)
             if move.is_enpassant_move :
                 self.board[move.end_row][move.end_col] = "--"
-                self.board[move.start_row][move.end_col] = move.piece_captured
-
-            if len(self.enpassant_possible_log) > 0 :
-                self.enpassant_possible_log.pop()
-            self.enpassant_possible = self.enpassant_possible_log[-1]
-
-            if len(self.castle_rights_log) > 1 :
-                self.castle_rights_log.pop()
-            self.current_castling_rights = self.castle_rights_log[-1]
+                self.board[move.start_row][move.end_col] = piece_captured
             # undo castle move
             if move.is_castle_move :
                 if move.end_col - move.start_col == 2 : # kingside
@@ -117,53 +361,55 @@ class GameState() :
 
 
 
+    '''
+    Passes the turn to the other side without moving (for null move pruning, never legal in a game)
+    The null move isn't added to the move log, returns the en passant square undo_null_move needs back
+    '''
+    def make_null_move(self) :
+        previous_enpassant = self.enpassant_possible
+        key = self.zobrist_key ^ ZOBRIST_BLACK_TO_MOVE
+        if previous_enpassant != () :
+            key ^= ZOBRIST_ENPASSANT[previous_enpassant[1]]
+            self.enpassant_possible = ()
+        self.zobrist_key = key
+        self.white_to_move = not self.white_to_move
+        return previous_enpassant
+
+    def undo_null_move(self, previous_enpassant) :
+        self.check_mate = self.stale_mate = False
+        key = self.zobrist_key ^ ZOBRIST_BLACK_TO_MOVE
+        if previous_enpassant != () :
+            key ^= ZOBRIST_ENPASSANT[previous_enpassant[1]]
+        self.enpassant_possible = previous_enpassant
+        self.zobrist_key = key
+        self.white_to_move = not self.white_to_move
+
+    '''
+    If the side to move has a piece other than its king and pawns (positions without one are prone to zugzwang)
+    '''
+    def has_non_pawn_material(self) :
+        color = 'w' if self.white_to_move else 'b'
+        for row in self.board :
+            for piece in row :
+                if piece[0] == color and piece[1] != 'p' and piece[1] != 'K' :
+                    return True
+        return False
+
     '''
     Update the castle rights given the move
     '''
     def update_castle_rights(self, move) :
-        if move.piece_moved == 'wK' :
-            self.current_castling_rights.wks = False
-            self.current_castling_rights.wqs = False
-        elif move.piece_moved == 'bK' :
-            self.current_castling_rights.bks = False
-            self.current_castling_rights.bqs = False
-        elif move.piece_moved == 'wR' :
-            if move.start_row == 7 :
-                if move.start_col == 0 : # left rook
-                    self.current_castling_rights.wqs = False
-                elif move.start_col == 7 : # right rook
-                    self.current_castling_rights.wks = False
-        elif move.piece_moved == 'bR' :
-            if move.start_row == 0 :
-                if move.start_col == 0 : # left rook
-                    self.current_castling_rights.bqs = False
-                elif move.start_col == 7 : # right rook
-                    self.current_castling_rights.bks = False
-        # if a rook is captured
-        if move.piece_captured == 'wR' :
-            if move.end_row == 7 :
-                if move.end_col == 0 :
-                    self.current_castling_rights.wqs = False
-                elif move.end_col == 7 :
-                    self.current_castling_rights.wks = False
-        elif move.piece_captured == 'bR' :
-            if move.end_row == 0 :
-                if move.end_col == 0 :
-                    self.current_castling_rights.bqs = False
-                elif move.end_col == 7 :
-                    self.current_castling_rights.bks = False
+        self.castling_rights &= (CASTLING_RIGHTS_MASK[move.start_row * 8 + move.start_col] &
+                                 CASTLING_RIGHTS_MASK[move.end_row * 8 + move.end_col])
 
     '''
     All moves considering checks
     '''
     def get_valid_moves(self) :
         temp_enpassant_possible = self.enpassant_possible
-        # copy the current castling rights
-        temp_castling_rights = CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                            self.current_castling_rights.wqs, self.current_castling_rights.bqs)
         moves = []
         
-        self.in_check, self.pins, self.checks = self.check_for_pins_and_checks()
+        self.in_check, self.pins, self.checks, self.check_block_squares = self.check_for_pins_and_checks()
         king_loc = self.white_king_loc if self.white_to_move else self.black_king_loc
         king_row = king_loc[0]
         king_col = king_loc[1]
@@ -175,25 +421,14 @@ class GameState() :
                 check = self.checks[0]
                 check_row = check[0]
                 check_col = check[1]
-                piece_checking = self.board[check_row][check_col]
-                valid_squares = [] # squares that pieces can move to
-                # if knight, must capture knight or move king
-                if piece_checking[1] == 'N' :
-                    valid_squares = [(check_row, check_col)]
-                else :
-                    # print(f"CHECK LOC: {check_row} {check_col}")
-                    # print(f"CHECK DIR: {check[2]} {check[3]}")
-                    for i in range(1, 8) :
-                        valid_square = (king_row + check[2] * i, king_col + check[3] * i) # check[2] and check[3] are the check directions
-                        valid_squares.append(valid_square)
-                        if valid_square[0] == check_row and valid_square[1] == check_col :
-                            break
-                    # print(f"VALID SQUARES: {valid_squares}")
+                valid_squares = self.check_block_squares # squares that pieces can move to
                 # get rid of any moves that dont block check or move king
                 for i in range(len(moves) - 1, -1, -1) :
                     if moves[i].piece_moved[1] != "K" : # move doesn't move king so it must block or capture
                         if not (moves[i].end_row, moves[i].end_col) in valid_squares : # move doesn't block check or capture piece
-                            del moves[i]
+                            # an enpassant capture removes the checking pawn without landing on its square
+                            if not (moves[i].is_enpassant_move and (moves[i].start_row, moves[i].end_col) == (check_row, check_col)) :
+                                del moves[i]
             else : # double check, king has to move
                 self.get_king_moves(king_row, king_col, moves)
         else :
@@ -204,7 +439,6 @@ class GameState() :
         else :
             self.get_castle_moves(self.black_king_loc[0], self.black_king_loc[1], moves)
 
-        self.current_castling_rights = temp_castling_rights
         self.enpassant_possible = temp_enpassant_possible
         # check for checkmate or stalemate
         if len(moves) == 0 :
@@ -215,84 +449,127 @@ class GameState() :
 
         return moves
 
+    '''
+    Lazy, staged alternative to get_valid_moves for the search
+    Works out checks and pins right away (so in_check is valid once this returns) and returns a generator that
+    yields the legal moves in stages: the hash move if it is legal here, then captures and promotions, then quiet
+    moves and castling. Each stage has its own generators and only runs when the caller asks for its first move,
+    so a cutoff on the hash move skips generating the captures, and a cutoff on a capture skips the quiet moves
+    order(moves, captures) sorts a stage before it is yielded, captures tells it which stage it got
+    The generators fill in the moved and captured pieces of every move from the squares they look at,
+    so splitting and ordering the stages never decodes a move. captures_only stops after the captures (unless in check)
+    When no move is yielded at all check_mate or stale_mate is set like get_valid_moves does
+    '''
+    def generate_moves(self, hash_move_id=None, order=None, captures_only=False) :
+        self.check_mate = self.stale_mate = False
+        self.in_check, self.pins, self.checks, self.check_block_squares = self.check_for_pins_and_checks()
+        if self.in_check : # evasions are few, generate them all with the usual check filtering
+            return stage_moves(self.get_valid_moves(), hash_move_id, order)
+        # the caller makes and undoes moves between stages, which overwrites self.pins, so keep them here
+        return self.generate_staged_moves(self.pins, None if captures_only else hash_move_id, order, captures_only)
+
+    def generate_staged_moves(self, pins, hash_move_id, order, captures_only) :
+        hash_move = None
+        if hash_move_id is not None :
+            hash_move = self.get_hash_move(hash_move_id, pins)
+            if hash_move is not None :
+                yield hash_move
+
+        self.pins = pins
+        captures = self.get_all_possible_moves(quiet_moves=False)
+        if hash_move is not None :
+            captures = [move for move in captures if move.move_id != hash_move_id]
+        yield from (order(captures, True) if order is not None else captures)
+        if captures_only :
+            return
+
+        self.pins = pins # searching the captures overwrote the pins and in_check
+        self.in_check = False
+        quiet_moves = self.get_all_possible_moves(captures=False)
+        king_row, king_col = self.white_king_loc if self.white_to_move else self.black_king_loc
+        self.get_castle_moves(king_row, king_col, quiet_moves)
+        if hash_move is not None :
+            quiet_moves = [move for move in quiet_moves if move.move_id != hash_move_id]
+        yield from (order(quiet_moves, False) if order is not None else quiet_moves)
+        if hash_move is None and not captures and not quiet_moves :
+            self.stale_mate = True
+
+    '''
+    Returns the move with hash_move_id if it is legal in this position (and not in check), otherwise None
+    Only the moves of the piece on the hash move's start square are generated. Castling is left to the quiet stage
+    '''
+    def get_hash_move(self, hash_move_id, pins) :
+        start_row, start_col = divmod(hash_move_id & 63, 8)
+        piece = self.board[start_row][start_col]
+        if piece[0] != ("w" if self.white_to_move else "b") :
+            return None
+        self.pins = pins
+        moves = []
+        self.move_functions[piece[1]](start_row, start_col, moves)
+        for move in moves :
+            if move.move_id == hash_move_id :
+                return move
+        return None
+
     '''
     All moves without considering checks
+    captures=False leaves out captures and promotions, quiet_moves=False every other move
     '''
-    def get_all_possible_moves(self) :
+    def get_all_possible_moves(self, captures=True, quiet_moves=True) :
         moves = []
+        turn = 'w' if self.white_to_move else 'b'
         for r in range(len(self.board)) :
-            for c in range(len(self.board[r])) :
-                square = self.board[r][c]
-                turn = square[0] # get color of piece
-
+            row = self.board[r]
+            for c in range(len(row)) :
+                square = row[c]
                 # then we should look at this piece
-                if (turn == 'w' and self.white_to_move) or (turn == 'b' and not self.white_to_move): 
-                    piece = square[1]
+                if square[0] == turn :
                     # call the appropriate move function based on piece type
-                    self.move_functions[piece](r, c, moves)
-        
+                    self.move_functions[square[1]](r, c, moves, captures, quiet_moves)
+
         return moves
 
     '''
     Get all the pawn moves for the pawn located at row, col and add these moves to the list of valid moves
+    Promotions count as captures, so captures=False leaves them out along with the captures
     '''
-    def get_pawn_moves(self, r, c, moves) :
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins) - 1, -1, -1) :
-            if self.pins[i][0] == r and self.pins[i][1] == c :
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                del self.pins[i]
-                break
+    def get_pawn_moves(self, r, c, moves, captures=True, quiet_moves=True) :
+        pin_direction = self.pins[r * 8 + c]
+        piece_pinned = pin_direction is not None
+        board = self.board
+        pawn = board[r][c]
+
+        if self.white_to_move : # white pawns move up the board
+            dr, start_row, enemy_color, color = -1, 6, "b", "w"
+        else :
+            dr, start_row, enemy_color, color = 1, 1, "w", "b"
+        end_row = r + dr
+        # 1 and 2 square advance
+        if board[end_row][c] == "--" and (not piece_pinned or pin_direction in ((-1, 0), (1, 0))) :
+            if end_row == 0 or end_row == 7 :
+                if captures :
+                    moves.append(Move((r, c), (end_row, c), board, pieces=(pawn, "--")))
+            elif quiet_moves :
+                moves.append(Move((r, c), (end_row, c), board, pieces=(pawn, "--")))
+                if r == start_row and board[end_row + dr][c] == "--" :
+                    moves.append(Move((r, c), (end_row + dr, c), board, pieces=(pawn, "--")))
+        if not captures :
+            return
+        # captures to the left
+        if c - 1 >= 0 and (not piece_pinned or pin_direction in ((dr, -1), (-dr, 1))) :
+            target = board[end_row][c - 1]
+            if target[0] == enemy_color :
+                moves.append(Move((r, c), (end_row, c - 1), board, pieces=(pawn, target)))
+            elif (end_row, c - 1) == self.enpassant_possible :
+                self.check_enpassant_possible(r, c, color, moves, False)
+        # captures to the right
+        if c + 1 <= 7 and (not piece_pinned or pin_direction in ((dr, 1), (-dr, -1))) :
+            target = board[end_row][c + 1]
+            if target[0] == enemy_color :
+                moves.append(Move((r, c), (end_row, c + 1), board, pieces=(pawn, target)))
+            elif (end_row, c + 1) == self.enpassant_possible :
+                self.check_enpassant_possible(r, c, color, moves, True)
 
-        if self.white_to_move : # then we will look at the white pawns
-            king_row, king_col = self.white_king_loc
-            if self.board[r - 1][c] == "--" : 
-                if not piece_pinned or pin_direction == (-1, 0) :
-                    moves.append(Move((r, c), (r - 1, c), self.board))
-                    if r == 6 and self.board[r - 2][c] == "--":
-                        moves.append(Move((r, c), (r - 2, c), self.board))
-            # captures to the left
-            if c - 1 >= 0 :
-                if self.board[r - 1][c - 1][0] == "b" :
-                    if not piece_pinned or pin_direction == (-1, -1) :
-                        moves.append(Move((r, c), (r - 1, c - 1), self.board))
-                elif (r-1, c-1) == self.enpassant_possible :
-                    if not piece_pinned or pin_direction == (-1, -1) :
-                        self.check_enpassant_possible(r, c, "w", moves, False)
-            # captures to the right
-            if c + 1 <= 7 :
-                if self.board[r - 1][c + 1][0] == "b" :
-                    if not piece_pinned or pin_direction == (-1, 1) :
-                        moves.append(Move((r, c), (r - 1, c + 1), self.board))
-                elif (r-1, c+1) == self.enpassant_possible :
-                    if not piece_pinned or pin_direction == (-1, 1) :
-                        self.check_enpassant_possible(r, c, "w", moves, True)
-        else : # we look at black pawns
-            # 1 and 2 square advance
-            if self.board[r + 1][c] == "--" : 
-                if not piece_pinned or pin_direction == (1, 0) :
-                    moves.append(Move((r, c), (r + 1, c), self.board))
-                    if r == 1 and self.board[r + 2][c] == "--":
-                        moves.append(Move((r, c), (r + 2, c), self.board))
-            # captures to the left
-            if c - 1 >= 0 :
-                if self.board[r + 1][c - 1][0] == "w" :
-                    if not piece_pinned or pin_direction == (1, -1) :
-                        moves.append(Move((r, c), (r + 1, c - 1), self.board))
-                elif (r+1, c-1) == self.enpassant_possible :
-                    if not piece_pinned or pin_direction == (1, -1) :
-                        self.check_enpassant_possible(r, c, "b", moves, False)
-            # captures to the right
-            if c + 1 <= 7 :
-                if self.board[r + 1][c + 1][0] == "w" :
-                    if not piece_pinned or pin_direction == (1, 1) :
-                        moves.append(Move((r, c), (r + 1, c + 1), self.board))
-                elif (r+1, c+1) == self.enpassant_possible :
-                    if not piece_pinned or pin_direction == (1, 1) :
-                        self.check_enpassant_possible(r, c, "b", moves, True)
-    
     '''
     Helper function for determining if an enpassant move can be made
     '''
@@ -318,117 +595,96 @@ class GameState() :
                 elif square != "--" :
                     blocking_piece = True
         if not attacking_piece or blocking_piece :
+            pieces = (color + "p", ("w" if color == "b" else "b") + "p")
             if is_right : # c + 1
                 if color == "b" :
-                    moves.append(Move((r, c), (r + 1, c + 1), self.board, is_enpassant_move=True))
+                    moves.append(Move((r, c), (r + 1, c + 1), self.board, is_enpassant_move=True, pieces=pieces))
                 else :
-                    moves.append(Move((r, c), (r - 1, c + 1), self.board, is_enpassant_move=True))
+                    moves.append(Move((r, c), (r - 1, c + 1), self.board, is_enpassant_move=True, pieces=pieces))
             else : # c - 1
                 if color == "b" :
-                    moves.append(Move((r, c), (r + 1, c - 1), self.board, is_enpassant_move=True))
+                    moves.append(Move((r, c), (r + 1, c - 1), self.board, is_enpassant_move=True, pieces=pieces))
                 else :
-                    moves.append(Move((r, c), (r - 1, c - 1), self.board, is_enpassant_move=True))
+                    moves.append(Move((r, c), (r - 1, c - 1), self.board, is_enpassant_move=True, pieces=pieces))
     
     '''
-    Get the moves for a directional piece (R, B, Q)
-    '''
-    def get_directional_piece_moves(self, piece, r, c, moves, directions) :
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins) - 1, -1, -1) :
-            if self.pins[i][0] == r and self.pins[i][1] == c :
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                if piece == "R" :
-                    if self.board[r][c][1] != "Q" :
-                        del self.pins[i]
-                break
-        
+    Get the moves for a directional piece (R, B, Q), walking the precomputed rays for the given direction indices
+    '''
+    def get_directional_piece_moves(self, r, c, moves, directions, captures=True, quiet_moves=True) :
+        pin_direction = self.pins[r * 8 + c]
+        piece_pinned = pin_direction is not None
         opposite_color = "b" if self.white_to_move else "w"
-
-        for d in directions :
-            for i in range(1, 8) :
-                end_row = r + d[0] * i
-                end_col = c + d[1] * i
-                if 0 <= end_row < 8 and 0 <= end_col < 8 :
-                    if not piece_pinned or pin_direction == d or pin_direction == (-d[0], -d[1]) :
-                        end_piece = self.board[end_row][end_col]
-                        if end_piece == "--" : # empty space valid
-                            moves.append(Move((r, c), (end_row, end_col), self.board))
-                        elif end_piece[0] == opposite_color : # enemy piece valid
-                            moves.append(Move((r, c), (end_row, end_col), self.board))
-                            break
-                        else : # friendly piece invalid
-                            break
-                else : # off board
+        board = self.board
+        piece = board[r][c]
+        quiet_pieces = (piece, "--")
+        rays = RAY_SQUARES[r * 8 + c]
+
+        for j in directions :
+            if piece_pinned :
+                d = DIRECTIONS[j]
+                if pin_direction != d and pin_direction != (-d[0], -d[1]) : # pinned pieces only move along the pin
+                    continue
+            for end_sq in rays[j] :
+                end_piece = board[end_sq[0]][end_sq[1]]
+                if end_piece == "--" : # empty space valid
+                    if quiet_moves :
+                        moves.append(Move((r, c), end_sq, board, pieces=quiet_pieces))
+                else :
+                    if captures and end_piece[0] == opposite_color : # enemy piece valid, a friendly one isn't
+                        moves.append(Move((r, c), end_sq, board, pieces=(piece, end_piece)))
                     break
     '''
     Get all the rook moves for the rook located at row, col and add these moves to the list of valid moves
     '''
-    def get_rook_moves(self, r, c, moves) :
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1))
-        self.get_directional_piece_moves("R", r, c, moves, directions)
+    def get_rook_moves(self, r, c, moves, captures=True, quiet_moves=True) :
+        self.get_directional_piece_moves(r, c, moves, ROOK_DIRECTIONS, captures, quiet_moves)
 
     '''
     Get all the bishop moves for the bishop located at row, col and add these moves to the list of valid moves
     '''
-    def get_bishop_moves(self, r, c, moves) :
-        directions = ((-1, -1), (-1, 1), (1, -1), (1, 1))
-        self.get_directional_piece_moves("B", r, c, moves, directions)
+    def get_bishop_moves(self, r, c, moves, captures=True, quiet_moves=True) :
+        self.get_directional_piece_moves(r, c, moves, BISHOP_DIRECTIONS, captures, quiet_moves)
 
     '''
     Get all the queen moves for the queen located at row, col and add these moves to the list of valid moves
     '''
-    def get_queen_moves(self, r, c, moves) :
-        directions = ((-1, -1), (-1, 1), (1, -1), (1, 1), (-1, 0), (0, -1), (1, 0), (0, 1))
-        self.get_directional_piece_moves("Q", r, c, moves, directions)
+    def get_queen_moves(self, r, c, moves, captures=True, quiet_moves=True) :
+        self.get_directional_piece_moves(r, c, moves, QUEEN_DIRECTIONS, captures, quiet_moves)
 
     '''
     Get all the knight moves for the knight located at row, col and add these moves to the list of valid moves
     '''
-    def get_knight_moves(self, r, c, moves) :
-        piece_pinned = False
-        for i in range(len(self.pins) - 1, -1, -1) :
-            if self.pins[i][0] == r and self.pins[i][1] == c :
-                piece_pinned = True
-                del self.pins[i]
-                break
+    def get_knight_moves(self, r, c, moves, captures=True, quiet_moves=True) :
+        if self.pins[r * 8 + c] is not None :
+            return # a pinned knight can never move along the pin
 
+        enemy_color = "b" if self.white_to_move else "w"
+        board = self.board
+        knight = board[r][c]
+        for end_sq in KNIGHT_SQUARES[r * 8 + c] :
+            end_piece = board[end_sq[0]][end_sq[1]]
+            if (quiet_moves and end_piece == "--") or (captures and end_piece[0] == enemy_color) :
+                moves.append(Move((r, c), end_sq, board, pieces=(knight, end_piece)))
+
+    def get_king_moves(self, r, c, moves, captures=True, quiet_moves=True) :
         ally_color = "w" if self.white_to_move else "b"
-        directions = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-        for d in directions :
-            end_row = d[0] + r
-            end_col = d[1] + c
-            if 0 <= end_row < 8 and 0 <= end_col < 8 :
-                if not piece_pinned :
-                    end_piece = self.board[end_row][end_col]
-                    
-                    if end_piece[0] != ally_color :
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-
-    def get_king_moves(self, r, c, moves) :
-        row_moves = (-1, -1, -1, 0, 0, 1, 1, 1)
-        col_moves = (-1, 0, 1, -1, 1, -1, 0, 1)
-        ally_color = "w" if self.white_to_move else "b"
-        for i in range(8) :
-            end_row = row_moves[i] + r
-            end_col = col_moves[i] + c
-            if 0 <= end_row < 8 and 0 <= end_col < 8 :
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] != ally_color :
-                    # place king on end square and check for checks
-                    if ally_color == 'w' :
-                        self.white_king_loc = (end_row, end_col)
-                    else :
-                        self.black_king_loc = (end_row, end_col)
-                    in_check, pins, checks = self.check_for_pins_and_checks()
-                    if not in_check :
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-                    # place king back on original location
-                    if ally_color == 'w' :
-                        self.white_king_loc = (r, c)
-                    else :
-                        self.black_king_loc = (r, c)
+        enemy_color = "b" if self.white_to_move else "w"
+        # lift the king off the board so a slider checking it still attacks the squares behind it
+        self.board[r][c] = "--"
+        targets = []
+        for end_row, end_col in KING_SQUARES[r * 8 + c] :
+            end_piece = self.board[end_row][end_col]
+            if end_piece == "--" :
+                if not quiet_moves :
+                    continue
+            elif end_piece[0] == ally_color or not captures :
+                continue
+            if not self.is_square_attacked(end_row, end_col, enemy_color) :
+                targets.append(((end_row, end_col), end_piece))
+        king = ally_color + "K"
+        self.board[r][c] = king
+        for end_sq, end_piece in targets :
+            moves.append(Move((r, c), end_sq, self.board, pieces=(king, end_piece)))
 
     '''
     Get all valid castle moves for the king at (r, c) and add them to the list of moves
@@ -436,36 +692,69 @@ class GameState() :
     def get_castle_moves(self, r, c, moves) :
         if self.in_check :
             return # we can't castle while in check
-        if (self.white_to_move and self.current_castling_rights.wks) or (not self.white_to_move and self.current_castling_rights.bks) :
+        if self.castling_rights & (WHITE_KING_SIDE if self.white_to_move else BLACK_KING_SIDE) :
             self.get_king_side_castle_moves(r, c, moves)
-        if (self.white_to_move and self.current_castling_rights.wqs) or (not self.white_to_move and self.current_castling_rights.bqs) :
+        if self.castling_rights & (WHITE_QUEEN_SIDE if self.white_to_move else BLACK_QUEEN_SIDE) :
             self.get_queen_side_castle_moves(r, c, moves)
 
     def get_king_side_castle_moves(self, r, c, moves) :
         if self.board[r][c+1] == '--'  and self.board[r][c+2] == '--' :
             if not self.square_under_attack(r, c+1) and not self.square_under_attack(r, c+2):
-                moves.append(Move((r, c), (r, c+2), self.board, is_castle_move=True))
+                moves.append(Move((r, c), (r, c+2), self.board, is_castle_move=True, pieces=(self.board[r][c], "--")))
 
     def get_queen_side_castle_moves(self, r, c, moves) :
         if self.board[r][c-1] == '--'  and self.board[r][c-2] == '--' and self.board[r][c-3] == '--':
             if not self.square_under_attack(r, c-1) and not self.square_under_attack(r, c-2) :
-                moves.append(Move((r, c), (r, c-2), self.board, is_castle_move=True))
+                moves.append(Move((r, c), (r, c-2), self.board, is_castle_move=True, pieces=(self.board[r][c], "--")))
 
+    '''
+    Returns if the square (r, c) is attacked by the opponent of the side to move
+    '''
     def square_under_attack(self, r, c) :
-        self.white_to_move = not self.white_to_move
-        opp_moves = self.get_all_possible_moves()
-        self.white_to_move = not self.white_to_move
-        for move in opp_moves :
-            if move.end_row == r and move.end_col == c :
+        return self.is_square_attacked(r, c, "b" if self.white_to_move else "w")
+
+    '''
+    Returns if any piece of attacker_color attacks the square (r, c)
+    Looks outward from the square with the attack tables instead of generating the attacker's moves
+    '''
+    def is_square_attacked(self, r, c, attacker_color) :
+        board = self.board
+        sq = r * 8 + c
+        # pawns attack diagonally forward, so an attacking pawn sits one row back towards its own side
+        pawn_row = r + 1 if attacker_color == "w" else r - 1
+        if 0 <= pawn_row < 8 :
+            pawn = attacker_color + "p"
+            if (c > 0 and board[pawn_row][c - 1] == pawn) or (c < 7 and board[pawn_row][c + 1] == pawn) :
                 return True
+        knight = attacker_color + "N"
+        for end_row, end_col in KNIGHT_SQUARES[sq] :
+            if board[end_row][end_col] == knight :
+                return True
+        king = attacker_color + "K"
+        for end_row, end_col in KING_SQUARES[sq] :
+            if board[end_row][end_col] == king :
+                return True
+        rays = RAY_SQUARES[sq]
+        straight_sliders = (attacker_color + "R", attacker_color + "Q")
+        diagonal_sliders = (attacker_color + "B", attacker_color + "Q")
+        for j in range(8) :
+            sliders = straight_sliders if j < 4 else diagonal_sliders
+            for end_row, end_col in rays[j] :
+                end_piece = board[end_row][end_col]
+                if end_piece != "--" : # first piece on the ray blocks everything behind it
+                    if end_piece in sliders :
+                        return True
+                    break
         return False
 
     '''
-    Returns if the player is in check, a list of pins, and a list of checks
+    Returns if the player is in check, the pin map, a list of checks and the squares that answer a single check
+    The pin map has the direction (from the king) of the pin for every pinned square and None everywhere else
     '''
     def check_for_pins_and_checks(self) :
-        pins = [] # squares where the allied pinned piece is and direction pinned from
+        pins = NO_PINS # copied into a list when the first pin is found
         checks = [] # squares where enemy is applying a check
+        block_squares = () # capturing the checker or landing between it and the king
         in_check = False
 
         if self.white_to_move :
@@ -479,63 +768,52 @@ class GameState() :
             start_row = self.black_king_loc[0]
             start_col = self.black_king_loc[1]
         # check outward from king for pins and checks, keep track of pins
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for j in range(len(directions)) :
-            d = directions[j]
+        board = self.board
+        rays = RAY_SQUARES[start_row * 8 + start_col]
+        for j in range(8) :
+            d = DIRECTIONS[j]
             possible_pin = ()
-            for i in range(1, 8) :
-                end_row = start_row + d[0] * i
-                end_col = start_col + d[1] * i
-                if 0 <= end_row < 8 and 0 <= end_col < 8 :
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece[0] == ally_color and end_piece[1] != "K" :
-                        if possible_pin == () : # 1st allied piece could be pinned
-                            possible_pin = (end_row, end_col, d[0], d[1])
-                        else :
+            for i, (end_row, end_col) in enumerate(rays[j], 1) :
+                end_piece = board[end_row][end_col]
+                if end_piece[0] == ally_color and end_piece[1] != "K" :
+                    if possible_pin == () : # 1st allied piece could be pinned
+                        possible_pin = (end_row, end_col, d[0], d[1])
+                    else :
+                        break
+                elif end_piece[0] == enemy_color :
+                    type = end_piece[1]
+                    # 5 possiblities in this conditional
+                    # 1) orthoginally away from king and piece is a rook
+                    # 2) diagonally away from king and piece is a bishop
+                    # 3) 1 square away diagonally from king and piece is a pawn
+                    # 4) any direction and piece is a queen
+                    # 5) any direction 1 square away and piece is a king
+                    if (0 <= j <= 3 and type == "R") or \
+                            (4 <= j <= 7 and type =="B") or \
+                            (i == 1 and type == "p" and ((enemy_color == "w" and 6 <= j <= 7) or (enemy_color == "b" and 4 <= j <= 5))) or \
+                            (type == "Q") or (i == 1 and type == "K") :
+                        if possible_pin == () : # no piece blocking to check
+                            in_check = True
+                            checks.append((end_row, end_col, d[0], d[1]))
+                            block_squares = rays[j][:i]
                             break
-                    elif end_piece[0] == enemy_color :
-                        type = end_piece[1]
-                        # 5 possiblities in this conditional
-                        # 1) orthoginally away from king and piece is a rook
-                        # 2) diagonally away from king and piece is a bishop
-                        # 3) 1 square away diagonally from king and piece is a pawn
-                        # 4) any direction and piece is a queen
-                        # 5) any direction 1 square away and piece is a king
-                        if (0 <= j <= 3 and type == "R") or \
-                                (4 <= j <= 7 and type =="B") or \
-                                (i == 1 and type == "p" and ((enemy_color == "w" and 6 <= j <= 7) or (enemy_color == "b" and 4 <= j <= 5))) or \
-                                (type == "Q") or (i == 1 and type == "K") :
-                            if possible_pin == () : # no piece blocking to check
-                                in_check = True
-                                checks.append((end_row, end_col, d[0], d[1]))
-                                break
-                            else : # piece blocking so pin
-                                pins.append(possible_pin)
-                                break
-                        else : # enemy piece not applying check
+                        else : # piece blocking so pin
+                            if pins is NO_PINS :
+                                pins = list(NO_PINS)
+                            pins[possible_pin[0] * 8 + possible_pin[1]] = d
                             break
-                else :
-                    break # off the board
+                    else : # enemy piece not applying check
+                        break
 
         # check for knight checks
-        knight_moves = ((-1, 2), (-1, -2), (1, 2), (1, -2), (2, -1), (2, 1), (-2, -1), (-2, 1))
-        for m in knight_moves :
-            end_row = start_row + m[0]
-            end_col = start_col + m[1]
-            if 0 <= end_row < 8 and 0 <= end_col < 8 :
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] == enemy_color and end_piece[1] == 'N' : # enemy knight attack king
-                    in_check = True
-                    checks.append((end_row, end_col, m[0], m[1]))
-
-        return in_check, pins, checks
-
-class CastleRights() :
-    def __init__(self, wks, bks, wqs, bqs) :
-        self.wks = wks
-        self.bks = bks
-        self.wqs = wqs
-        self.bqs = bqs
+        enemy_knight = enemy_color + "N"
+        for end_row, end_col in KNIGHT_SQUARES[start_row * 8 + start_col] :
+            if board[end_row][end_col] == enemy_knight : # enemy knight attack king
+                in_check = True
+                checks.append((end_row, end_col, end_row - start_row, end_col - start_col))
+                block_squares = ((end_row, end_col),)
+
+        return in_check, pins, checks, block_squares
 
 class Move() :
 
@@ -546,33 +824,60 @@ class Move() :
                      "e" : 4, "f" : 5, "g" : 6, "h" : 7}
     cols_to_files = {v : k for k, v in files_to_cols.items()}
 
-    def __init__(self, start_sq, end_sq, board, is_enpassant_move = False, is_castle_move = False) :
-        self.start_row = start_sq[0]
-        self.start_col = start_sq[1]
-        self.end_row = end_sq[0]
-        self.end_col = end_sq[1]
-
-        self.piece_moved = board[self.start_row][self.start_col]
-        self.piece_captured = board[self.end_row][self.end_col] # piece_captured can be "--" to represent nothing was captured
-
-        self.move_id = self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col
+    # a move is a few ints plus the board it was generated on; the pieces are only read from that board
+    # the first time something asks for them (most moves the search generates are never played or printed)
+    # Move generators that already looked at both squares pass the pieces in, then nothing is ever decoded
+    __slots__ = ("start_row", "start_col", "end_row", "end_col", "move_id", "is_enpassant_move", "is_castle_move", "board", "pieces")
 
-        self.is_pawn_promotion = ((self.piece_moved == "wp" and self.end_row == 0) or (self.piece_moved == "bp" and self.end_row == 7))
-        
+    def __init__(self, start_sq, end_sq, board, is_enpassant_move = False, is_castle_move = False, pieces = None) :
+        self.start_row, self.start_col = start_sq
+        self.end_row, self.end_col = end_sq
+        # start square | end square << 6, squares numbered row * 8 + col
+        self.move_id = (start_sq[0] << 3 | start_sq[1]) | (end_sq[0] << 3 | end_sq[1]) << 6
         self.is_enpassant_move = is_enpassant_move
-        if is_enpassant_move :
-            self.piece_captured = board[self.start_row][self.end_col]
-        # castle move
         self.is_castle_move = is_castle_move
+        self.board = board if pieces is None else None # only needed to decode the pieces, the board keeps changing
+        self.pieces = pieces # (piece_moved, piece_captured) once known
+
+    '''
+    Reads the moved and captured pieces off the board the move was generated on
+    Must happen before the move is made - make_move reads piece_moved first for this reason
+    '''
+    def decode_pieces(self) :
+        board = self.board
+        piece_moved = board[self.start_row][self.start_col]
+        if self.is_enpassant_move :
+            piece_captured = board[self.start_row][self.end_col]
+        else :
+            piece_captured = board[self.end_row][self.end_col] # piece_captured can be "--" to represent nothing was captured
+        self.pieces = (piece_moved, piece_captured)
+        self.board = None # the board keeps changing, don't hold on to it
+        return self.pieces
+
+    @property
+    def piece_moved(self) :
+        return (self.pieces or self.decode_pieces())[0]
+
+    @property
+    def piece_captured(self) :
+        return (self.pieces or self.decode_pieces())[1]
+
+    @property
+    def is_pawn_promotion(self) :
+        piece_moved = self.piece_moved
+        return (piece_moved == "wp" and self.end_row == 0) or (piece_moved == "bp" and self.end_row == 7)
 
     '''
-    Overwriting the equals method
+    Moves are equal when they go from the same square to the same square
     '''
     def __eq__(self, __value) :
         if isinstance(__value, Move) :
             return self.move_id == __value.move_id
         return False
 
+    def __hash__(self) :
+        return self.move_id
+
     '''
     Returns a move made in chess notation (for debugging purposes)
     '''
@@ -594,9 +899,50 @@ class Move() :
                 piece = ""
 
             return piece + self.get_rank_file(self.end_row, self.end_col)
-    
+
+    '''
+    Returns the move in long algebraic (UCI) notation, e.g. e2e4 or e7e8q
+    '''
+    def get_uci_notation(self) :
+        notation = self.get_rank_file(self.start_row, self.start_col) + self.get_rank_file(self.end_row, self.end_col)
+        if self.is_pawn_promotion :
+            notation += 'q'
+        return notation
+
     '''
     Helper method for printing moves
     '''
     def get_rank_file(self, r, c) :
-        return self.cols_to_files[c] + self.rows_to_ranks[r]
\ No newline at end of file
+        return self.cols_to_files[c] + self.rows_to_ranks[r]
+'''
+Yields an already generated list of moves in the same stages as GameState.generate_moves:
+the hash move, then captures and promotions, then quiet moves
+'''
+def stage_moves(moves, hash_move_id=None, order=None, captures_only=False) :
+    hash_move = None
+    captures = []
+    quiet_moves = []
+    for move in moves :
+        if move.move_id == hash_move_id :
+            hash_move = move
+        elif move.piece_captured != "--" or move.is_pawn_promotion :
+            captures.append(move)
+        else :
+            quiet_moves.append(move)
+    if hash_move is not None :
+        yield hash_move
+    yield from (order(captures, True) if order is not None else captures)
+    if not captures_only :
+        yield from (order(quiet_moves, False) if order is not None else quiet_moves)
+
+'''
+Creates a GameState using the requested position backend
+"mailbox" is the 2d board list above, "bitboard" keeps 64 bit masks per piece type (see BitboardEngine)
+'''
+def create_game_state(fen=None, backend="mailbox") :
+    if backend == "mailbox" :
+        return GameState(fen)
+    if backend == "bitboard" :
+        import BitboardEngine # imported here since BitboardEngine builds on this module
+        return BitboardEngine.BitboardGameState(fen)
+    raise ValueError(f"Unknown backend: {backend}")
@@ -1,8 +1,9 @@
 '''
 This is our main driver file. Responsible for handling user input and displaying the current GameState object
 '''
+import argparse, copy, os, queue, threading
 import pygame as py
-import ChessEngine, SmartMoveFinder
+import ChessEngine, SmartMoveFinder, Bitbases, SearchStats, Profiler
 
 BOARD_WIDTH = BOARD_HEIGHT = 512 # 400 is another option
 MOVE_LOG_PANEL_WIDTH = 270
@@ -10,6 +11,11 @@ MOVE_LOG_PANEL_HEIGHT = BOARD_HEIGHT
 DIMENSION = 8 # dimensions of a chess board are 8x8
 SQ_SIZE = BOARD_HEIGHT // DIMENSION
 MAX_FPS = 15 # for animations
+AI_MOVE_TIME = 3 # seconds the AI may think about each move
+PRINT_SEARCH_STATS = False # print a JSON record of every AI search (see SearchStats)
+BACKEND = "mailbox" # position representation used by the engine, "mailbox" or "bitboard"
+OPENING_BOOK = "book.bin" # Polyglot opening book the AI plays from when the file exists
+AI_MOVE_EVENT = py.USEREVENT + 1 # posted by the AI thread when its move is ready
 IMAGES = {}
 
 '''
@@ -22,156 +28,291 @@ def load_images() :
         IMAGES[piece] = py.transform.scale(py.image.load("./images/" + piece + ".png"), (SQ_SIZE, SQ_SIZE))
     # We can access an image by saying 'IMAGES['wp']'
 
-'''
-Highlight the square selected and moves for the piece selected
-'''
-def highlight_squares(screen, gs, valid_moves, selected_sq, move_log) :
-    s = py.Surface((SQ_SIZE, SQ_SIZE))
-    s.set_alpha(150) # transparency -> 0 transparent; 255 opaque
-    s.fill(py.Color(222, 222, 82))
-    # highlight where the last move was to
-    if len(move_log) > 0 :
-        screen.blit(s, (move_log[-1].end_col * SQ_SIZE, move_log[-1].end_row * SQ_SIZE))
-    if selected_sq != () :
-        r, c = selected_sq
-        # make sure the square selected is a piece that can be moved
-        if gs.board[r][c][0] == ('w' if gs.white_to_move else 'b') :
-            # highlight the selected square
-            screen.blit(s, (c*SQ_SIZE, r*SQ_SIZE))
-            # highlight moves from that square
-            s.set_alpha(100)
-            s.fill(py.Color(246,246,130))
-            for move in valid_moves :
-                if move.start_row == r and move.start_col == c :
-                    screen.blit(s, (move.end_col*SQ_SIZE, move.end_row*SQ_SIZE))
-
-'''
-Responsible for all the graphics within a current game state
-'''
-def draw_game_state(screen, gs, valid_moves, selected_sq, move_log_font) :
-    draw_board(screen) # draw the squares on the board
-    highlight_squares(screen, gs, valid_moves, selected_sq, gs.move_log)
-    draw_pieces(screen, gs.board) # draw the pieces on top of the squares
-    draw_move_log(screen, gs, move_log_font)
+BOARD_COLORS = [py.Color(238, 238, 210), py.Color(118, 150, 86)] # light and dark squares
+MOVES_PER_ROW = 3 # full moves per move log line
+MOVE_LOG_PADDING = 5
 
 '''
-Draw the squares on the board. The top left square is always light
+Pre-renders the empty board once, squares get redrawn by blitting their part of it
+The top left square is always light
 '''
-def draw_board(screen) :
-    global colors
-    colors = [py.Color(238,238,210), py.Color(118,150,86)]
+def create_board_surface() :
+    surface = py.Surface((BOARD_WIDTH, BOARD_HEIGHT))
     for rank in range(DIMENSION) :
         for file in range(DIMENSION) :
-            color = colors[(rank + file) % 2]
-            py.draw.rect(screen, color, py.Rect(file * SQ_SIZE, rank * SQ_SIZE, SQ_SIZE, SQ_SIZE))
+            color = BOARD_COLORS[(rank + file) % 2]
+            py.draw.rect(surface, color, py.Rect(file * SQ_SIZE, rank * SQ_SIZE, SQ_SIZE, SQ_SIZE))
+    return surface
+
+def create_highlight_surface(color, alpha) :
+    surface = py.Surface((SQ_SIZE, SQ_SIZE))
+    surface.set_alpha(alpha) # transparency -> 0 transparent; 255 opaque
+    surface.fill(color)
+    return surface
+
+class BoardRenderer() :
+    '''
+    Draws the game incrementally: it remembers what every square and move log line on screen shows,
+    redraws only what changed and returns those rectangles for py.display.update
+    '''
+    def __init__(self, move_log_font) :
+        self.font = move_log_font
+        self.board_surface = create_board_surface()
+        self.selected_surface = create_highlight_surface(py.Color(222, 222, 82), 150) # selected square and last move
+        self.target_surface = create_highlight_surface(py.Color(246, 246, 130), 100) # moves of the selected piece
+        self.end_font = py.font.SysFont('monospace', 32, True, False)
+        self.end_text_surfaces = {} # text -> (white, black) rendered end of game text
+        self.logged_moves = [] # moves the cached move log lines were rendered from
+        self.move_notations = [] # str() of each of them
+        self.line_surfaces = [] # rendered move log lines
+        self.invalidate()
+
+    '''
+    Makes the next draw repaint everything, e.g. after the window was uncovered
+    '''
+    def invalidate(self) :
+        self.invalidate_board()
+        self.panel_redraw_from = 0 # first move log line to repaint, None when the panel is up to date
+
+    '''
+    Makes the next draw repaint every square, e.g. after an animation drew over the board
+    '''
+    def invalidate_board(self) :
+        self.square_states = [None] * (DIMENSION * DIMENSION)
+        self.end_text = None
+
+    '''
+    Draws whatever changed since the last call and returns the changed rectangles
+    '''
+    def draw(self, screen, gs, valid_moves, selected_sq, end_text=None) :
+        dirty_rects = []
+        states = self.get_square_states(gs, valid_moves, selected_sq)
+        end_text_changed = end_text != self.end_text
+        for sq, state in enumerate(states) :
+            if state != self.square_states[sq] or end_text_changed :
+                dirty_rects.append(self.draw_square(screen, sq, state))
+        self.square_states = states
+        if end_text is not None and dirty_rects :
+            dirty_rects.append(self.draw_end_game_text(screen, end_text))
+        self.end_text = end_text
+        dirty_rects.extend(self.draw_move_log(screen, gs.move_log))
+        return dirty_rects
+
+    '''
+    What each square shows: (piece, last move highlight, selected highlight, move target highlight)
+    '''
+    def get_square_states(self, gs, valid_moves, selected_sq) :
+        move_log = gs.move_log
+        last_move_sq = move_log[-1].end_row * DIMENSION + move_log[-1].end_col if move_log else None
+        selected = None
+        targets = ()
+        if selected_sq != () :
+            r, c = selected_sq
+            # make sure the square selected is a piece that can be moved
+            if gs.board[r][c][0] == ('w' if gs.white_to_move else 'b') :
+                selected = r * DIMENSION + c
+                targets = {move.end_row * DIMENSION + move.end_col for move in valid_moves if move.start_row == r and move.start_col == c}
+        return [(piece, sq == last_move_sq, sq == selected, sq in targets)
+                for sq, piece in enumerate(piece for row in gs.board for piece in row)]
+
+    def draw_square(self, screen, sq, state) :
+        piece, last_move, selected, target = state
+        rect = py.Rect(sq % DIMENSION * SQ_SIZE, sq // DIMENSION * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        screen.blit(self.board_surface, rect, rect)
+        if last_move :
+            screen.blit(self.selected_surface, rect)
+        if selected :
+            screen.blit(self.selected_surface, rect)
+        if target :
+            screen.blit(self.target_surface, rect)
+        if piece != "--" :
+            screen.blit(IMAGES[piece], rect)
+        return rect
+
+    '''
+    Draws the move log. Lines are rendered once and kept, so only the lines from the first changed move
+    (the new move, or the first one an undo took back) are rendered and repainted
+    '''
+    def draw_move_log(self, screen, move_log) :
+        common = len(self.logged_moves)
+        if common > len(move_log) or (common > 0 and move_log[common - 1] is not self.logged_moves[common - 1]) :
+            common = 0
+            while common < min(len(move_log), len(self.logged_moves)) and move_log[common] is self.logged_moves[common] :
+                common += 1
+        if common == len(move_log) == len(self.logged_moves) and self.panel_redraw_from is None :
+            return []
+        del self.logged_moves[common:]
+        del self.move_notations[common:]
+        for move in move_log[common:] :
+            self.logged_moves.append(move)
+            self.move_notations.append(str(move))
+
+        plies_per_row = 2 * MOVES_PER_ROW
+        first_line = common // plies_per_row
+        del self.line_surfaces[first_line:]
+        for line in range(first_line, (len(move_log) + plies_per_row - 1) // plies_per_row) :
+            text = ""
+            for i in range(line * plies_per_row, min((line + 1) * plies_per_row, len(move_log)), 2) :
+                text += f" {i // 2 + 1}. {self.move_notations[i]} "
+                if i + 1 < len(move_log) : # make sure black made a move
+                    text += self.move_notations[i + 1]
+            self.line_surfaces.append(self.font.render(text, 0, py.Color('White')))
+
+        if self.panel_redraw_from is not None :
+            first_line = min(first_line, self.panel_redraw_from)
+        self.panel_redraw_from = None
+        # each line goes below the one before it (lines with descenders render taller)
+        text_y = MOVE_LOG_PADDING + sum(surface.get_height() for surface in self.line_surfaces[:first_line])
+        top = text_y if first_line > 0 else 0
+        panel_rect = py.Rect(BOARD_WIDTH, top, MOVE_LOG_PANEL_WIDTH, max(0, MOVE_LOG_PANEL_HEIGHT - top))
+        py.draw.rect(screen, py.Color("black"), panel_rect)
+        for surface in self.line_surfaces[first_line:] :
+            if text_y >= MOVE_LOG_PANEL_HEIGHT :
+                break
+            screen.blit(surface, (BOARD_WIDTH + MOVE_LOG_PADDING, text_y))
+            text_y += surface.get_height()
+        return [panel_rect]
+
+    '''
+    Draws text for the end screen, returns its rectangle
+    '''
+    def draw_end_game_text(self, screen, text) :
+        if text not in self.end_text_surfaces :
+            self.end_text_surfaces[text] = (self.end_font.render(text, 0, py.Color('White')),
+                                            self.end_font.render(text, 0, py.Color('Black')))
+        white_text, black_text = self.end_text_surfaces[text]
+        text_location = py.Rect(0, 0, BOARD_WIDTH, BOARD_HEIGHT).move(BOARD_WIDTH/2 - white_text.get_width() / 2,
+                                                          BOARD_HEIGHT/2 - white_text.get_height() / 2)
+        screen.blit(white_text, text_location)
+        screen.blit(black_text, text_location.move(2, 2))
+        return py.Rect(text_location.topleft, (white_text.get_width() + 2, white_text.get_height() + 2))
 
 '''
-Draw the pieces on the board using the current GameState board
+Responsible for all the graphics within a current game state. Returns the rectangles that changed
 '''
-def draw_pieces(screen, board) :
-    for rank in range(DIMENSION) :
-        for file in range(DIMENSION) :
-            piece = board[rank][file]
+def draw_game_state(screen, renderer, gs, valid_moves, selected_sq, end_text=None) :
+    return renderer.draw(screen, gs, valid_moves, selected_sq, end_text)
 
-            if piece != "--" : # not an empty square
-                screen.blit(IMAGES[piece], py.Rect(file * SQ_SIZE, rank * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-'''
-Draws the move log
-'''
-def draw_move_log(screen, gs, font) :
-    move_log_rect = py.Rect(BOARD_WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT)
-    py.draw.rect(screen, py.Color("black"), move_log_rect)
-    move_log = gs.move_log
-    move_texts = [] # modify later
-    for i in range(0, len(move_log), 2) :
-        move_string = f"{i // 2 + 1}. {str(move_log[i])} "
-        if i + 1 < len(move_log) : # make sure black made a move
-            move_string += str(move_log[i+1])
-        move_texts.append(move_string)
-
-    moves_per_row = 3
-    padding = 5
-    text_y = padding
-    for i in range(0, len(move_texts), moves_per_row) :
-        text = ""
-        for j in range(moves_per_row) :
-            if i + j < len(move_texts) :
-                text += " " + move_texts[i+j]
-        text_object = font.render(text, 0, py.Color('White'))
-        text_location = move_log_rect.move(padding, text_y)
-        screen.blit(text_object, text_location)
-        text_y += text_object.get_height()
-
-'''
-Animating a move
-'''
-def animate_move(move, screen, board, clock) :
-    global colors
+'''
+Animating a move. The board without the moving piece is drawn once, each frame only puts back
+the square the piece just left and draws it at its new place
+'''
+def animate_move(move, screen, board, clock, renderer) :
     dR = move.end_row - move.start_row
     dC = move.end_col - move.start_col
     frame_count = 10 # frames to make a move
+    background = renderer.board_surface.copy()
+    for rank in range(DIMENSION) :
+        for file in range(DIMENSION) :
+            piece = board[rank][file]
+            if piece != "--" and (rank, file) != (move.end_row, move.end_col) : # the moving piece is drawn by the frames
+                background.blit(IMAGES[piece], py.Rect(file * SQ_SIZE, rank * SQ_SIZE, SQ_SIZE, SQ_SIZE))
+    # draw captured piece back
+    if move.piece_captured != '--' :
+        end_square = py.Rect(move.end_col * SQ_SIZE, move.end_row * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        if move.is_enpassant_move :
+            enpassant_row = (move.end_row + 1) if move.piece_captured[0] == 'b' else (move.end_row - 1)
+            end_square = py.Rect(move.end_col * SQ_SIZE, enpassant_row * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        background.blit(IMAGES[move.piece_captured], end_square)
+    screen.blit(background, (0, 0))
+    previous_rect = py.Rect(0, 0, BOARD_WIDTH, BOARD_HEIGHT) # the first frame shows the whole board
     for frame in range(frame_count + 1) :
-        r, c = (move.start_row + dR * (frame / frame_count), 
+        r, c = (move.start_row + dR * (frame / frame_count),
                        move.start_col + dC * (frame / frame_count))
-        draw_board(screen)
-        draw_pieces(screen, board)
-        # erase the piece moved from its ending square
-        color = colors[(move.end_row + move.end_col) % 2]
-        end_square = py.Rect(move.end_col * SQ_SIZE, move.end_row * SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        py.draw.rect(screen, color, end_square)
-        # draw captured piece back
-        if move.piece_captured != '--' :
-            if move.is_enpassant_move :
-                enpassant_row = (move.end_row + 1) if move.piece_captured[0] == 'b' else (move.end_row - 1)
-                end_square = py.Rect(move.end_col * SQ_SIZE, enpassant_row * SQ_SIZE, SQ_SIZE, SQ_SIZE)
-            screen.blit(IMAGES[move.piece_captured], end_square)
+        rect = py.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        screen.blit(background, previous_rect, previous_rect)
         # draw the moving piece
         if move.piece_moved != '--' :
-            screen.blit(IMAGES[move.piece_moved], py.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        py.display.flip()
+            screen.blit(IMAGES[move.piece_moved], rect)
+        py.display.update(previous_rect.union(rect))
+        previous_rect = rect
         clock.tick(60)
+    renderer.invalidate_board() # the squares the piece passed over are redrawn by the next draw
 
 '''
-Draws text for the end screen
+Text for the end screen, None while the game is running
 '''
-def draw_end_game_text(screen, text) :
-    font = py.font.SysFont('monospace', 32, True, False)
-    text_object = font.render(text, 0, py.Color('White'))
-    text_location = py.Rect(0, 0, BOARD_WIDTH, BOARD_HEIGHT).move(BOARD_WIDTH/2 - text_object.get_width() / 2,
-                                                      BOARD_HEIGHT/2 - text_object.get_height() / 2)
-    screen.blit(text_object, text_location)
-    text_object = font.render(text, 0, py.Color('Black'))
-    screen.blit(text_object, text_location.move(2, 2))
+def get_end_game_text(gs) :
+    if gs.stale_mate :
+        return "Stalemate"
+    if gs.check_mate :
+        return "Black wins by checkmate" if gs.white_to_move else "White wins by checkmate"
+    return None
+
+'''
+Runs on the AI thread: searches a copy of the game and puts the move it found on the result queue
+With profile set the search runs under the profiler (see Profiler)
+'''
+def find_AI_move(gs, result_queue, cancel_event, profile=False) :
+    valid_moves = gs.get_valid_moves()
+    stats = SearchStats.SearchStats() if PRINT_SEARCH_STATS else None
+    if profile :
+        AI_move = Profiler.profile_call(SmartMoveFinder.find_best_move, gs, valid_moves, move_time=AI_MOVE_TIME,
+                                        cancel_event=cancel_event, stats=stats)
+    else :
+        AI_move = SmartMoveFinder.find_best_move(gs, valid_moves, move_time=AI_MOVE_TIME, cancel_event=cancel_event, stats=stats)
+    if stats is not None :
+        print(stats.to_json())
+    if AI_move is None :
+        AI_move = SmartMoveFinder.find_random_move(valid_moves)
+    result_queue.put(AI_move)
+    py.event.post(py.event.Event(AI_MOVE_EVENT)) # wakes the main loop if it is waiting for events
+
+'''
+Cancels a running AI search and waits for its thread to stop (it checks the cancel event every few nodes)
+'''
+def stop_AI_thread(move_finder_thread, cancel_event) :
+    if move_finder_thread is not None and move_finder_thread.is_alive() :
+        cancel_event.set()
+        move_finder_thread.join()
 
 '''
 Main driver for our code. This will handle user input and updating the graphics
 '''
 
 def main() :
+    parser = argparse.ArgumentParser(description="Play chess against the AI")
+    parser.add_argument("--profile", action="store_true", help="profile the AI's first search (press f in game for the next one)")
+    args = parser.parse_args()
     py.init()
     screen = py.display.set_mode((BOARD_WIDTH + MOVE_LOG_PANEL_WIDTH, BOARD_HEIGHT))
     clock = py.time.Clock()
     screen.fill(py.Color('white'))
-    gs = ChessEngine.GameState()
+    gs = ChessEngine.create_game_state(backend=BACKEND)
     valid_moves = gs.get_valid_moves()
+    if os.path.exists(OPENING_BOOK) :
+        SmartMoveFinder.load_opening_book(OPENING_BOOK)
+    Bitbases.load() # whichever endgame tables have been generated
     move_made = False # flag variable for when a move is made
     animate = False # flag variable for when we should animate a move
 
     move_log_font = py.font.SysFont('monospace', 12, False, False)
     load_images() # only do this once before the while loop
+    renderer = BoardRenderer(move_log_font)
+    idle = False # True when the last frame changed nothing, then the loop sleeps until the next event
     running = True
     selected_sq = () # tuple : (row, col)
     player_clicks = [] # keep track of player clicks (two tuples : [(6, 4), (4, 4)])
     game_over = False
     player_one = True # If a human is playing white, then this will be True. If an AI is playing, then false
     player_two = False # Same as above but for black
+    AI_thinking = False # True while the AI thread is searching
+    move_finder_thread = None
+    cancel_event = None # set to abort the AI thread's search
+    result_queue = None # the AI thread puts its move here
+    profile_next_search = args.profile # run the next AI search under the profiler
 
     while running :
         human_turn = (gs.white_to_move and player_one) or (not gs.white_to_move and player_two)
-        for e in py.event.get() :
+        events = py.event.get()
+        if not events and idle :
+            events = [py.event.wait()] # nothing to draw and nobody to wait for but the user or the AI thread
+        for e in events :
             if e.type == py.QUIT :
+                stop_AI_thread(move_finder_thread, cancel_event)
                 running = False
+            elif e.type in (py.VIDEOEXPOSE, py.WINDOWEXPOSED) : # the window was uncovered
+                renderer.invalidate()
             # mouse handling
             elif e.type == py.MOUSEBUTTONDOWN :
                 if not game_over and human_turn : # can only play if the game isn't done (checkmate/stalemate)
@@ -199,57 +340,76 @@ def main() :
             # key handling
             elif e.type == py.KEYDOWN :
                 if e.key == py.K_z : # undo move when z pressed
+                    stop_AI_thread(move_finder_thread, cancel_event) # its move would be for a position that's gone
+                    AI_thinking = False
                     game_over = False
                     animate = False
                     gs.undo_move()
                     move_made = True
                 if e.key == py.K_r : # reset the board when 'r' is pressed
-                    gs = ChessEngine.GameState()
+                    stop_AI_thread(move_finder_thread, cancel_event)
+                    AI_thinking = False
+                    gs = ChessEngine.create_game_state(backend=BACKEND)
                     valid_moves = gs.get_valid_moves()
                     selected_sq = ()
                     player_clicks = []
                     move_made = animate = game_over = False
+                if e.key == py.K_f : # profile the AI's next search when f is pressed
+                    profile_next_search = True
+                    print("the AI's next search will be profiled")
                 if e.key == py.K_p : # pause the game
                     pause = True
                     while pause :
-                        for e in py.event.get() :
+                        for e in [py.event.wait()] : # sleep until a key is pressed
                             if e.type == py.KEYDOWN :
                                 if e.key == py.K_p :
                                     pause = False
                                     break
                             if e.type == py.QUIT :
+                                stop_AI_thread(move_finder_thread, cancel_event)
                                 pause = False
                                 running = False
                                 break
 
-        # AI move finder
-        if not game_over and not human_turn :
-            AI_move = SmartMoveFinder.find_best_move(gs, valid_moves)
-            if AI_move == None :
-                AI_move = SmartMoveFinder.find_random_move(valid_moves)
-            gs.make_move(AI_move)
-            move_made = True
-            animate = True
+        # AI move finder - searches on its own thread so the window keeps responding
+        human_turn = (gs.white_to_move and player_one) or (not gs.white_to_move and player_two) # undo/reset may have changed it
+        if not game_over and not human_turn and running :
+            if not AI_thinking :
+                AI_thinking = True
+                cancel_event = threading.Event()
+                result_queue = queue.Queue()
+                # the search gets its own copy of the game so drawing never sees its half made moves
+                move_finder_thread = threading.Thread(target=find_AI_move, daemon=True,
+                                                      args=(copy.deepcopy(gs), result_queue, cancel_event, profile_next_search))
+                profile_next_search = False
+                move_finder_thread.start()
+            elif not result_queue.empty() :
+                AI_move = result_queue.get()
+                for move in valid_moves : # use the move object from this game, not the search's copy
+                    if move == AI_move :
+                        gs.make_move(move)
+                        move_made = True
+                        animate = True
+                        break
+                AI_thinking = False
 
         if move_made :
             if len(gs.move_log) > 0 :
                 if not gs.move_log[-1].is_castle_move and animate :
-                    animate_move(gs.move_log[-1], screen, gs.board, clock)
+                    animate_move(gs.move_log[-1], screen, gs.board, clock, renderer)
             valid_moves = gs.get_valid_moves()
             move_made = False
             animate = False
 
-        draw_game_state(screen, gs, valid_moves, selected_sq, move_log_font)
-
-        if gs.check_mate or gs.stale_mate:
+        end_text = get_end_game_text(gs)
+        if end_text is not None :
             game_over = True
-            if gs.stale_mate :
-                text = "Stalemate"
-            else :
-                text = "Black wins by checkmate" if gs.white_to_move else "White wins by checkmate"
-            draw_end_game_text(screen, text)
+        dirty_rects = draw_game_state(screen, renderer, gs, valid_moves, selected_sq, end_text)
+        if dirty_rects :
+            py.display.update(dirty_rects)
+        # an AI search that still has to be started keeps the loop awake
+        idle = not dirty_rects and (game_over or AI_thinking or human_turn)
         clock.tick(MAX_FPS)
-        py.display.flip()
 
 if __name__ == "__main__" :
     main()
\ No newline at end of file
@@ -0,0 +1,226 @@
+'''
+Runs the search on a suite of EPD test positions and reports how many it solves.
+A position is solved when the move played is one of its best moves (bm) and none of its avoid moves (am).
+The positions are spread over a pool of worker processes, each with its own transposition table,
+and every position gets the same fixed depth or time budget so runs are repeatable.
+For each position the report shows the time to solution (when the search first settled on a right move
+and kept it), the depth completed and the nodes searched. A position that can't be set up (a broken line,
+a bm/am move that isn't legal or that the engine can't play such as an underpromotion) is reported as
+skipped with the reason, and the rest of the suite still runs.
+
+Usage:
+    python EpdRunner.py                                 # the built-in Win at Chess positions, 5 seconds each
+    python EpdRunner.py suite.epd --movetime 2 --workers 4
+    python EpdRunner.py suite.epd --depth 4
+'''
+import argparse
+import multiprocessing
+import os
+import re
+import shlex
+import time
+import ChessEngine, SmartMoveFinder, Bitbases
+from TranspositionTable import TranspositionTable
+
+DEFAULT_MOVE_TIME = 5 # seconds per position when neither a depth nor a move time is given
+TT_SIZE_MB = 16
+
+# first positions of the Win at Chess suite
+DEFAULT_SUITE = [
+    '2rr3k/pp3pp1/1nnqbN1p/3pN3/2pP4/2P3Q1/PPB4P/R4RK1 w - - bm Qg6; id "WAC.001";',
+    '8/7p/5k2/5p2/p1p2P2/Pr6/1P4PP/6K1 b - - bm Rxb2; id "WAC.002";',
+    '5rk1/1ppb3p/p1pb4/6q1/3P1p1r/2P1R2P/PP1BQ1P1/5RKN w - - bm Rg3; id "WAC.003";',
+    'r1bq2rk/pp3pbp/2p1p1pQ/7P/3P4/2PB1N2/PP3PPR/2KR4 w - - bm Qxh7+; id "WAC.004";',
+    '5k2/6pp/p1qN4/1p1p4/3P4/2PKP2Q/PP3r2/3R4 b - - bm Qc4+; id "WAC.005";',
+    '7k/p7/1R5K/6r1/6p1/6P1/8/8 w - - bm Rb7; id "WAC.006";',
+    'rnbqkb1r/pppp1ppp/8/4P3/6n1/7P/PPPNPPP1/R1BQKBNR b KQkq - bm Ne3; id "WAC.007";',
+    'r4q1k/p2bR1rp/2p2Q1N/5p2/5p2/2P5/PP3PPP/R5K1 w - - bm Rf7; id "WAC.008";',
+    '3q1rk1/p4pp1/2pb3p/3p4/6Pr/1PNQ4/P1PB1PP1/4RRK1 b - - bm Bh2+; id "WAC.009";',
+    '2br2k1/2q3rn/p2NppQ1/2p1P3/Pp5R/4P3/1P3PPP/3R2K1 w - - bm Rxh7; id "WAC.010";',
+]
+
+# worker process state, set up once per process by init_worker
+worker_max_depth = None
+worker_move_time = None
+
+SAN_PATTERN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$")
+
+'''
+Splits an EPD line into its FEN (with the move counters from hmvc/fmvn when given) and a dict of operations,
+opcode -> list of operands
+'''
+def parse_epd(line) :
+    fields = line.split(maxsplit=4)
+    if len(fields) < 4 :
+        raise ValueError(f"Invalid EPD: {line}")
+    operations = {}
+    for operation in split_operations(fields[4] if len(fields) > 4 else "") :
+        tokens = shlex.split(operation)
+        if tokens :
+            operations[tokens[0]] = tokens[1:]
+    halfmove_clock = operations.get("hmvc", ["0"])[0]
+    fullmove_number = operations.get("fmvn", ["1"])[0]
+    return " ".join(fields[:4] + [halfmove_clock, fullmove_number]), operations
+
+'''
+Splits the operations part of an EPD line on the semicolons that aren't inside a quoted string
+'''
+def split_operations(text) :
+    operations = []
+    current = ""
+    in_quotes = False
+    for char in text :
+        if char == '"' :
+            in_quotes = not in_quotes
+        if char == ';' and not in_quotes :
+            operations.append(current.strip())
+            current = ""
+        else :
+            current += char
+    if current.strip() :
+        operations.append(current.strip())
+    return operations
+
+'''
+Returns the move of valid_moves written in standard algebraic notation (e.g. Nf3, exd5, O-O, e8=Q+)
+or in UCI notation, None if no legal move matches
+'''
+def parse_move(san, valid_moves) :
+    san = san.rstrip("+#!?")
+    if san in ("O-O", "0-0", "O-O-O", "0-0-0") :
+        end_col = 6 if len(san) == 3 else 2
+        return next((move for move in valid_moves if move.is_castle_move and move.end_col == end_col), None)
+    for move in valid_moves :
+        if move.get_uci_notation() == san :
+            return move
+    match = SAN_PATTERN.match(san)
+    if match is None :
+        return None
+    piece, start_file, start_rank, square, promotion = match.groups()
+    piece = piece or 'p'
+    if promotion is not None and promotion != 'Q' : # the engine always promotes to a queen
+        return None
+    end_row, end_col = ChessEngine.Move.ranks_to_rows[square[1]], ChessEngine.Move.files_to_cols[square[0]]
+    candidates = [move for move in valid_moves
+                  if move.piece_moved[1] == piece and move.end_row == end_row and move.end_col == end_col and not move.is_castle_move
+                  and (start_file is None or move.start_col == ChessEngine.Move.files_to_cols[start_file])
+                  and (start_rank is None or move.start_row == ChessEngine.Move.ranks_to_rows[start_rank])]
+    return candidates[0] if len(candidates) == 1 else None
+
+'''
+Runs once in every worker process: remembers the search limits and loads the endgame tables
+'''
+def init_worker(max_depth, move_time) :
+    global worker_max_depth, worker_move_time
+    worker_max_depth = max_depth
+    worker_move_time = move_time
+    SmartMoveFinder.transposition_table = TranspositionTable(TT_SIZE_MB)
+    Bitbases.load()
+
+'''
+Parses the operands of a bm or am operation, raises ValueError for a move that isn't legal or not supported
+'''
+def parse_moves(opcode, operations, valid_moves) :
+    moves = []
+    for san in operations.get(opcode, []) :
+        move = parse_move(san, valid_moves)
+        if move is None :
+            raise ValueError(f"{opcode} move {san} is not legal or not supported")
+        moves.append(move)
+    return moves
+
+'''
+Searches one suite position with a cold search (empty hash table and history) and returns its result as a dict
+A position that can't be set up isn't searched, its result has the reason in "skipped"
+'''
+def solve_position(position) :
+    index, line = position
+    result = {"index" : index, "id" : str(index + 1), "fen" : None, "move" : None, "expected" : "", "solved" : False,
+              "solution_time" : None, "depth" : 0, "nodes" : 0, "time" : 0.0, "skipped" : None}
+    try :
+        fen, operations = parse_epd(line)
+        result["id"] = operations.get("id", [result["id"]])[0]
+        result["fen"] = fen
+        result["expected"] = "; ".join(" ".join([opcode] + operations[opcode]) for opcode in ("bm", "am") if opcode in operations)
+        gs = ChessEngine.GameState(fen)
+        valid_moves = gs.get_valid_moves()
+        best_moves = parse_moves("bm", operations, valid_moves)
+        avoid_moves = parse_moves("am", operations, valid_moves)
+    except ValueError as error :
+        result["skipped"] = str(error)
+        return result
+    SmartMoveFinder.transposition_table.clear()
+    SmartMoveFinder.history_table.clear()
+
+    start_time = time.perf_counter()
+    move = SmartMoveFinder.find_best_move(gs, valid_moves, worker_max_depth, worker_move_time)
+    elapsed = time.perf_counter() - start_time
+
+    # the solution time is when the search picked a right move and kept it through every later iteration
+    solution_time = None
+    for _, iteration_move, _, _, seconds in reversed(SmartMoveFinder.search_iterations) :
+        if not is_solution(iteration_move, best_moves, avoid_moves) :
+            break
+        solution_time = seconds
+    result.update({"move" : None if move is None else move.get_uci_notation(), "solved" : is_solution(move, best_moves, avoid_moves),
+                   "solution_time" : solution_time, "depth" : SmartMoveFinder.depth_completed,
+                   "nodes" : SmartMoveFinder.nodes_searched, "time" : elapsed})
+    return result
+
+def is_solution(move, best_moves, avoid_moves) :
+    if move is None :
+        return False
+    if best_moves and move not in best_moves :
+        return False
+    return move not in avoid_moves
+
+'''
+Reads the EPD lines of a file, skipping blank lines and # comments
+'''
+def read_suite(path) :
+    with open(path) as f :
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+'''
+Solves every position of the suite with a pool of worker processes, printing each result as it comes in
+Returns the results in suite order
+'''
+def run_suite(lines, workers=None, max_depth=None, move_time=None) :
+    workers = workers or os.cpu_count() or 1
+    results = []
+    start_time = time.perf_counter()
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(max_depth, move_time)) as pool :
+        for result in pool.imap_unordered(solve_position, enumerate(lines)) :
+            results.append(result)
+            if result["skipped"] is not None :
+                print(f"{result['id']:<12} SKIP  {result['skipped']}")
+                continue
+            solution_time = f"{result['solution_time']:.2f}s" if result['solution_time'] is not None else "-"
+            print(f"{result['id']:<12} {'ok  ' if result['solved'] else 'FAIL'}  {result['move'] or '-':<6} ({result['expected']})  "
+                  f"solved in {solution_time:<7} depth {result['depth']:>2}  {result['nodes']:>9} nodes  "
+                  f"{nodes_per_second(result['nodes'], result['time']):>7.0f} nps")
+    elapsed = time.perf_counter() - start_time
+    results.sort(key=lambda result : result["index"])
+    solved = sum(result["solved"] for result in results)
+    skipped = sum(result["skipped"] is not None for result in results)
+    nodes = sum(result["nodes"] for result in results)
+    print(f"solved {solved}/{len(results) - skipped}{f' ({skipped} skipped)' if skipped else ''} with {workers} workers in {elapsed:.2f}s  "
+          f"{nodes} nodes ({nodes_per_second(nodes, sum(result['time'] for result in results)):.0f} nps per worker)")
+    return results
+
+def nodes_per_second(nodes, elapsed) :
+    return nodes / elapsed if elapsed > 0 else 0.0
+
+def main() :
+    parser = argparse.ArgumentParser(description="Solve a suite of EPD test positions")
+    parser.add_argument("epd", nargs="?", help="EPD file with bm/am operations (defaults to the built-in Win at Chess positions)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--depth", type=int, help="fixed search depth per position")
+    parser.add_argument("--movetime", type=float, help=f"seconds per position (default {DEFAULT_MOVE_TIME} when no depth is given)")
+    args = parser.parse_args()
+    lines = DEFAULT_SUITE if args.epd is None else read_suite(args.epd)
+    move_time = args.movetime if args.movetime is not None or args.depth is not None else DEFAULT_MOVE_TIME
+    run_suite(lines, args.workers, args.depth, move_time)
+
+if __name__ == "__main__" :
+    main()
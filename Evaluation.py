@@ -0,0 +1,80 @@
+'''
+Evaluation tables shared by the engine and the AI: material values and piece square tables.
+GameState uses them to keep its score up to date move by move, SmartMoveFinder to score positions.
+'''
+piece_score = {"K": 0, "Q": 9, "R": 5, "N": 3, "B": 3, "p": 1}
+
+knight_scores = [[1, 1, 1, 1, 1, 1, 1, 1],
+                 [1, 2, 2, 2, 2, 2, 2, 1],
+                 [1, 2, 3, 3, 3, 3, 2, 1],
+                 [1, 2, 3, 4, 4, 3, 2, 1],
+                 [1, 2, 3, 4, 4, 3, 2, 1],
+                 [1, 2, 3, 3, 3, 3, 2, 1],
+                 [1, 2, 2, 2, 2, 2, 2, 1],
+                 [1, 1, 1, 1, 1, 1, 1, 1]]
+
+bishop_scores = [[4, 3, 2, 1, 1, 2, 3, 4],
+                 [3, 4, 3, 2, 2, 3, 4, 3],
+                 [2, 3, 4, 3, 3, 4, 3, 2],
+                 [1, 2, 3, 4, 4, 3, 2, 1],
+                 [1, 2, 3, 4, 4, 3, 2, 1],
+                 [2, 3, 4, 3, 3, 4, 3, 2],
+                 [3, 4, 3, 2, 2, 3, 4, 3],
+                 [4, 3, 2, 1, 1, 2, 3, 4]]
+
+queen_scores = [[1, 1, 1, 3, 1, 1, 1, 1],
+                [1, 2, 3, 3, 3, 1, 1, 1],
+                [1, 4, 3, 3, 3, 4, 2, 1],
+                [1, 2, 3, 3, 3, 2, 2, 1],
+                [1, 2, 3, 3, 3, 2, 2, 1],
+                [1, 4, 3, 3, 3, 4, 2, 1],
+                [1, 1, 2, 3, 3, 1, 1, 1],
+                [1, 1, 1, 3, 1, 1, 1, 1]]
+
+rook_scores = [ [4, 3, 4, 4, 4, 4, 3, 4],
+                [4, 4, 4, 4, 4, 4, 4, 4],
+                [1, 1, 2, 3, 3, 2, 1, 1],
+                [1, 2, 3, 4, 4, 3, 2, 1],
+                [1, 2, 3, 4, 4, 3, 2, 1],
+                [1, 1, 2, 2, 2, 2, 1, 1],
+                [4, 4, 4, 4, 4, 4, 4, 4],
+                [4, 3, 4, 4, 4, 4, 3, 4]]
+
+white_pawn_scores =[[10, 10, 10, 10, 10, 10, 10, 10],
+                    [8, 8, 8, 8, 8, 8, 8, 8],
+                    [5, 6, 6, 7, 7, 6, 6, 5],
+                    [2, 3, 3, 5, 5, 3, 3, 2],
+                    [1, 2, 3, 4, 4, 3, 2, 1],
+                    [1, 1, 2, 3, 3, 2, 1, 1],
+                    [1, 1, 1, 0, 0, 1, 1, 1],
+                    [0, 0, 0, 0, 0, 0, 0, 0]]
+
+black_pawn_scores =[[0, 0, 0, 0, 0, 0, 0, 0],
+                    [1, 1, 1, 0, 0, 1, 1, 1],
+                    [1, 1, 2, 3, 3, 2, 1, 1],
+                    [1, 2, 3, 4, 4, 3, 2, 1],
+                    [2, 3, 3, 5, 5, 3, 3, 2],
+                    [5, 6, 6, 7, 7, 6, 6, 5],
+                    [8, 8, 8, 8, 8, 8, 8, 8],
+                    [10, 10, 10, 10, 10, 10, 10, 10]]
+    
+
+piece_position_scores = {"N" : knight_scores, "B" : bishop_scores, "R" : rook_scores,
+                         "Q" : queen_scores, "bp" : black_pawn_scores, "wp" : white_pawn_scores}
+
+'''
+Returns the position table of a piece ("wN", "bp", ...), or None for kings which aren't scored positionally
+'''
+def get_position_table(piece) :
+    if piece[1] == 'p' :
+        return piece_position_scores[piece]
+    return piece_position_scores.get(piece[1])
+
+# piece_square_values[piece][row * 8 + col] = material + position score of the piece on that square in tenths
+# of a pawn, positive for white and negative for black, so a position's score is the sum over its pieces
+piece_square_values = {}
+for _color, _sign in (('w', 1), ('b', -1)) :
+    for _piece in piece_score :
+        _table = get_position_table(_color + _piece)
+        piece_square_values[_color + _piece] = [_sign * (piece_score[_piece] * 10 + (_table[sq // 8][sq % 8] if _table else 0))
+                                                 for sq in range(64)]
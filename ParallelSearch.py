@@ -0,0 +1,142 @@
+'''
+Multi-core search (Lazy SMP). Every worker process searches the same position with the normal
+SmartMoveFinder search, and all of them share one transposition table kept in multiprocessing.shared_memory,
+so each worker skips whatever another one has already searched. The deepest finished iteration decides the move.
+
+Usage:
+    python ParallelSearch.py --workers 4 --movetime 5             # compare 1 process with 4 workers
+    python ParallelSearch.py --workers 4 --depth 4 --fen "<fen>"
+'''
+import argparse
+import multiprocessing
+import os
+import random
+import time
+from multiprocessing import shared_memory
+import ChessEngine, SmartMoveFinder
+from TranspositionTable import TranspositionTable, buffer_size
+
+DEFAULT_TT_SIZE_MB = 64
+
+# worker process state, set up once per process by init_worker
+worker_memory = None
+worker_cancel_event = None
+
+'''
+Runs once in every worker process: attaches the shared transposition table and the cancel event
+'''
+def init_worker(memory_name, tt_size_mb, cancel_event) :
+    global worker_memory, worker_cancel_event
+    worker_memory = shared_memory.SharedMemory(name=memory_name)
+    SmartMoveFinder.transposition_table = TranspositionTable(tt_size_mb, worker_memory.buf)
+    worker_cancel_event = cancel_event
+
+'''
+Searches the position in a worker process
+Helpers (worker_index > 0) search the root moves in a shuffled order, which the search doesn't sort again
+(only the best move of each iteration goes first), so they explore different parts of the tree first
+Returns (worker index, best move id, depth completed, nodes searched, seconds)
+'''
+def search_worker(gs, worker_index, max_depth, move_time, time_left, increment) :
+    start_time = time.perf_counter()
+    valid_moves = gs.get_valid_moves()
+    # a pool process runs the main worker for one search and a helper for the next, so set this every time
+    SmartMoveFinder.sort_root_moves = worker_index == 0
+    if worker_index > 0 :
+        random.Random(worker_index).shuffle(valid_moves)
+    move = SmartMoveFinder.find_best_move(gs, valid_moves, max_depth, move_time, time_left, increment, cancel_event=worker_cancel_event)
+    return (worker_index, None if move is None else move.move_id, SmartMoveFinder.depth_completed,
+            SmartMoveFinder.nodes_searched, time.perf_counter() - start_time)
+
+class ParallelSearcher() :
+    def __init__(self, workers=None, tt_size_mb=DEFAULT_TT_SIZE_MB) :
+        self.workers = workers or os.cpu_count() or 1
+        self.tt_size_mb = tt_size_mb
+        self.memory = shared_memory.SharedMemory(create=True, size=buffer_size(tt_size_mb))
+        self.memory.buf[:] = bytes(self.memory.size) # every entry starts empty
+        self.cancel_event = multiprocessing.Event()
+        self.pool = multiprocessing.Pool(self.workers, initializer=init_worker,
+                                         initargs=(self.memory.name, tt_size_mb, self.cancel_event))
+        self.last_report = None
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *exc_info) :
+        self.close()
+
+    '''
+    Searches with all workers and returns the best move from valid_moves (same arguments as SmartMoveFinder.find_best_move)
+    With a fixed depth (no time budget) the first worker to finish stops the others, with a time budget every worker
+    searches until its own clock runs out
+    The depth reached, nodes and nodes/sec of the search are kept in last_report
+    '''
+    def find_best_move(self, gs, valid_moves, max_depth=None, move_time=None, time_left=None, increment=0) :
+        if not valid_moves :
+            return None
+        if SmartMoveFinder.opening_book is not None : # probe here so the workers don't each pick a different book move
+            book_move = SmartMoveFinder.opening_book.choose_move(gs, valid_moves)
+            if book_move is not None :
+                return book_move
+        self.cancel_event.clear()
+        start_time = time.perf_counter()
+        # a timed worker that doesn't start another iteration would stop the others in the middle of theirs
+        fixed_depth = SmartMoveFinder.allocate_time(move_time, time_left, increment) is None
+        callback = (lambda _ : self.cancel_event.set()) if fixed_depth else None
+        tasks = [self.pool.apply_async(search_worker, (gs, i, max_depth, move_time, time_left, increment), callback=callback)
+                 for i in range(self.workers)]
+        results = [task.get() for task in tasks]
+        elapsed = time.perf_counter() - start_time
+
+        # deepest completed iteration wins, the main worker breaks ties
+        worker_index, move_id, depth, _, _ = max(results, key=lambda result : (result[2], -result[0]))
+        nodes = sum(result[3] for result in results)
+        self.last_report = {"workers" : self.workers, "depth" : depth, "nodes" : nodes, "time" : elapsed,
+                            "nps" : nodes / elapsed if elapsed > 0 else 0.0, "chosen_worker" : worker_index,
+                            "worker_depths" : [result[2] for result in sorted(results)]}
+        for move in valid_moves :
+            if move.move_id == move_id :
+                return move
+        return valid_moves[0]
+
+    '''
+    Stops the worker processes and frees the shared table
+    '''
+    def close(self) :
+        if self.pool is not None :
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            self.memory.close()
+            self.memory.unlink()
+
+'''
+Runs the single process search and the parallel search on the same position and prints depth and speed for both
+'''
+def compare(fen, workers, max_depth=None, move_time=None) :
+    gs = ChessEngine.GameState(fen)
+    SmartMoveFinder.transposition_table = TranspositionTable(DEFAULT_TT_SIZE_MB)
+    start_time = time.perf_counter()
+    move = SmartMoveFinder.find_best_move(gs, gs.get_valid_moves(), max_depth, move_time)
+    elapsed = time.perf_counter() - start_time
+    print(f"1 process : {move}  depth {SmartMoveFinder.depth_completed}  {SmartMoveFinder.nodes_searched} nodes  "
+          f"{elapsed:.2f}s  {SmartMoveFinder.nodes_searched / elapsed:.0f} nps")
+
+    with ParallelSearcher(workers) as searcher :
+        move = searcher.find_best_move(gs, gs.get_valid_moves(), max_depth, move_time)
+        report = searcher.last_report
+        print(f"{workers} workers : {move}  depth {report['depth']}  {report['nodes']} nodes  {report['time']:.2f}s  "
+              f"{report['nps']:.0f} nps  (worker depths {report['worker_depths']})")
+
+def main() :
+    parser = argparse.ArgumentParser(description="Compare the single process search with the parallel search")
+    parser.add_argument("--fen", default="r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--depth", type=int, help="fixed search depth")
+    parser.add_argument("--movetime", type=float, help="seconds per search (default 5 when no depth is given)")
+    args = parser.parse_args()
+    move_time = args.movetime if args.movetime is not None or args.depth is not None else 5
+    compare(args.fen, args.workers, args.depth, move_time)
+
+if __name__ == "__main__" :
+    main()
@@ -0,0 +1,173 @@
+'''
+Headless perft (performance test) driver for the move generator.
+Counts the leaf nodes of the legal move tree to a given depth and reports nodes/sec.
+The suite of reference positions doubles as a correctness check for the pin, check,
+en passant and castling logic in ChessEngine, and of the FEN loader (every position has to read back the same).
+
+Usage:
+    python Perft.py                                  # run the reference suite
+    python Perft.py --max-nodes 200000               # quicker suite run
+    python Perft.py --fen "<fen>" --depth 4          # perft of a single position
+    python Perft.py --fen "<fen>" --depth 3 --divide # node count per root move
+    python Perft.py --backend bitboard               # test the bitboard position backend
+'''
+import argparse
+import time
+import ChessEngine
+import BitboardEngine
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# (name, fen, {depth : reference node count})
+# The engine always promotes to a queen, so every count below is taken at a depth where no promotion is reachable
+PERFT_SUITE = [
+    ("start position", START_FEN,
+        {1 : 20, 2 : 400, 3 : 8902, 4 : 197281, 5 : 4865609}),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        {1 : 48, 2 : 2039, 3 : 97862}),
+    ("rook and pawn endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        {1 : 14, 2 : 191, 3 : 2812, 4 : 43238, 5 : 674624}),
+    ("middlegame", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        {1 : 46, 2 : 2079, 3 : 89890}),
+    ("illegal en passant (horizontal pin) #1", "3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1",
+        {1 : 18, 2 : 92, 3 : 1670, 4 : 10138, 5 : 185429}),
+    ("illegal en passant (diagonal pin) #2", "8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1",
+        {1 : 13, 2 : 102, 3 : 1266, 4 : 10276, 5 : 135655}),
+    ("en passant capture checks opponent", "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1",
+        {1 : 15, 2 : 126, 3 : 1928, 4 : 13931}),
+    ("short castling gives check", "5k2/8/8/8/8/8/8/4K2R w K - 0 1",
+        {1 : 15, 2 : 66, 3 : 1198, 4 : 6399, 5 : 120330}),
+    ("long castling gives check", "3k4/8/8/8/8/8/8/R3K3 w Q - 0 1",
+        {1 : 16, 2 : 71, 3 : 1286, 4 : 7418, 5 : 141077}),
+    ("castling rights lost by captures", "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1",
+        {1 : 26, 2 : 1141, 3 : 27826}),
+    ("castling prevented by attacks", "r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1",
+        {1 : 44, 2 : 1494, 3 : 50509}),
+    ("castling through pawn attacks", "r3k2r/2P3P1/8/8/8/8/8/R3K2R b KQkq - 0 1",
+        {1 : 22}),
+    ("pawn pinned on its own file", "4K3/8/8/8/4P3/8/8/k3r3 w - - 0 1",
+        {1 : 6, 2 : 73, 3 : 497, 4 : 7622, 5 : 51979}),
+    ("discovered check", "8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1",
+        {1 : 29, 2 : 165, 3 : 5160}),
+    ("self stalemate", "K1k5/8/P7/8/8/8/8/8 w - - 0 1",
+        {1 : 2, 2 : 6, 3 : 13, 4 : 63}),
+    ("stalemate and checkmate", "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1",
+        {1 : 37, 2 : 183, 3 : 6559, 4 : 23527}),
+]
+
+'''
+Counts the leaf nodes of the legal move tree at the given depth
+'''
+def perft(gs, depth) :
+    if isinstance(gs, BitboardEngine.BitboardGameState) :
+        return packed_perft(gs, depth)
+    if depth == 0 :
+        return 1
+    moves = gs.get_valid_moves()
+    if depth == 1 : # bulk count the leaves instead of making every move
+        return len(moves)
+    nodes = 0
+    for move in moves :
+        gs.make_move(move)
+        nodes += perft(gs, depth - 1)
+        gs.undo_move()
+    return nodes
+
+'''
+perft of the bitboard backend on its packed moves, so no Move object is built for the count
+'''
+def packed_perft(gs, depth) :
+    if depth == 0 :
+        return 1
+    moves = gs.get_packed_moves()
+    if depth == 1 :
+        return len(moves)
+    nodes = 0
+    for move in moves :
+        gs.make_packed_move(move)
+        nodes += packed_perft(gs, depth - 1)
+        gs.undo_packed_move()
+    return nodes
+
+'''
+Returns a list of (move, node count) pairs, one for each legal move at the root
+'''
+def divide(gs, depth) :
+    results = []
+    for move in gs.get_valid_moves() :
+        gs.make_move(move)
+        results.append((move, perft(gs, depth - 1)))
+        gs.undo_move()
+    return results
+
+'''
+Runs perft on a position and returns the node count and the time it took in seconds
+'''
+def timed_perft(gs, depth) :
+    start_time = time.perf_counter()
+    nodes = perft(gs, depth)
+    return nodes, time.perf_counter() - start_time
+
+'''
+Runs every suite position up to its deepest reference depth (skipping depths above max_nodes)
+Each position is also read back with get_fen after loading and after the perft, which has to give the same FEN
+Returns True if every node count and FEN matched
+'''
+def run_suite(max_nodes=None, backend="mailbox") :
+    total_nodes = 0
+    total_time = 0.0
+    failures = 0
+    for name, fen, counts in PERFT_SUITE :
+        for depth in sorted(counts) :
+            expected = counts[depth]
+            if max_nodes is not None and expected > max_nodes :
+                break
+            gs = ChessEngine.create_game_state(fen, backend)
+            loaded_fen = gs.get_fen()
+            nodes, elapsed = timed_perft(gs, depth)
+            total_nodes += nodes
+            total_time += elapsed
+            status = "ok"
+            if nodes != expected :
+                status = f"FAIL (expected {expected})"
+            elif loaded_fen != fen :
+                status = f"FAIL (FEN read back as {loaded_fen})"
+            elif gs.get_fen() != fen :
+                status = f"FAIL (FEN after perft is {gs.get_fen()})"
+            if status != "ok" :
+                failures += 1
+            print(f"{name:<42} depth {depth}  {nodes:>9} nodes  {nodes_per_second(nodes, elapsed):>9.0f} nps  {status}")
+    print(f"total: {total_nodes} nodes in {total_time:.2f}s ({nodes_per_second(total_nodes, total_time):.0f} nps), {failures} failed")
+    return failures == 0
+
+def nodes_per_second(nodes, elapsed) :
+    return nodes / elapsed if elapsed > 0 else 0.0
+
+def main() :
+    parser = argparse.ArgumentParser(description="Perft node counts and move generation speed")
+    parser.add_argument("--fen", help="position to search (defaults to the reference suite)")
+    parser.add_argument("--depth", type=int, default=3, help="perft depth for --fen")
+    parser.add_argument("--divide", action="store_true", help="print the node count of every root move")
+    parser.add_argument("--max-nodes", type=int, help="skip suite depths with more reference nodes than this")
+    parser.add_argument("--backend", choices=["mailbox", "bitboard"], default="mailbox", help="position representation to test")
+    args = parser.parse_args()
+
+    if args.fen is None :
+        return 0 if run_suite(args.max_nodes, args.backend) else 1
+
+    gs = ChessEngine.create_game_state(args.fen, args.backend)
+    if args.divide :
+        start_time = time.perf_counter()
+        results = divide(gs, args.depth)
+        elapsed = time.perf_counter() - start_time
+        for move, nodes in sorted(results, key=lambda result : result[0].get_uci_notation()) :
+            print(f"{move.get_uci_notation()}: {nodes}")
+        nodes = sum(nodes for _, nodes in results)
+        print(f"\nmoves: {len(results)}")
+    else :
+        nodes, elapsed = timed_perft(gs, args.depth)
+    print(f"nodes: {nodes}  time: {elapsed:.3f}s  nps: {nodes_per_second(nodes, elapsed):.0f}")
+    return 0
+
+if __name__ == "__main__" :
+    raise SystemExit(main())
@@ -0,0 +1,103 @@
+'''
+Profiles a single call (in practice the next SmartMoveFinder.find_best_move) while the game keeps running.
+Every capture writes two files into profiles/, named after the time it was taken:
+    <name>-<timestamp>.prof       cProfile data, for pstats, snakeviz, gprof2dot or flameprof
+    <name>-<timestamp>.collapsed  sampled call stacks in collapsed format ("a;b;c count" per line),
+                                  for flamegraph.pl, inferno or speedscope
+and prints the functions with the most time of their own to stdout.
+cProfile only records caller/callee pairs, so the stacks come from a sampler thread that looks at the
+profiled thread's frames every millisecond (limited in practice by the interpreter's thread switch interval).
+
+Usage (from code):
+    move = Profiler.profile_call(SmartMoveFinder.find_best_move, gs, valid_moves, move_time=3)
+'''
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+
+PROFILE_DIR = "profiles"
+SAMPLE_INTERVAL = 0.001 # seconds between stack samples
+TOP_FUNCTIONS = 15 # functions in the printed summary
+
+class StackSampler() :
+    '''
+    Samples the stack of the thread thread_id, keeping only the frames below root_frame
+    '''
+    def __init__(self, thread_id, root_frame) :
+        self.thread_id = thread_id
+        self.root_frame = root_frame
+        self.stacks = {} # tuple of function names, outermost first -> samples
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self) :
+        self.thread.start()
+
+    def stop(self) :
+        self.stop_event.set()
+        self.thread.join()
+
+    def run(self) :
+        while not self.stop_event.wait(SAMPLE_INTERVAL) :
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and frame is not self.root_frame :
+                stack.append(function_name(frame.f_code))
+                frame = frame.f_back
+            if self.stop_event.is_set() : # the profiled call has returned, this stack is from stop()
+                break
+            if stack :
+                stack = tuple(reversed(stack))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+'''
+File and qualified name of a code object, e.g. ChessEngine.py:Move.__init__
+'''
+def function_name(code) :
+    return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+'''
+Calls func(*args, **kwargs) under the profiler and the stack sampler, writes both profiles and prints the summary
+Returns whatever func returns
+'''
+def profile_call(func, *args, name="search", directory=PROFILE_DIR, top=TOP_FUNCTIONS, **kwargs) :
+    profile = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident(), sys._getframe())
+    sampler.start()
+    profile.enable()
+    try :
+        return func(*args, **kwargs)
+    finally :
+        profile.disable()
+        sampler.stop()
+        path = save_profile(profile, sampler.stacks, name, directory)
+        print_summary(profile, top, path)
+
+'''
+Writes the .prof and .collapsed files and returns their common path without the extension
+'''
+def save_profile(profile, stacks, name, directory=PROFILE_DIR) :
+    os.makedirs(directory, exist_ok=True)
+    now = time.time()
+    path = os.path.join(directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{int(now * 1000) % 1000:03d}")
+    profile.dump_stats(path + ".prof")
+    with open(path + ".collapsed", "w") as f :
+        for stack, samples in sorted(stacks.items()) :
+            f.write(f"{';'.join(stack)} {samples}\n")
+    return path
+
+'''
+Prints the top functions by time spent in the function itself, with their call counts and cumulative time
+'''
+def print_summary(profile, top=TOP_FUNCTIONS, path=None) :
+    stats = pstats.Stats(profile)
+    total_time = stats.total_tt
+    rows = sorted(stats.stats.items(), key=lambda item : item[1][2], reverse=True)[:top]
+    print(f"profile: {total_time:.3f}s" + ("" if path is None else f", written to {path}.prof / .collapsed"))
+    print(f"{'calls':>10} {'own s':>8} {'own %':>6} {'total s':>8}  function")
+    for (filename, line, function), (_, calls, own_time, cumulative_time, _) in rows :
+        share = 100 * own_time / total_time if total_time > 0 else 0.0
+        print(f"{calls:>10} {own_time:>8.3f} {share:>5.1f}% {cumulative_time:>8.3f}  {os.path.basename(filename)}:{line}({function})")
@@ -0,0 +1,87 @@
+'''
+Opt-in counters for the search. Pass a SearchStats to SmartMoveFinder.find_best_move (stats=...) and the search
+fills it in; without one every counter is skipped behind a single None check per node.
+to_dict() / to_json() turn a finished search into one structured record.
+'''
+import json
+
+class SearchStats() :
+    def __init__(self) :
+        self.nodes_per_ply = [] # main search and quiescence nodes by distance from the root
+        self.quiescence_nodes = 0
+        self.leaf_evaluations = 0 # static evaluations (stand pat scores) of quiescence nodes
+        self.beta_cutoffs = 0 # main search nodes that failed high
+        self.first_move_cutoffs = 0 # ... on the first move searched, a measure of the move ordering
+        self.hash_cutoffs = 0 # nodes answered by the transposition table without searching
+        self.null_move_cutoffs = 0 # nodes pruned because they still failed high after passing the turn
+        self.re_searches = 0 # null window or reduced searches that beat alpha and were searched again
+        self.hash_probes = 0
+        self.hash_hits = 0
+        self.bitbase_hits = 0
+        self.iterations = [] # (depth, best move, score, nodes, seconds) of every completed iteration
+        self.nodes = 0
+        self.time = 0.0
+
+    def count_node(self, ply) :
+        nodes_per_ply = self.nodes_per_ply
+        while len(nodes_per_ply) <= ply :
+            nodes_per_ply.append(0)
+        nodes_per_ply[ply] += 1
+
+    def count_cutoff(self, moves_searched) :
+        self.beta_cutoffs += 1
+        if moves_searched == 1 :
+            self.first_move_cutoffs += 1
+
+    '''
+    Effective branching factor of every iteration after the first: its nodes over the previous iteration's nodes
+    '''
+    def branching_factors(self) :
+        nodes = self.iteration_nodes()
+        return [nodes[i] / nodes[i - 1] for i in range(1, len(nodes)) if nodes[i - 1] > 0]
+
+    '''
+    Nodes searched by each iteration on its own (the search keeps a running total)
+    '''
+    def iteration_nodes(self) :
+        nodes = []
+        previous = 0
+        for _, _, _, total, _ in self.iterations :
+            nodes.append(total - previous)
+            previous = total
+        return nodes
+
+    def to_dict(self) :
+        branching_factors = self.branching_factors()
+        iteration_nodes = self.iteration_nodes()
+        iterations = []
+        previous_time = 0.0
+        for (depth, move, score, _, seconds), nodes in zip(self.iterations, iteration_nodes) :
+            iterations.append({"depth" : depth, "move" : None if move is None else move.get_uci_notation(), "score" : score,
+                               "nodes" : nodes, "time" : round(seconds - previous_time, 6)})
+            previous_time = seconds
+        return {
+            "depth" : self.iterations[-1][0] if self.iterations else 0,
+            "nodes" : self.nodes,
+            "time" : round(self.time, 6),
+            "nps" : round(self.nodes / self.time) if self.time > 0 else 0,
+            "nodes_per_ply" : list(self.nodes_per_ply),
+            "quiescence_nodes" : self.quiescence_nodes,
+            "leaf_evaluations" : self.leaf_evaluations,
+            "beta_cutoffs" : self.beta_cutoffs,
+            "first_move_cutoffs" : self.first_move_cutoffs,
+            "first_move_cutoff_rate" : self.first_move_cutoffs / self.beta_cutoffs if self.beta_cutoffs else 0.0,
+            "effective_branching_factor" : branching_factors[-1] if branching_factors else None,
+            "branching_factors" : branching_factors,
+            "hash_probes" : self.hash_probes,
+            "hash_hits" : self.hash_hits,
+            "hash_hit_rate" : self.hash_hits / self.hash_probes if self.hash_probes else 0.0,
+            "hash_cutoffs" : self.hash_cutoffs,
+            "null_move_cutoffs" : self.null_move_cutoffs,
+            "re_searches" : self.re_searches,
+            "bitbase_hits" : self.bitbase_hits,
+            "iterations" : iterations,
+        }
+
+    def to_json(self, **kwargs) :
+        return json.dumps(self.to_dict(), **kwargs)
@@ -1,68 +1,68 @@
 from random import randint, shuffle
+import time
+from TranspositionTable import TranspositionTable, EXACT, LOWER_BOUND, UPPER_BOUND
+from Evaluation import piece_score
+import BatchEvaluation
+import Bitbases
+import OpeningBook
 
-piece_score = {"K": 0, "Q": 9, "R": 5, "N": 3, "B": 3, "p": 1}
-
-knight_scores = [[1, 1, 1, 1, 1, 1, 1, 1],
-                 [1, 2, 2, 2, 2, 2, 2, 1],
-                 [1, 2, 3, 3, 3, 3, 2, 1],
-                 [1, 2, 3, 4, 4, 3, 2, 1],
-                 [1, 2, 3, 4, 4, 3, 2, 1],
-                 [1, 2, 3, 3, 3, 3, 2, 1],
-                 [1, 2, 2, 2, 2, 2, 2, 1],
-                 [1, 1, 1, 1, 1, 1, 1, 1]]
-
-bishop_scores = [[4, 3, 2, 1, 1, 2, 3, 4],
-                 [3, 4, 3, 2, 2, 3, 4, 3],
-                 [2, 3, 4, 3, 3, 4, 3, 2],
-                 [1, 2, 3, 4, 4, 3, 2, 1],
-                 [1, 2, 3, 4, 4, 3, 2, 1],
-                 [2, 3, 4, 3, 3, 4, 3, 2],
-                 [3, 4, 3, 2, 2, 3, 4, 3],
-                 [4, 3, 2, 1, 1, 2, 3, 4]]
-
-queen_scores = [[1, 1, 1, 3, 1, 1, 1, 1],
-                [1, 2, 3, 3, 3, 1, 1, 1],
-                [1, 4, 3, 3, 3, 4, 2, 1],
-                [1, 2, 3, 3, 3, 2, 2, 1],
-                [1, 2, 3, 3, 3, 2, 2, 1],
-                [1, 4, 3, 3, 3, 4, 2, 1],
-                [1, 1, 2, 3, 3, 1, 1, 1],
-                [1, 1, 1, 3, 1, 1, 1, 1]]
-
-rook_scores = [ [4, 3, 4, 4, 4, 4, 3, 4],
-                [4, 4, 4, 4, 4, 4, 4, 4],
-                [1, 1, 2, 3, 3, 2, 1, 1],
-                [1, 2, 3, 4, 4, 3, 2, 1],
-                [1, 2, 3, 4, 4, 3, 2, 1],
-                [1, 1, 2, 2, 2, 2, 1, 1],
-                [4, 4, 4, 4, 4, 4, 4, 4],
-                [4, 3, 4, 4, 4, 4, 3, 4]]
-
-white_pawn_scores =[[10, 10, 10, 10, 10, 10, 10, 10],
-                    [8, 8, 8, 8, 8, 8, 8, 8],
-                    [5, 6, 6, 7, 7, 6, 6, 5],
-                    [2, 3, 3, 5, 5, 3, 3, 2],
-                    [1, 2, 3, 4, 4, 3, 2, 1],
-                    [1, 1, 2, 3, 3, 2, 1, 1],
-                    [1, 1, 1, 0, 0, 1, 1, 1],
-                    [0, 0, 0, 0, 0, 0, 0, 0]]
-
-black_pawn_scores =[[0, 0, 0, 0, 0, 0, 0, 0],
-                    [1, 1, 1, 0, 0, 1, 1, 1],
-                    [1, 1, 2, 3, 3, 2, 1, 1],
-                    [1, 2, 3, 4, 4, 3, 2, 1],
-                    [2, 3, 3, 5, 5, 3, 3, 2],
-                    [5, 6, 6, 7, 7, 6, 6, 5],
-                    [8, 8, 8, 8, 8, 8, 8, 8],
-                    [10, 10, 10, 10, 10, 10, 10, 10]]
-    
+CHECKMATE = 1000 # the search scores a mate CHECKMATE less the plies from the root, so a quicker mate scores higher
+STALEMATE = 0
+BITBASE_WIN = 500 # won bitbase position, below CHECKMATE so a mate the search can see is still preferred
+DEPTH = 3 # search depth when no time budget is given
+MAX_DEPTH = 64 # deepest iteration of a timed search
+MATE_THRESHOLD = CHECKMATE - 2 * MAX_DEPTH # scores at least this far from 0 are mates (quiescence can go past MAX_DEPTH)
+MOVES_TO_GO = 30 # assumed number of moves left when budgeting from the remaining clock
+TIME_CHECK_INTERVAL = 64 # nodes between clock checks
+TT_SIZE_MB = 16
+BATCH_LEAF_EVALUATION = False # score all children of depth 1 nodes in one NumPy batch (needs NumPy)
 
-piece_position_scores = {"N" : knight_scores, "B" : bishop_scores, "R" : rook_scores,
-                         "Q" : queen_scores, "bp" : black_pawn_scores, "wp" : white_pawn_scores}
+# move ordering scores - each stage gets its own band so a single sort puts the stages in order
+HASH_MOVE_SCORE = 1000000
+CAPTURE_SCORE = 100000 # plus MVV-LVA: most valuable victim first, least valuable attacker breaks ties
+KILLER_SCORES = (90000, 80000)
+HISTORY_MAX = 50000 # history scores are kept below the killer band
 
-CHECKMATE = 1000
-STALEMATE = 0
-DEPTH = 3
+# quiescence search
+DELTA_MARGIN = 2 # a capture must be able to bring the score within this much of alpha to be searched
+mvv_lva_values = {"p" : 1, "N" : 3, "B" : 3, "R" : 5, "Q" : 9, "K" : 10}
+
+# pruning and reductions, each can be switched off to measure it (e.g. Arena.py --engine2 "NULL_MOVE_PRUNING=False")
+PRINCIPAL_VARIATION_SEARCH = True # moves after the first only have to be proven no better than alpha, with a null window
+NULL_WINDOW = 0.01 # width of a null window, below the smallest step between two scores
+NULL_MOVE_PRUNING = True # a node where passing the turn still fails high isn't searched
+NULL_MOVE_REDUCTION = 2 # extra plies the null move search is shallower
+NULL_MOVE_MIN_DEPTH = 3
+LATE_MOVE_REDUCTIONS = True # quiet moves late in the ordering are searched a ply shallower first
+LMR_MIN_DEPTH = 3
+LMR_FULL_DEPTH_MOVES = 3 # moves searched at full depth before reductions start
+
+# search state
+next_move = None
+deadline = None # perf_counter time the current search has to stop by, None for no limit
+soft_deadline = None # no new iteration is started after this time, since it couldn't finish before the deadline
+stop_event = None # threading.Event another thread can set to cancel the current search
+nodes_searched = 0
+depth_completed = 0 # deepest iteration the last search finished
+search_stats = None # SearchStats the current search fills in, None when nobody asked for them
+search_iterations = [] # (depth, best move, score, nodes, seconds) of every iteration the last search finished
+probe_interior_nodes = True # False when the root is already in a bitbase ending, then only the leaves are probed
+sort_root_moves = True # False keeps the root in the order it was given (last iteration's best move first), see ParallelSearch
+killer_moves = [[None, None] for _ in range(MAX_DEPTH + 1)] # two quiet moves per ply that caused beta cutoffs (by move_id)
+history_table = {} # move_id -> how often (weighted by depth) this quiet move caused a beta cutoff
+
+# kept at module level so it survives between moves (and games) and each search starts warm
+transposition_table = TranspositionTable(TT_SIZE_MB)
+opening_book = None # OpeningBook find_best_move plays from while the position is in book (see load_opening_book)
+
+'''
+Opens a Polyglot .bin book for find_best_move to play from, or closes the current one when path is None
+'''
+def load_opening_book(path) :
+    global opening_book
+    if opening_book is not None :
+        opening_book.close()
+    opening_book = None if path is None else OpeningBook.OpeningBook(path)
 
 '''
 Picks and returns a random move
@@ -106,40 +106,432 @@ def find_random_move(valid_moves) :
     # return best_player_move
 
 '''
-Helper method to make the first recursive call to find the best move
+Raised inside the search when the time budget runs out or the search is cancelled
+'''
+class SearchTimeout(Exception) :
+    pass
+
+'''
+Called every TIME_CHECK_INTERVAL nodes, raises SearchTimeout when the search has to stop
+'''
+def check_search_limits() :
+    if (deadline is not None and time.perf_counter() > deadline) or (stop_event is not None and stop_event.is_set()) :
+        raise SearchTimeout()
+
+'''
+Starts the clock of the current search: it stops after budget seconds from now (None for no limit)
+Can be called from another thread while a search runs, e.g. when a ponder search becomes the real one
+'''
+def set_time_budget(budget) :
+    global deadline, soft_deadline
+    if budget is None :
+        deadline = soft_deadline = None
+    else :
+        now = time.perf_counter()
+        # the next iteration takes several times longer than this one, so don't start it past half the budget
+        soft_deadline = now + budget / 2
+        deadline = now + budget
+
+'''
+Works out how many seconds to spend on this move from a fixed move time or from the remaining clock plus increment
+Returns None when no time limit was given
 '''
-def find_best_move(gs, valid_moves) :
-    global next_move
-    next_move = None
-    find_move_nega_max_alpha_beta(gs, valid_moves, DEPTH, -CHECKMATE, CHECKMATE, 1 if gs.white_to_move else -1)
-    return next_move
+def allocate_time(move_time=None, time_left=None, increment=0) :
+    if move_time is not None :
+        return move_time
+    if time_left is not None :
+        # never plan to use more than half the clock, however large the increment
+        return max(0.01, min(time_left / MOVES_TO_GO + increment, time_left / 2))
+    return None
+
+'''
+Searches the position with iterative deepening and returns the best move
+Without a time budget it searches to max_depth (DEPTH by default). With move_time (seconds) or the
+remaining clock (time_left and increment in seconds) it deepens until the budget runs out and returns
+the best move of the last completed iteration
+Setting cancel_event (a threading.Event) from another thread stops the search the same way running out of time does
+on_iteration is called with (depth, best move, score, nodes, seconds) after every completed iteration
+Passing a SearchStats as stats turns on the search counters, it holds them once the search returns
+'''
+def find_best_move(gs, valid_moves, max_depth=None, move_time=None, time_left=None, increment=0, cancel_event=None,
+                   on_iteration=None, stats=None) :
+    global next_move, nodes_searched, stop_event, depth_completed, probe_interior_nodes, search_stats
+    stop_event = cancel_event
+    search_stats = stats
+    depth_completed = 0
+    search_iterations.clear()
+    budget = allocate_time(move_time, time_left, increment)
+    if max_depth is None :
+        max_depth = DEPTH if budget is None else MAX_DEPTH
+    start_time = time.perf_counter()
+    set_time_budget(budget)
+    nodes_searched = 0
+    if opening_book is not None :
+        book_move = opening_book.choose_move(gs, valid_moves)
+        if book_move is not None : # still in book, no need to search
+            return book_move
+    transposition_table.new_search()
+    # once the game is in a bitbase ending every node would be an instant win or draw with nothing to tell
+    # the moves apart, so let the search look ahead for the mate and score the leaves with the bitbases
+    probe_interior_nodes = gs.piece_count > Bitbases.MAX_PIECES
+    for killers in killer_moves :
+        killers[0] = killers[1] = None
+    for move_id in history_table : # keep some history from the last search but let the new one dominate
+        history_table[move_id] //= 2
+
+    root_moves = list(valid_moves)
+    best_move = root_moves[0] if root_moves else None # always have a move ready, even if the first iteration is cut off
+    root_ply = len(gs.move_log)
+    for depth in range(1, max_depth + 1) :
+        next_move = None
+        try :
+            score = find_move_nega_max_alpha_beta(gs, root_moves, depth, -CHECKMATE, CHECKMATE, 1 if gs.white_to_move else -1)
+        except SearchTimeout :
+            while len(gs.move_log) > root_ply : # unwind the moves the aborted search left on the board
+                gs.undo_move()
+            break
+        depth_completed = depth
+        if next_move is not None :
+            best_move = next_move
+            # search this iteration's best move first in the next one
+            root_moves.remove(best_move)
+            root_moves.insert(0, best_move)
+        search_iterations.append((depth, best_move, score, nodes_searched, time.perf_counter() - start_time))
+        if on_iteration is not None :
+            on_iteration(*search_iterations[-1])
+        if stats is not None :
+            stats.iterations.append(search_iterations[-1])
+        if abs(score) >= MATE_THRESHOLD : # forced mate found, searching deeper won't change the move
+            break
+        if soft_deadline is not None and time.perf_counter() > soft_deadline :
+            break
+        if stop_event is not None and stop_event.is_set() :
+            break
+    if stats is not None :
+        stats.nodes = nodes_searched
+        stats.time = time.perf_counter() - start_time
+        stats.hash_probes = transposition_table.probes
+        stats.hash_hits = transposition_table.hits
+    return best_move
 
 '''
 Find the best move using the nega max alpha beta pruning algorithm
+valid_moves is only given at the root, every other node generates its moves in stages after the hash table probe
+The first move gets the full window, the others a null window and a re-search if they beat alpha (principal
+variation search), late quiet moves are reduced a ply and nodes that fail high after a null move are pruned
+null_move_allowed is False right after a null move, so two never follow each other
 '''
-def find_move_nega_max_alpha_beta(gs, valid_moves, depth, alpha, beta, turn_multiplier) :
-    global next_move
+def find_move_nega_max_alpha_beta(gs, valid_moves, depth, alpha, beta, turn_multiplier, ply=0, static_score=None,
+                                  null_move_allowed=True) :
+    global next_move, nodes_searched
+    nodes_searched += 1
+    if nodes_searched % TIME_CHECK_INTERVAL == 0 :
+        check_search_limits()
+    stats = search_stats
+    if stats is not None :
+        stats.count_node(ply)
+    if ply > 0 and probe_interior_nodes and gs.piece_count <= Bitbases.MAX_PIECES :
+        bitbase_score = probe_bitbases(gs)
+        if bitbase_score is not None :
+            if stats is not None :
+                stats.bitbase_hits += 1
+            return bitbase_score
     if depth == 0 :
-        return turn_multiplier * score_board(gs)
+        return quiescence_search(gs, alpha, beta, turn_multiplier, ply, static_score)
+
+    # a stored result that is deep enough can replace this search (the root always searches to pick next_move)
+    original_alpha = alpha
+    hash_move_id = None
+    entry = transposition_table.probe(gs.zobrist_key)
+    if entry is not None :
+        entry_depth, flag, entry_score, hash_move_id = entry
+        entry_score = score_from_table(entry_score, ply)
+        if entry_depth >= depth and ply > 0 :
+            if flag == EXACT :
+                if stats is not None :
+                    stats.hash_cutoffs += 1
+                return entry_score
+            elif flag == LOWER_BOUND :
+                alpha = max(alpha, entry_score)
+            else :
+                beta = min(beta, entry_score)
+            if alpha >= beta :
+                if stats is not None :
+                    stats.hash_cutoffs += 1
+                return entry_score
+
+    in_check = False
+    if (NULL_MOVE_PRUNING and depth >= NULL_MOVE_MIN_DEPTH) or (LATE_MOVE_REDUCTIONS and depth >= LMR_MIN_DEPTH) :
+        king_row, king_col = gs.white_king_loc if gs.white_to_move else gs.black_king_loc
+        in_check = gs.square_under_attack(king_row, king_col)
+    # if the opponent can't bring the score below beta even when we pass, a real move would fail high too
+    # Passing isn't legal in check, and with only pawns left zugzwang is common, so the null move would be wrong there
+    if (NULL_MOVE_PRUNING and null_move_allowed and ply > 0 and depth >= NULL_MOVE_MIN_DEPTH and not in_check
+            and beta < MATE_THRESHOLD and turn_multiplier * score_board(gs) >= beta and gs.has_non_pawn_material()) :
+        null_score = search_null_move(gs, depth, beta, turn_multiplier, ply)
+        if null_score >= beta :
+            if stats is not None :
+                stats.null_move_cutoffs += 1
+            return beta if null_score >= MATE_THRESHOLD else null_score # a mate found after passing isn't a real one
 
-    # move ordering - implement later
     max_score = -CHECKMATE
-    for move in valid_moves :
+    best_move = None
+    if valid_moves is None :
+        ordered_moves = gs.generate_moves(hash_move_id, lambda stage, captures : order_stage(stage, captures, ply))
+    elif sort_root_moves :
+        ordered_moves = order_moves(valid_moves, hash_move_id, ply)
+    else :
+        ordered_moves = valid_moves
+    child_scores = None
+    if depth == 1 and BATCH_LEAF_EVALUATION and BatchEvaluation.NUMPY_AVAILABLE :
+        ordered_moves = list(ordered_moves) # the batch needs every child up front
+        child_scores = score_children_in_batch(gs, ordered_moves)
+    killers = killer_moves[ply] if ply < len(killer_moves) else (None, None)
+    moves_searched = 0
+    for i, move in enumerate(ordered_moves) :
+        moves_searched += 1
         gs.make_move(move)
-        next_moves = gs.get_valid_moves()
-        score = -find_move_nega_max_alpha_beta(gs, next_moves, depth - 1, -beta, -alpha, -turn_multiplier)
+        child_score = None if child_scores is None else child_scores[i]
+        if moves_searched == 1 :
+            score = -find_move_nega_max_alpha_beta(gs, None, depth - 1, -beta, -alpha, -turn_multiplier, ply + 1, child_score)
+        else :
+            reduction = 0
+            if (LATE_MOVE_REDUCTIONS and depth >= LMR_MIN_DEPTH and moves_searched > LMR_FULL_DEPTH_MOVES and not in_check
+                    and move.piece_captured == '--' and not move.is_pawn_promotion and move.move_id not in killers
+                    and not gives_check(gs)) :
+                reduction = 1
+            window = min(beta, alpha + NULL_WINDOW) if PRINCIPAL_VARIATION_SEARCH else beta
+            score = -find_move_nega_max_alpha_beta(gs, None, depth - 1 - reduction, -window, -alpha, -turn_multiplier, ply + 1,
+                                                   child_score)
+            if reduction and score > alpha : # the reduced search didn't show the move is worse, look at it properly
+                if stats is not None :
+                    stats.re_searches += 1
+                score = -find_move_nega_max_alpha_beta(gs, None, depth - 1, -window, -alpha, -turn_multiplier, ply + 1,
+                                                       child_score)
+            if window < beta and alpha < score < beta : # beat alpha on the null window, get its exact score
+                if stats is not None :
+                    stats.re_searches += 1
+                score = -find_move_nega_max_alpha_beta(gs, None, depth - 1, -beta, -alpha, -turn_multiplier, ply + 1,
+                                                       child_score)
         if score > max_score :
             max_score = score
-            if depth == DEPTH :
+            best_move = move
+            if ply == 0 :
                 next_move = move
         gs.undo_move()
 
         if max_score > alpha : # PRUNING
             alpha = max_score
         if alpha >= beta :
+            if move.piece_captured == '--' and not move.is_pawn_promotion :
+                update_quiet_move_heuristics(move, depth, ply)
+            if stats is not None :
+                stats.count_cutoff(moves_searched)
             break
+    if moves_searched == 0 : # checkmate or stalemate, the move generator told which
+        return -CHECKMATE + ply if gs.check_mate else turn_multiplier * score_board(gs)
+
+    if max_score <= original_alpha :
+        flag = UPPER_BOUND
+    elif max_score >= beta :
+        flag = LOWER_BOUND
+    else :
+        flag = EXACT
+    transposition_table.store(gs.zobrist_key, depth, flag, score_to_table(max_score, ply),
+                              best_move.move_id if best_move is not None else None)
     return max_score
 
+'''
+A mate score counts plies from the root but the table entry can be found again at another ply, so the table
+stores mates counted from the entry's own position. score_to_table converts a score for storing, score_from_table back
+'''
+def score_to_table(score, ply) :
+    if score >= MATE_THRESHOLD :
+        return score + ply
+    if score <= -MATE_THRESHOLD :
+        return score - ply
+    return score
+
+def score_from_table(score, ply) :
+    if score >= MATE_THRESHOLD :
+        return score - ply
+    if score <= -MATE_THRESHOLD :
+        return score + ply
+    return score
+
+'''
+Score of the position after passing the turn, from a null window search NULL_MOVE_REDUCTION plies shallower than usual
+The null move isn't in the move log, so when the search runs out of time the moves above it are taken back here first
+'''
+def search_null_move(gs, depth, beta, turn_multiplier, ply) :
+    log_length = len(gs.move_log)
+    previous_enpassant = gs.make_null_move()
+    try :
+        score = -find_move_nega_max_alpha_beta(gs, None, max(0, depth - 1 - NULL_MOVE_REDUCTION), -beta, -beta + NULL_WINDOW,
+                                               -turn_multiplier, ply + 1, null_move_allowed=False)
+    except SearchTimeout :
+        while len(gs.move_log) > log_length :
+            gs.undo_move()
+        gs.undo_null_move(previous_enpassant)
+        raise
+    gs.undo_null_move(previous_enpassant)
+    return score
+
+'''
+If the move just made puts the opponent (now the side to move) in check
+'''
+def gives_check(gs) :
+    king_row, king_col = gs.white_king_loc if gs.white_to_move else gs.black_king_loc
+    return gs.square_under_attack(king_row, king_col)
+
+'''
+Searches only captures and promotions past the horizon until the position is quiet, so the search
+doesn't stop in the middle of an exchange. The side to move can always "stand pat" on the static
+score instead of capturing, and captures that can't raise the score near alpha are skipped (delta pruning)
+When in check every evasion is searched since standing pat isn't an option
+Only captures are generated when not in check, so a stalemate past the horizon is scored like any quiet position
+'''
+def quiescence_search(gs, alpha, beta, turn_multiplier, ply, static_score=None) :
+    global nodes_searched
+    nodes_searched += 1
+    if nodes_searched % TIME_CHECK_INTERVAL == 0 :
+        check_search_limits()
+    stats = search_stats
+    if stats is not None :
+        stats.count_node(ply)
+        stats.quiescence_nodes += 1
+    if gs.piece_count <= Bitbases.MAX_PIECES :
+        bitbase_score = probe_bitbases(gs)
+        if bitbase_score is not None :
+            if stats is not None :
+                stats.bitbase_hits += 1
+            return bitbase_score
+    moves = gs.generate_moves(order=lambda stage, captures : order_stage(stage, captures, ply), captures_only=True)
+    in_check = gs.in_check # read now, searching the children overwrites it
+    if in_check :
+        max_score = -CHECKMATE
+    else :
+        # static_score is the board score when the caller already worked it out in a batch
+        stand_pat = turn_multiplier * (score_board(gs) if static_score is None else static_score)
+        if stats is not None :
+            stats.leaf_evaluations += 1
+        if stand_pat >= beta :
+            return stand_pat
+        # even winning a queen (or promoting) can't bring the score up to alpha
+        if stand_pat + piece_score["Q"] + DELTA_MARGIN < alpha :
+            return stand_pat
+        max_score = stand_pat
+        if stand_pat > alpha :
+            alpha = stand_pat
+
+    moves_searched = 0
+    for move in moves :
+        moves_searched += 1
+        if not in_check and not move.is_pawn_promotion and stand_pat + piece_score[move.piece_captured[1]] + DELTA_MARGIN < alpha :
+            continue # delta pruning
+        gs.make_move(move)
+        score = -quiescence_search(gs, -beta, -alpha, -turn_multiplier, ply + 1)
+        gs.undo_move()
+        if score > max_score :
+            max_score = score
+            if score > alpha :
+                alpha = score
+                if alpha >= beta :
+                    break
+    if in_check and moves_searched == 0 : # checkmate
+        return -CHECKMATE + ply
+    return max_score
+
+'''
+Exact score of a position the endgame bitbases cover, from the side to move's point of view (None if not covered)
+Won positions also get a small mop-up bonus so the search makes progress towards mate
+Positions in check are left to the search so it still sees the checkmates
+'''
+def probe_bitbases(gs) :
+    king_row, king_col = gs.white_king_loc if gs.white_to_move else gs.black_king_loc
+    if gs.square_under_attack(king_row, king_col) :
+        return None
+    result = Bitbases.probe(gs)
+    if result is None :
+        return None
+    if result == 0 :
+        return STALEMATE
+    return result * (BITBASE_WIN + Bitbases.mop_up(gs))
+
+'''
+Scores the position after each move in one NumPy batch and returns the board scores (white positive)
+The children are encoded from the parent's board and the moves' squares, none of the moves is played
+'''
+def score_children_in_batch(gs, moves) :
+    codes = BatchEvaluation.encode_children(BatchEvaluation.encode_board(gs.board), moves)
+    return BatchEvaluation.score_positions(codes).tolist()
+
+'''
+Returns the moves sorted so the most promising are searched first (which makes alpha beta prune more):
+the hash move, then captures by MVV-LVA, then the killer moves of this ply, then quiet moves by history score
+Used for a whole move list (the root), the other nodes sort each stage on its own with order_stage
+'''
+def order_moves(moves, hash_move_id, ply) :
+    killers = killer_moves[ply] if ply < len(killer_moves) else (None, None)
+    scored_moves = []
+    for move in moves :
+        move_id = move.move_id
+        if move_id == hash_move_id :
+            score = HASH_MOVE_SCORE
+        elif move.piece_captured != '--' or move.is_pawn_promotion :
+            score = CAPTURE_SCORE + mvv_lva_score(move)
+        elif move_id == killers[0] :
+            score = KILLER_SCORES[0]
+        elif move_id == killers[1] :
+            score = KILLER_SCORES[1]
+        else :
+            score = history_table.get(move_id, 0)
+        scored_moves.append((score, move))
+    scored_moves.sort(key=lambda scored_move : scored_move[0], reverse=True)
+    return [move for _, move in scored_moves]
+
+'''
+Sorts one stage of GameState.generate_moves. The stages are already split, so captures are sorted by MVV-LVA
+and quiet moves by killers and history without looking at the pieces of a quiet move
+'''
+def order_stage(moves, captures, ply) :
+    if captures :
+        moves.sort(key=mvv_lva_score, reverse=True)
+        return moves
+    killers = killer_moves[ply] if ply < len(killer_moves) else (None, None)
+    first_killer, second_killer = killers
+    history = history_table
+    def quiet_move_score(move) :
+        move_id = move.move_id
+        if move_id == first_killer :
+            return KILLER_SCORES[0]
+        if move_id == second_killer :
+            return KILLER_SCORES[1]
+        return history.get(move_id, 0)
+    moves.sort(key=quiet_move_score, reverse=True)
+    return moves
+
+'''
+Most valuable victim first, least valuable attacker breaks ties. Promotions without a capture come last
+'''
+def mvv_lva_score(move) :
+    piece_captured = move.piece_captured
+    if piece_captured == '--' :
+        return 0
+    return 10 * mvv_lva_values[piece_captured[1]] - mvv_lva_values[move.piece_moved[1]]
+
+'''
+Remembers a quiet move that caused a beta cutoff as a killer for this ply and in the history table
+'''
+def update_quiet_move_heuristics(move, depth, ply) :
+    move_id = move.move_id
+    if ply < len(killer_moves) :
+        killers = killer_moves[ply]
+        if killers[0] != move_id :
+            killers[1] = killers[0]
+            killers[0] = move_id
+    history_table[move_id] = min(HISTORY_MAX, history_table.get(move_id, 0) + depth * depth)
+
 '''
 A Positive score is good for white, a negative score is good for black
 '''
@@ -152,22 +544,5 @@ def score_board(gs) :
     elif gs.stale_mate :
         return STALEMATE
     
-    score = 0
-    for row in range(len(gs.board)) :
-        for col in range(len(gs.board[row])) :
-            square = gs.board[row][col]
-            if square != '--' :
-                piece_position_score = 0
-                # score it positionally
-                if square[1] != "K" : # no position table for king
-                    if square[1] == 'p' : # for pawns
-                        piece_position_score = piece_position_scores[square][row][col]
-                    else : # for other pieces
-                        piece_position_score = piece_position_scores["N"][row][col]
-
-                if square[0] == 'w' :
-                    score += piece_score[square[1]] + piece_position_score * .1
-                elif square[0] == 'b' :
-                    score -= piece_score[square[1]] + piece_position_score * .1
-
-    return score
\ No newline at end of file
+    # material and piece square score, kept up to date by make_move/undo_move in tenths of a pawn
+    return gs.board_score / 10
\ No newline at end of file
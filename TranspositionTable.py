@@ -0,0 +1,108 @@
+'''
+Size-bounded transposition table for the search, keyed by GameState.zobrist_key.
+Entries live in one flat array of 64 bit words so the memory use is fixed up front.
+Every bucket holds two entries: a depth-preferred slot that keeps the deepest result,
+and an always-replace slot that takes everything the depth-preferred slot turns down.
+The array can live in a buffer shared between processes (see ParallelSearch). Each entry stores
+key XOR data in its key word, so an entry half written by another process fails the key check
+instead of returning a wrong result.
+'''
+
+EXACT = 0 # score is the exact value of the position
+LOWER_BOUND = 1 # search failed high, the real score is at least this
+UPPER_BOUND = 2 # search failed low, the real score is at most this
+
+WORDS_PER_ENTRY = 2 # [key, data]
+ENTRY_SIZE = WORDS_PER_ENTRY * 8 # bytes
+ENTRIES_PER_BUCKET = 2 # [depth-preferred, always-replace]
+
+# data word layout: score (32 bits) | move id + 1 (16 bits) | depth (8 bits) | flag (2 bits) | age (6 bits)
+SCORE_SCALE = 1000 # scores are stored as fixed point numbers since evaluations are floats
+SCORE_OFFSET = 1 << 31
+MOVE_SHIFT = 32
+DEPTH_SHIFT = 48
+FLAG_SHIFT = 56
+AGE_SHIFT = 58
+AGE_MASK = 0x3F
+
+class TranspositionTable() :
+    '''
+    buffer is an optional writable buffer (e.g. SharedMemory.buf) of at least buffer_size(size_mb) bytes to keep the entries in
+    '''
+    def __init__(self, size_mb=16, buffer=None) :
+        if size_mb <= 0 :
+            raise ValueError(f"Transposition table size must be positive, got {size_mb} MB")
+        self.size_mb = size_mb
+        self.num_buckets = bucket_count(size_mb)
+        if buffer is None :
+            buffer = bytearray(buffer_size(size_mb))
+        elif len(buffer) < buffer_size(size_mb) :
+            raise ValueError(f"Buffer of {len(buffer)} bytes is too small for a {size_mb} MB transposition table")
+        self.table = memoryview(buffer)[:buffer_size(size_mb)].cast('Q')
+        self.age = 0
+        self.hits = 0
+        self.probes = 0
+
+    '''
+    Empties the table
+    '''
+    def clear(self) :
+        self.table[:] = memoryview(bytearray(len(self.table) * 8)).cast('Q') # in place, so a shared buffer is cleared for everyone
+        self.age = 0
+        self.hits = self.probes = 0
+
+    '''
+    Called once per search so entries from older searches get replaced first
+    '''
+    def new_search(self) :
+        self.age = (self.age + 1) & AGE_MASK
+        self.hits = self.probes = 0
+
+    '''
+    Looks up a position. Returns (depth, flag, score, move_id) or None if the position isn't stored
+    move_id is None when no best move was stored
+    '''
+    def probe(self, key) :
+        self.probes += 1
+        table = self.table
+        index = (key % self.num_buckets) * ENTRIES_PER_BUCKET * WORDS_PER_ENTRY
+        for i in (index, index + WORDS_PER_ENTRY) :
+            data = table[i + 1]
+            if table[i] ^ data == key :
+                if data == 0 : # empty slot whose key happens to be 0
+                    continue
+                self.hits += 1
+                move_id = ((data >> MOVE_SHIFT) & 0xFFFF) - 1
+                return ((data >> DEPTH_SHIFT) & 0xFF, (data >> FLAG_SHIFT) & 0x3,
+                        ((data & 0xFFFFFFFF) - SCORE_OFFSET) / SCORE_SCALE, move_id if move_id >= 0 else None)
+        return None
+
+    '''
+    Stores a search result. The depth-preferred slot is replaced by deeper (or equally deep) results,
+    results from the same position and entries left over from older searches; everything else goes to the always-replace slot
+    '''
+    def store(self, key, depth, flag, score, move_id=None) :
+        table = self.table
+        index = (key % self.num_buckets) * ENTRIES_PER_BUCKET * WORDS_PER_ENTRY
+        data = ((int(round(score * SCORE_SCALE)) + SCORE_OFFSET) | ((0 if move_id is None else move_id + 1) << MOVE_SHIFT) |
+                (depth << DEPTH_SHIFT) | (flag << FLAG_SHIFT) | (self.age << AGE_SHIFT))
+        stored = table[index + 1]
+        if (table[index] ^ stored == key or stored == 0 or depth >= (stored >> DEPTH_SHIFT) & 0xFF
+                or (stored >> AGE_SHIFT) & AGE_MASK != self.age) :
+            table[index] = key ^ data
+            table[index + 1] = data
+        else :
+            table[index + WORDS_PER_ENTRY] = key ^ data
+            table[index + WORDS_PER_ENTRY + 1] = data
+
+'''
+Number of buckets a table of size_mb megabytes holds
+'''
+def bucket_count(size_mb) :
+    return max(1, int(size_mb * 1024 * 1024) // (ENTRY_SIZE * ENTRIES_PER_BUCKET))
+
+'''
+Bytes needed for the entries of a table of size_mb megabytes
+'''
+def buffer_size(size_mb) :
+    return bucket_count(size_mb) * ENTRIES_PER_BUCKET * ENTRY_SIZE
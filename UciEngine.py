@@ -0,0 +1,252 @@
+'''
+Headless UCI (Universal Chess Interface) front end, so GUIs and tournament managers such as cutechess-cli
+can run the engine over stdin/stdout without the pygame window.
+The search runs on a background thread, so stop, isready and ponderhit are answered while it is thinking.
+With pondering on, the engine keeps searching the position after its expected reply on the opponent's time:
+a ponderhit turns that search into the real one and starts its clock, so the time already spent counts as extra depth.
+
+Usage:
+    python UciEngine.py
+'''
+import sys
+import threading
+import ChessEngine, SmartMoveFinder, Bitbases
+from TranspositionTable import TranspositionTable
+
+ENGINE_NAME = "ChessEngine"
+ENGINE_AUTHOR = "the ChessEngine authors"
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+MAX_HASH_MB = 1024
+
+class UciEngine() :
+    def __init__(self, output=sys.stdout) :
+        self.output = output
+        self.output_lock = threading.Lock() # the search thread writes info and bestmove lines too
+        self.fen = START_FEN
+        self.moves = [] # UCI notation of the moves played from fen
+        self.search_thread = None
+        self.cancel_event = None # set to abort the running search
+        self.release_event = None # set by stop/ponderhit: a ponder or infinite search may not answer before that
+        self.ponder_budget = None # seconds the current ponder search gets once ponderhit arrives
+        self.ponder_depth = None # without a budget, the depth the ponder search stops at once ponderhit arrives
+        self.stop_timer = None
+        self.ponder = False # UCI option, the GUI tells us whether we may ponder
+        Bitbases.load()
+
+    def send(self, line) :
+        with self.output_lock :
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    '''
+    Reads commands from input until quit (or the end of the input)
+    '''
+    def run(self, input=sys.stdin) :
+        for line in input :
+            if not self.handle(line) :
+                break
+        self.stop_search()
+
+    '''
+    Handles one command line, returns False on quit
+    '''
+    def handle(self, line) :
+        tokens = line.split()
+        if not tokens :
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == "uci" :
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHOR}")
+            self.send(f"option name Hash type spin default {SmartMoveFinder.TT_SIZE_MB} min 1 max {MAX_HASH_MB}")
+            self.send("option name Ponder type check default false")
+            self.send("uciok")
+        elif command == "isready" :
+            self.send("readyok")
+        elif command == "setoption" :
+            self.set_option(args)
+        elif command == "ucinewgame" :
+            self.stop_search()
+            SmartMoveFinder.transposition_table.clear()
+            SmartMoveFinder.history_table.clear()
+        elif command == "position" :
+            self.stop_search()
+            self.set_position(args)
+        elif command == "go" :
+            self.stop_search()
+            self.go(args)
+        elif command == "stop" :
+            self.stop_search()
+        elif command == "ponderhit" :
+            self.ponderhit()
+        elif command == "quit" :
+            return False
+        return True
+
+    '''
+    setoption name <name> [value <value>]
+    '''
+    def set_option(self, args) :
+        if "name" not in args :
+            return
+        value_index = args.index("value") if "value" in args else len(args)
+        name = " ".join(args[args.index("name") + 1 : value_index]).lower()
+        value = " ".join(args[value_index + 1:])
+        if name == "hash" :
+            self.stop_search()
+            SmartMoveFinder.transposition_table = TranspositionTable(max(1, min(int(value), MAX_HASH_MB)))
+        elif name == "ponder" :
+            self.ponder = value.lower() == "true"
+
+    '''
+    position [startpos | fen <fen>] [moves <move> ...]
+    '''
+    def set_position(self, args) :
+        moves_index = args.index("moves") if "moves" in args else len(args)
+        if args and args[0] == "fen" :
+            self.fen = " ".join(args[1:moves_index])
+        else :
+            self.fen = START_FEN
+        self.moves = args[moves_index + 1:]
+
+    '''
+    Sets up the position of the last position command, raises ValueError for a move that isn't legal
+    The engine only promotes to a queen, so an underpromotion is played as the queen promotion (and said so)
+    '''
+    def create_game_state(self) :
+        gs = ChessEngine.GameState(self.fen)
+        for notation in self.moves :
+            if len(notation) == 5 and notation[4] in "rbn" :
+                self.send(f"info string underpromotion {notation} is played as {notation[:4]}q, the engine only promotes to a queen")
+                notation = notation[:4] + "q"
+            move = next((move for move in gs.get_valid_moves() if move.get_uci_notation() == notation), None)
+            if move is None :
+                raise ValueError(f"Illegal move in position command: {notation}")
+            gs.make_move(move)
+        return gs
+
+    '''
+    go [ponder] [infinite] [depth <plies>] [movetime <ms>] [wtime <ms>] [btime <ms>] [winc <ms>] [binc <ms>]
+    '''
+    def go(self, args) :
+        limits = {}
+        for i, token in enumerate(args[:-1]) :
+            if token in ("depth", "movetime", "wtime", "btime", "winc", "binc") :
+                limits[token] = int(args[i + 1])
+        try :
+            gs = self.create_game_state()
+        except ValueError as error :
+            self.send(f"info string {error}")
+            self.send("bestmove 0000")
+            return
+        white = gs.white_to_move
+        max_depth = limits.get("depth")
+        move_time = limits["movetime"] / 1000 if "movetime" in limits else None
+        time_left = limits.get("wtime" if white else "btime")
+        time_left = None if time_left is None else time_left / 1000
+        increment = limits.get("winc" if white else "binc", 0) / 1000
+
+        pondering = "ponder" in args
+        infinite = "infinite" in args
+        self.ponder_depth = None
+        if pondering :
+            # search without a clock until ponderhit tells us the opponent played the expected move
+            self.ponder_budget = SmartMoveFinder.allocate_time(move_time, time_left, increment)
+            if self.ponder_budget is None and max_depth is None : # after ponderhit stop where a plain go would
+                self.ponder_depth = SmartMoveFinder.DEPTH
+            max_depth, move_time, time_left = max_depth or SmartMoveFinder.MAX_DEPTH, None, None
+        elif infinite :
+            max_depth, move_time, time_left = SmartMoveFinder.MAX_DEPTH, None, None
+        self.cancel_event = threading.Event()
+        self.release_event = threading.Event()
+        if not (pondering or infinite) :
+            self.release_event.set()
+        self.search_thread = threading.Thread(target=self.search, daemon=True,
+                                              args=(gs, max_depth, move_time, time_left, increment, self.cancel_event, self.release_event))
+        self.search_thread.start()
+
+    '''
+    Runs on the search thread: searches, waits for stop/ponderhit if the GUI asked for that, and sends the best move
+    '''
+    def search(self, gs, max_depth, move_time, time_left, increment, cancel_event, release_event) :
+        valid_moves = gs.get_valid_moves()
+        move = None
+        if valid_moves :
+            move = SmartMoveFinder.find_best_move(gs, valid_moves, max_depth, move_time, time_left, increment,
+                                                  cancel_event=cancel_event, on_iteration=self.finish_iteration)
+        release_event.wait()
+        if move is None :
+            self.send("bestmove 0000")
+            return
+        reply = self.expected_reply(gs, move) if self.ponder else None
+        self.send(f"bestmove {move.get_uci_notation()}" + ("" if reply is None else f" ponder {reply.get_uci_notation()}"))
+
+    '''
+    Runs on the search thread after every iteration: reports it, and ends a ponder search that has no clock
+    once ponderhit has arrived and the search is as deep as a plain go would go
+    '''
+    def finish_iteration(self, depth, move, score, nodes, seconds) :
+        self.send_info(depth, move, score, nodes, seconds)
+        if self.ponder_depth is not None and depth >= self.ponder_depth and self.release_event.is_set() :
+            self.cancel_event.set()
+
+    '''
+    Reports a finished iteration to the GUI
+    '''
+    def send_info(self, depth, move, score, nodes, seconds) :
+        if abs(score) >= SmartMoveFinder.MATE_THRESHOLD : # a mate score is CHECKMATE less the plies to the mate
+            mate_moves = (int(round(SmartMoveFinder.CHECKMATE - abs(score))) + 1) // 2
+            score_text = f"mate {mate_moves if score > 0 else -mate_moves}"
+        else :
+            score_text = f"cp {int(round(score * 100))}"
+        self.send(f"info depth {depth} score {score_text} nodes {nodes} nps {int(nodes / seconds) if seconds > 0 else 0} "
+                  f"time {int(seconds * 1000)} pv {move.get_uci_notation()}")
+
+    '''
+    The opponent's reply to move the transposition table expects, None if it doesn't know one
+    '''
+    def expected_reply(self, gs, move) :
+        gs.make_move(move)
+        entry = SmartMoveFinder.transposition_table.probe(gs.zobrist_key)
+        replies = gs.get_valid_moves()
+        gs.undo_move()
+        if entry is None or entry[3] is None :
+            return None
+        return next((reply for reply in replies if reply.move_id == entry[3]), None)
+
+    '''
+    The opponent played the move we were pondering on: from now on the search runs on our clock
+    '''
+    def ponderhit(self) :
+        if self.search_thread is None or self.release_event.is_set() :
+            return
+        if self.ponder_budget is not None :
+            SmartMoveFinder.set_time_budget(self.ponder_budget)
+            # backstop in case the search thread hadn't started its own clock yet when the budget was set
+            self.stop_timer = threading.Timer(self.ponder_budget, self.cancel_event.set)
+            self.stop_timer.daemon = True
+            self.stop_timer.start()
+        self.release_event.set()
+        # set after the release, so either this or finish_iteration sees the search is deep enough
+        if self.ponder_depth is not None and SmartMoveFinder.depth_completed >= self.ponder_depth :
+            self.cancel_event.set()
+
+    '''
+    Stops a running search and waits for its thread, which sends the bestmove line
+    '''
+    def stop_search(self) :
+        if self.search_thread is None :
+            return
+        self.cancel_event.set()
+        self.release_event.set()
+        self.search_thread.join()
+        self.search_thread = None
+        if self.stop_timer is not None :
+            self.stop_timer.cancel()
+            self.stop_timer = None
+
+def main() :
+    UciEngine().run()
+
+if __name__ == "__main__" :
+    main()